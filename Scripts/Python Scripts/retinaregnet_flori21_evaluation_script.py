@@ -1,16 +1,27 @@
 import os
 import sys
 import gc
+import hashlib
 import cv2
+import math
+import multiprocessing
 import random
+import atexit
+import queue
+import threading
 import shutil
+import tempfile
 import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from PIL import Image
 from random import sample
 from pyunpack import Archive
 import matplotlib.pyplot as plt
 from matplotlib.colors import ListedColormap
-from scipy.ndimage import map_coordinates
+from matplotlib.collections import EllipseCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 import torch
 import torch.nn as nn
@@ -22,7 +33,23 @@ from diffusers.models.unet_2d_condition import UNet2DConditionModel
 from diffusers import DDIMScheduler
 from diffusers import StableDiffusionPipeline
 
-img_size= 1024 # input image resolution for image registration, tried with 512 on a trial run with T4 GPU in Colab.
+img_size= 1024 # input image resolution (side length, or (height, width) for non-square frames) for image registration, tried with 512 on a trial run with T4 GPU in Colab.
+warp_tolerance = 0.05 # worst-case error (px) accepted from the coarse-grid polynomial warp field, None for exact evaluation
+polynomial_loss = 'huber' # robust loss of the stage-2 IRLS polynomial fit ('huber' or 'tukey'), None for ordinary least squares
+irls_min_matches = 50 # stage-2 matches from which the IRLS fit is trusted without retrying the featurization
+retry_min_score = 0.05 # featurization retries predicted to succeed below this score are skipped, None to always retry
+persistent_featurizer = True # keep the Stable Diffusion featurizer loaded between calls instead of reloading it for every image pair
+feature_compression = None # channel reduction of the diffusion features before matching: 'pca', 'random' or None
+feature_channels = 64 # channels kept by feature_compression
+fov_crop = True # featurize only the bounding box of the retinal field of view and match only inside the field of view
+case_workers = 2 # processes finishing earlier cases (warps, figures, errors) while the featurizer runs the next one, 0 for serial
+writer_workers = 2 # threads writing figures and PNG files in the background, 0 to write them synchronously
+writer_queue_size = 8 # queued writes from which the pipeline waits for the disk
+show_figures = True # display the figures (pyplot) as well as saving them; figures of case_workers processes are never shown
+fast_render = False # draw the correspondence figures with OpenCV instead of matplotlib, for headless runs
+output_level = 'full' # results written per case: 'metrics', 'transforms', 'thumbnails' or 'full' (see OUTPUT_LEVELS)
+thumbnail_size = 512 # longest side of the PNG images written at the 'thumbnails' output level
+case_prefetch = True # decode the next case and sample its points in a background thread while the featurizer runs the current one
 
 archive_name = "FLoRI21_DataPort" # dataset file name
 
@@ -237,15 +264,16 @@ class OneStepSDPipeline(StableDiffusionPipeline):
         prompt_embeds: Optional[torch.FloatTensor] = None,
         callback: Optional[Callable[[int, int, torch.FloatTensor], None]] = None,
         callback_steps: int = 1,
-        cross_attention_kwargs: Optional[Dict[str, Any]] = None
+        cross_attention_kwargs: Optional[Dict[str, Any]] = None,
+        latents: Optional[torch.FloatTensor] = None
     ):
 
         """
         Call method for `OneStepSDPipeline`.
 
         Args:
-            img_tensor (torch.Tensor): Image tensor.
-            t (torch.Tensor or int): Timesteps tensor.
+            img_tensor (torch.Tensor): Image tensor; ignored when `latents` is given.
+            t (torch.Tensor or int): Timesteps tensor, a single timestep or one per sample of the batch.
             up_ft_indices (list): List of upsampling indices.
             negative_prompt (Optional[str or list], default=None): Negative prompts.
             generator (Optional[torch.Generator or list], default=None): Torch generator for random sampling.
@@ -253,13 +281,15 @@ class OneStepSDPipeline(StableDiffusionPipeline):
             callback (Optional[Callable], default=None): Callback function invoked during diffusion.
             callback_steps (int, default=1): Frequency of invoking the callback.
             cross_attention_kwargs (Optional[dict], default=None): Keyword arguments for cross-attention.
+            latents (Optional[torch.FloatTensor], default=None): Precomputed (scaled) VAE latents, skipping the encoder.
 
         Returns:
             dict: Dictionary containing output from U-Net.
         """
         device = self._execution_device
-        latents = self.vae.encode(img_tensor).latent_dist.sample() * self.vae.config.scaling_factor
-        t = torch.tensor(t, dtype=torch.long, device=device)
+        if latents is None:
+            latents = self.vae.encode(img_tensor).latent_dist.sample() * self.vae.config.scaling_factor
+        t = torch.as_tensor(t, dtype=torch.long, device=device)
         noise = torch.randn_like(latents).to(device)
         latents_noisy = self.scheduler.add_noise(latents, noise, t)
         unet_output = self.unet(latents_noisy,
@@ -276,13 +306,16 @@ class SDFeaturizer:
 
     Provides a mechanism to compute stable diffusion based features from an input image, conditioned on a given prompt.
     """
-    def __init__(self, sd_id='stabilityai/stable-diffusion-2-1'):
+    def __init__(self, sd_id='stabilityai/stable-diffusion-2-1', latent_cache_size=16):
         """
         Initializes `SDFeaturizer` with a given stable diffusion model ID.
 
         Args:
             sd_id (str, default='stabilityai/stable-diffusion-2-1'): Stable diffusion model ID to be used for featurization.
+            latent_cache_size (int, default=16): Number of encoded images (image and size) kept by `encode`.
         """
+        self.latent_cache = OrderedDict()
+        self.latent_cache_size = latent_cache_size
         unet = MyUNet2DConditionModel.from_pretrained(sd_id, subfolder="unet")
         onestep_pipe = OneStepSDPipeline.from_pretrained(sd_id, unet=unet, safety_checker=None)
         onestep_pipe.vae.decoder = None
@@ -293,6 +326,33 @@ class SDFeaturizer:
         onestep_pipe.enable_xformers_memory_efficient_attention()
         self.pipe = onestep_pipe
 
+    @torch.no_grad()
+    def encode(self, img_tensor):
+        """
+        Encodes a single image with the VAE, reusing the result for an image (and size) seen before.
+
+        Args:
+            img_tensor (torch.Tensor): Single input image tensor with shape [c, h, w] or [1, c, h, w].
+
+        Returns:
+            tuple: Mean and standard deviation of the latent distribution, each with shape [1, 4, h/8, w/8].
+
+        Notes:
+            The encoder is deterministic, so the distribution of an image is computed once and each ensemble member
+            only draws its own sample from it. Retries and multi-resolution passes revisit the same images at other
+            timesteps; the least recently used entries are dropped beyond `latent_cache_size`.
+        """
+        img_tensor = img_tensor.reshape(1, *img_tensor.shape[-3:])
+        key = (hashlib.sha1(img_tensor.cpu().numpy().tobytes()).hexdigest(), tuple(img_tensor.shape))
+        if key in self.latent_cache:
+            self.latent_cache.move_to_end(key)
+        else:
+            latent_dist = self.pipe.vae.encode(img_tensor.cuda()).latent_dist
+            self.latent_cache[key] = (latent_dist.mean, latent_dist.std)
+            if len(self.latent_cache) > self.latent_cache_size:
+                self.latent_cache.popitem(last=False)
+        return self.latent_cache[key]
+
     @torch.no_grad()
     def forward(self,
                 img_tensor, # single image, [1,c,h,w]
@@ -305,48 +365,63 @@ class SDFeaturizer:
 
         Args:
             img_tensor (torch.Tensor): Single input image tensor with shape [1, c, h, w].
-            t (torch.Tensor or int): Timesteps tensor.
+            t (int or list of int): Timestep, or several timesteps batched into one U-Net call.
             up_ft_index (int): Index for upsampling.
             prompt (str): Textual prompt for conditioning.
             ensemble_size (int, default=8): Size of the ensemble for feature averaging.
 
         Returns:
-            torch.Tensor: Stable diffusion based features with shape [1, c, h, w].
+            torch.Tensor: Stable diffusion based features with shape [T, c, h, w], one row per timestep (T = 1 for a
+                          single timestep).
+
+        Notes:
+            The image is encoded once (see `encode`) whatever the number of timesteps; the U-Net batch holds
+            ensemble_size noisy latents per timestep, so its memory grows with the number of timesteps.
         """
-        img_tensor = img_tensor.repeat(ensemble_size, 1, 1, 1).cuda() # ensem, c, h, w
+        timesteps = [int(t)] if np.ndim(t) == 0 else [int(timestep) for timestep in t]
+        mean, std = self.encode(img_tensor)
+        batch = ensemble_size * len(timesteps)
+        latents = mean + std * torch.randn((batch,) + tuple(mean.shape[1:]), device=mean.device, dtype=mean.dtype)
+        latents = latents * self.pipe.vae.config.scaling_factor # T*ensem, 4, h/8, w/8
         prompt_embeds = self.pipe._encode_prompt(
             prompt=prompt,
             device='cuda',
             num_images_per_prompt=1,
             do_classifier_free_guidance=False) # [1, 77, dim]
-        prompt_embeds = prompt_embeds.repeat(ensemble_size, 1, 1)
+        prompt_embeds = prompt_embeds.repeat(batch, 1, 1)
         unet_ft_all = self.pipe(
-            img_tensor=img_tensor,
-            t=t,
+            img_tensor=None,
+            t=torch.tensor(timesteps, device='cuda').repeat_interleave(ensemble_size),
             up_ft_indices=[up_ft_index],
-            prompt_embeds=prompt_embeds)
-        unet_ft = unet_ft_all['up_ft'][up_ft_index] # ensem, c, h, w
-        unet_ft = unet_ft.mean(0, keepdim=True) # 1,c,h,w
+            prompt_embeds=prompt_embeds,
+            latents=latents)
+        unet_ft = unet_ft_all['up_ft'][up_ft_index] # T*ensem, c, h, w
+        unet_ft = unet_ft.reshape(len(timesteps), ensemble_size, *unet_ft.shape[1:]).mean(1) # T,c,h,w
         return unet_ft
 
+FEATURE_NORM_EPS = 1e-6 # smallest feature norm divided by in the cosine similarities
+
 class DFT:
     """
     RetinaRegNet (RetinaRegNetwork) utilizes DFT (Diffusion Features) for identifying vital key feature correlations
     and locations between images.
     """
-    def __init__(self, imgs,img_size,pts):
+    def __init__(self, imgs,img_size,pts,fov_masks=None):
         """
         Initialize the DFT object.
 
         Parameters:
         - imgs (list): List of input image tensors.
-        - img_size (int): Expected size of the image for processing.
-        - pts (list): List of point tuples specifying coordinates.
+        - img_size (int or tuple): Expected size of the image for processing, a side length or (height, width).
+        - pts (np.array): (N, 2) array of the (x, y) points to match.
+        - fov_masks (list of np.array, optional): Field of view masks of the images on the img_size grid (see
+                                                `fov_mask`); the matches are restricted to them. Defaults to None.
         """
-        self.pts = pts
+        self.pts = as_points(pts)
         self.imgs = imgs
         self.num_imgs = len(imgs)
         self.img_size = img_size
+        self.fov_masks = fov_masks
 
     def unravel_index(self,index, shape):
         """
@@ -406,7 +481,7 @@ class DFT:
         feature vector correlates across the spatial dimensions of the second feature map.
 
         Parameters:
-        - pts_list (list of tuples): List of points (y, x) for which the correlation map is to be computed.
+        - pts_list (np.array or torch.Tensor): (N, 2) integer points (y, x) for which the correlation map is to be computed.
         - feature_map1 (torch.Tensor): The first feature map tensor of shape (1, C, H1, W1) where C is the number of channels.
         - feature_map2 (torch.Tensor): The second feature map tensor of shape (1, C, H2, W2) where C is the number of channels
                                      and H2, W2 do not necessarily need to be equal to H1, W1.
@@ -417,6 +492,7 @@ class DFT:
         Notes:
             The function assumes that the first dimension of feature_map1 and feature_map2 is 1 (batch size of 1).
             This method uses batch matrix multiplication and vector normalization for efficient computation.
+            All-zero feature vectors (outside the field of view box with `fov_crop`) correlate to 0 with everything.
             Running this method on a GPU is recommended due to its computational and memory intensity.
         """
         # Convert the input tensors to float16
@@ -428,14 +504,15 @@ class DFT:
         feature_map2_flat = feature_map2.view(C, H*W)
 
         # Prepare a batch of point features
-        points_indices = torch.tensor(pts_list)
+        points_indices = torch.as_tensor(pts_list, device=feature_map1.device).long()
         point_features = feature_map1[0, :, points_indices[:, 0], points_indices[:, 1]].transpose(0, 1)  # Shape: (NumPoints, Channels)  # Shape: (NumPoints, Channels)
 
         # Normalize the point features and feature_map2_flat
-        point_features_norm = torch.norm(point_features, dim=1, keepdim=True)
+        # features outside the featurized field of view box are zero; clamping their norms gives them a zero correlation
+        point_features_norm = torch.norm(point_features, dim=1, keepdim=True).clamp_min(FEATURE_NORM_EPS)
         normalized_point_features = point_features / point_features_norm
 
-        feature_map2_norm = torch.norm(feature_map2_flat, dim=0, keepdim=True)
+        feature_map2_norm = torch.norm(feature_map2_flat, dim=0, keepdim=True).clamp_min(FEATURE_NORM_EPS)
         normalized_feature_map2 = feature_map2_flat / feature_map2_norm
 
         # Compute the correlation map for each point
@@ -449,32 +526,82 @@ class DFT:
 
         return correlation_maps
 
-    def compute_correlation_map_max_locations(self, pts_list, feature_map1, feature_map2): # heirachy range - hpo
+    def compute_streamed_2d_correlation_maps(self, pts_list, feature_map1, feature_map2):
+        """
+        Computes the correlation maps of `compute_batched_2d_correlation_maps` for features split into scales, without
+        ever holding more than one full-resolution scale.
+
+        Parameters:
+        - pts_list (np.array or torch.Tensor): (N, 2) integer points (y, x) for which the correlation map is to be computed.
+        - feature_map1 (MultiScaleFeatures): Multi-scale features of the first image.
+        - feature_map2 (MultiScaleFeatures): Multi-scale features of the second image.
+
+        Returns:
+        - torch.Tensor: A tensor of shape (NumPoints, H, W), the cosine similarity of the features of every point with
+                        every pixel, all scales concatenated along the channels.
+
+        Notes:
+            The cosine similarity of concatenated features is sum_s p_s.f_s / (|p| |f|) with |p|^2 = sum_s |p_s|^2 (and
+            likewise for |f|). A first sweep over the scales gathers the point features and accumulates both norms; a
+            second one adds up the normalised per-scale products. Peak memory is one upsampled scale per image plus
+            the correlation maps, whatever the number of scales; the price is upsampling each scale twice.
+        """
+        points_indices = torch.as_tensor(pts_list, device=feature_map1.device).long()
+        point_features, point_norms, pixel_norms = [], 0, 0
+        for scale in range(len(feature_map1)):
+            features = self.compute_pooled_and_combining_feature_maps(feature_map1.upsampled(scale), hierarchy_range=1)
+            point_features.append(features[0, :, points_indices[:, 0], points_indices[:, 1]].transpose(0, 1).float())
+            point_norms = point_norms + point_features[-1].pow(2).sum(1, keepdim=True)
+            del features
+            features = self.compute_pooled_and_combining_feature_maps(feature_map2.upsampled(scale), hierarchy_range=1)
+            pixel_norms = pixel_norms + features[0].float().pow(2).sum(0).view(1, -1)
+            del features
+        point_norms, pixel_norms = point_norms.sqrt().clamp_min(FEATURE_NORM_EPS), pixel_norms.sqrt().clamp_min(FEATURE_NORM_EPS)
+        H, W = feature_map2.size
+        correlation_maps = torch.zeros((len(points_indices), H*W), dtype=torch.float16, device=feature_map1.device)
+        for scale in range(len(feature_map2)):
+            features = self.compute_pooled_and_combining_feature_maps(feature_map2.upsampled(scale), hierarchy_range=1)
+            normalized_feature_map2 = (features[0].float().view(-1, H*W) / pixel_norms).to(dtype=torch.float16)
+            del features
+            normalized_point_features = (point_features[scale] / point_norms).to(dtype=torch.float16)
+            correlation_maps += torch.mm(normalized_point_features, normalized_feature_map2)
+            del normalized_feature_map2
+        torch.cuda.empty_cache()
+        return correlation_maps.view(-1, H, W)
+
+    def compute_correlation_map_max_locations(self, pts_list, feature_map1, feature_map2, mask2=None): # heirachy range - hpo
         """
         Compute the maximum locations in the batched correlation maps between two feature maps.
 
         Parameters:
-        - pts_list (list of tuples): List of points for which the correlation maps were computed.
-        - feature_map1, feature_map2 (torch.Tensor): The input feature maps.
+        - pts_list (np.array or torch.Tensor): (N, 2) integer points (y, x) for which the correlation maps are computed.
+        - feature_map1, feature_map2 (torch.Tensor or MultiScaleFeatures): The input feature maps.
+        - mask2 (torch.Tensor, optional): (H, W) boolean mask of the pixels of feature_map2 that may be matched.
+                                        Defaults to None, all pixels.
 
         Returns:
         - torch.Tensor: Tensor of maximum locations for each point.
         - torch.Tensor: Tensor of maximum values for each point.
         """
-        enhanced_feature_map1 = self.compute_pooled_and_combining_feature_maps(feature_map1, hierarchy_range=1)
-        enhanced_feature_map2 = self.compute_pooled_and_combining_feature_maps(feature_map2, hierarchy_range=1)
-        # Compute the batched correlation maps
-        batched_correlation_maps = self.compute_batched_2d_correlation_maps(pts_list, enhanced_feature_map1, enhanced_feature_map2)
+        if isinstance(feature_map1, MultiScaleFeatures):
+            batched_correlation_maps = self.compute_streamed_2d_correlation_maps(pts_list, feature_map1, feature_map2)
+        else:
+            enhanced_feature_map1 = self.compute_pooled_and_combining_feature_maps(feature_map1, hierarchy_range=1)
+            enhanced_feature_map2 = self.compute_pooled_and_combining_feature_maps(feature_map2, hierarchy_range=1)
+            # Compute the batched correlation maps
+            batched_correlation_maps = self.compute_batched_2d_correlation_maps(pts_list, enhanced_feature_map1, enhanced_feature_map2)
 
+        if mask2 is not None:
+            batched_correlation_maps.masked_fill_(~mask2, -2) # below any cosine similarity
         M,H2, W2 = batched_correlation_maps.shape
         #print(batched_correlation_maps.shape)
 
         # Find the maximum values and their locations along the last two dimensions for each map
         max_values, max_indices_flat = torch.max(batched_correlation_maps.view(len(pts_list), -1), dim=-1)
 
-        x, y = zip(*[self.unravel_index(idx.item(), (H2, W2)) for idx in max_indices_flat.view(-1)])
-        x = torch.tensor(x, device = 'cuda').view(M)
-        y = torch.tensor(y, device = 'cuda').view(M)
+        # Row and column of every maximum at once (a vectorised `unravel_index`)
+        x = torch.div(max_indices_flat, W2, rounding_mode='floor').view(M)
+        y = (max_indices_flat % W2).view(M)
 
         # Stack the coordinates to get a 2xHxW tensor
         max_locations = torch.stack((x, y)).t()
@@ -486,18 +613,19 @@ class DFT:
         Upsample the feature to match the specified image size.
 
         Parameters:
-        - ft (torch.Tensor): Feature tensor to be upsampled.
+        - ft (torch.Tensor): Feature tensor to be upsampled, computed on images padded to `padded_grid_size`.
 
         Returns:
-        - tuple: Upsampled source and target feature maps.
+        - tuple: Upsampled source and target feature maps, cropped to the image grid.
         """
+        height, width = grid_size(self.img_size)
         with torch.no_grad():
             num_channel = ft.size(1)
             src_ft = ft[0].unsqueeze(0)
-            src_ft = nn.Upsample(size=(self.img_size, self.img_size), mode='bilinear')(src_ft)  # (1, C, H, W)
+            src_ft = nn.Upsample(size=padded_grid_size(self.img_size), mode='bilinear')(src_ft)[:, :, :height, :width].contiguous()  # (1, C, H, W)
             gc.collect()
             torch.cuda.empty_cache()
-            trg_ft = nn.Upsample(size=(self.img_size, self.img_size), mode='bilinear')(ft[1:])  # (1, C, H, W)
+            trg_ft = nn.Upsample(size=padded_grid_size(self.img_size), mode='bilinear')(ft[1:])[:, :, :height, :width].contiguous()  # (1, C, H, W)
         return src_ft,trg_ft
 
     def feature_maps(self,feature_map1,feature_map2,iccl):
@@ -510,32 +638,326 @@ class DFT:
         distance between the original point and its double-mapped location is within the threshold.
 
         Parameters:
-        - feature_map1 (torch.Tensor): The first feature map, used as the base for initial correlations.
-        - feature_map2 (torch.Tensor): The second feature map, used for reverse correlations to check consistency.
+        - feature_map1 (torch.Tensor or MultiScaleFeatures): The first feature map, used as the base for initial correlations.
+        - feature_map2 (torch.Tensor or MultiScaleFeatures): The second feature map, used for reverse correlations to check consistency.
         - iccl (float): The maximum allowed distance (inverse consistency criteria limit) for a point and
                       its double-mapped location to be considered consistent.
 
+        With `fov_masks` set, each search only considers pixels inside the field of view of the searched image.
+
         Returns:
-        tuple of (list, list, list):
-        - pnts (list of tuples): The points from the original feature map that meet the inverse consistency criteria.
-        - rmaxs (list of floats): The maximum correlation values at these points.
-        - rspts (list of tuples): The corresponding points in the second feature map that have the highest correlation
+        tuple of (np.array, np.array, np.array):
+        - pnts (np.array): (N, 2) points from the original feature map that meet the inverse consistency criteria.
+        - rmaxs (np.array): (N,) maximum correlation values at these points.
+        - rspts (np.array): (N, 2) corresponding points in the second feature map that have the highest correlation
                                   with the points in `pnts`.
         """
-        pnts,rmaxs,rspts=[],[],[]
-        pts = [(int(y), int(x)) for x, y in self.pts]
-        max_indices_ST, max_values_ST = self.compute_correlation_map_max_locations(pts,feature_map1,feature_map2)
-        x_prime_y_prime = max_indices_ST
-        max_indices_TS, max_values_TS = self.compute_correlation_map_max_locations(max_indices_ST,feature_map2,feature_map1)
-        x_prime_prime_y_prime_prime = max_indices_TS
-        for i, (pt, max_idx) in enumerate(zip(self.pts, x_prime_prime_y_prime_prime)):
-            # Calculate the distance between the point and the max correlation index
-            if np.sqrt((pt[1] - max_idx.cpu()[0]) ** 2 + (pt[0] - max_idx.cpu()[1]) ** 2) <=iccl: ### inverse consistency criteria
-                pnts.append((int(pt[0]), int(pt[1])))
-                rmaxs.append(max_values_ST[i].cpu().item())  # Assuming max_values_ST is a tensor with corresponding max values
-                rspts.append((x_prime_y_prime[i][1].cpu().item(), x_prime_y_prime[i][0].cpu().item()))  # Assuming x_prime_y_prime has corresponding max index locations
+        pts = self.pts.astype(np.int64) # integer pixel (x, y) of every point
+        mask1, mask2 = [None, None] if self.fov_masks is None else [torch.as_tensor(mask, device=feature_map1.device) for mask in self.fov_masks]
+        max_indices_ST, max_values_ST = self.compute_correlation_map_max_locations(pts[:, ::-1].copy(),feature_map1,feature_map2,mask2)
+        x_prime_y_prime = max_indices_ST.cpu().numpy() # (y', x')
+        max_indices_TS, max_values_TS = self.compute_correlation_map_max_locations(max_indices_ST,feature_map2,feature_map1,mask1)
+        x_prime_prime_y_prime_prime = max_indices_TS.cpu().numpy() # (y'', x'')
+        # Distance between every point and its double-mapped location: inverse consistency criteria
+        distances = np.sqrt((self.pts[:, 1] - x_prime_prime_y_prime_prime[:, 0]) ** 2 + (self.pts[:, 0] - x_prime_prime_y_prime_prime[:, 1]) ** 2)
+        consistent = distances <= iccl
+        pnts = as_points(pts[consistent])
+        rmaxs = max_values_ST.float().cpu().numpy()[consistent]
+        rspts = as_points(x_prime_y_prime[consistent][:, ::-1])
         return pnts, rmaxs, rspts
 
+class MultiScaleFeatures:
+    """
+    Diffusion features of one image extracted at several scales, kept at their native resolution and only upsampled
+    to the matching resolution one scale at a time.
+    """
+    def __init__(self, size):
+        """
+        Initialize the MultiScaleFeatures object.
+
+        Parameters:
+        - size (tuple): Size (height, width) every scale is upsampled to for matching.
+        """
+        self.size = size
+        self.scales = []
+
+    def __len__(self):
+        return len(self.scales)
+
+    @property
+    def device(self):
+        return self.scales[0][0].device
+
+    def append(self, feature, scale_size):
+        """
+        Add the features of one scale.
+
+        Parameters:
+        - feature (torch.Tensor): (1, C, h, w) features as returned by the featurizer.
+        - scale_size (int or tuple): Image grid the features were extracted at, a side length or (height, width).
+        """
+        self.scales.append((feature, scale_size))
+
+    def upsampled(self, scale):
+        """
+        Upsample the features of one scale to `size`.
+
+        Parameters:
+        - scale (int): Index of the scale.
+
+        Returns:
+        - torch.Tensor: (1, C, H, W) features, upsampled to the scale's grid exactly as `DFT.feature_upsampling` does
+                        and then bilinearly resized to `size`.
+        """
+        feature, scale_size = self.scales[scale]
+        height, width = grid_size(scale_size)
+        with torch.no_grad():
+            feature = nn.Upsample(size=padded_grid_size(scale_size), mode='bilinear')(feature)[:, :, :height, :width]
+            return F.interpolate(feature, size=self.size, mode='bilinear', align_corners=False)
+
+class LazyWarp:
+    """
+    Moving image warped by a homography whose full-resolution warp is deferred until it is actually requested.
+
+    Only a low-resolution `preview`, warped straight into the grid used for featurization, is computed up front.
+    """
+    def __init__(self, image, matrix, dsize, preview):
+        """
+        Initialize the LazyWarp object.
+
+        Parameters:
+        - image (np.array): The full-resolution moving image.
+        - matrix (np.array): (3x3) homography matrix mapping the moving image onto the full-resolution output grid.
+        - dsize (tuple): Size (width, height) of the full-resolution output.
+        - preview (np.array): The warped image already resampled onto the low-resolution grid.
+        """
+        self.image = image
+        self.matrix = matrix
+        self.dsize = dsize
+        self.preview = preview
+        self.full = None
+
+    def compute(self):
+        """
+        Warp the full-resolution moving image, caching the result for later requests.
+
+        Returns:
+        - np.array: The deformed image at full resolution.
+        """
+        if self.full is None:
+            self.full = warp_image_homography(self.image, self.matrix, self.dsize)
+        return self.full
+
+def resize_matrix(src_size, dst_size):
+    """
+    Computes the (3x3) matrix mapping pixel coordinates of an image onto the same image resized with `cv2.resize`.
+
+    Parameters:
+    - src_size (tuple): Size (width, height) of the source image.
+    - dst_size (tuple): Size (width, height) of the resized image.
+
+    Returns:
+    - np.array: The scaling matrix, following OpenCV's pixel-center convention.
+    """
+    sx, sy = dst_size[0] / src_size[0], dst_size[1] / src_size[1]
+    return np.array([[sx, 0, 0.5 * sx - 0.5],
+                     [0, sy, 0.5 * sy - 0.5],
+                     [0, 0, 1]])
+
+def homography_remap_fields(matrix, rows, columns):
+    """
+    Evaluates the inverse of a homography over a block of output pixels and returns it as an OpenCV remap field.
+
+    Parameters:
+    - matrix (np.array): (3x3) homography matrix mapping the source image onto the output grid, as for `cv2.warpPerspective`.
+    - rows (np.array): The y coordinates of the output rows to evaluate.
+    - columns (np.array): The x coordinates of the output columns to evaluate.
+
+    Returns:
+    - tuple: Two float32 arrays of shape (len(rows), len(columns)) holding the source x and y of every output pixel.
+    """
+    inverse = np.linalg.inv(np.asarray(matrix, dtype=np.float64))
+    x = np.asarray(columns, dtype=np.float32)[np.newaxis, :]
+    y = np.asarray(rows, dtype=np.float64)[:, np.newaxis]
+    fields = []
+    for i in range(3):
+        # Row offsets in float64, per-pixel arithmetic in float32
+        fields.append(inverse[i, 0].astype(np.float32) * x + (inverse[i, 1] * y + inverse[i, 2]).astype(np.float32))
+    map_x, map_y, w = fields
+    at_infinity = np.abs(w) < 1e-12
+    w[at_infinity] = 1
+    map_x /= w
+    map_y /= w
+    map_x[at_infinity] = -2 # points mapped to infinity are left empty in the output
+    map_y[at_infinity] = -2
+    return map_x, map_y
+
+def warp_image_tiled(image, remap_fields, dsize, tile_size=1024, workers=None, output=None):
+    """
+    Warps an image tile by tile on a thread pool, resampling each output tile from only the part of the source
+    image it maps to.
+
+    Parameters:
+    - image (numpy.ndarray): The image to warp, (height, width) or (height, width, channels). It may be a memory-mapped
+                           array, in which case only the source blocks needed by the tiles are read.
+    - remap_fields (callable): Function taking the output rows and columns of a tile and returning the source x and y
+                             of its pixels, e.g. a wrapped `homography_remap_fields` or `polynomial_remap_fields`.
+    - dsize (tuple): Size (width, height) of the output image.
+    - tile_size (int, optional): Side of the square output tiles in pixels. Defaults to 1024.
+    - workers (int, optional): Number of threads. Defaults to None, the number of CPUs.
+    - output (numpy.ndarray, optional): Array to write the warped image into, e.g. a `numpy.memmap` for outputs that
+                                      do not fit in RAM.
+                                      Defaults to None, a new in-memory array.
+
+    Returns:
+    - numpy.ndarray: The warped image (`output` if one was given), with the dtype and channels of the input.
+
+    Notes:
+        Pixels are bilinearly interpolated with `cv2.remap` and areas mapped from outside the image are filled with
+        zeros. OpenCV releases the GIL, so the tiles resample in parallel, and at most one source block and one remap
+        field per thread are held in memory besides the output. Since the remap field is made relative to the source
+        block, sources wider than the 32767 px that `cv2.remap` can address are supported too.
+    """
+    width, height = dsize
+    if output is None:
+        output = np.empty((height, width) + image.shape[2:], dtype=image.dtype)
+    src_height, src_width = image.shape[:2]
+
+    def warp_tile(y0, x0):
+        y1, x1 = min(y0 + tile_size, height), min(x0 + tile_size, width)
+        map_x, map_y = remap_fields(np.arange(y0, y1), np.arange(x0, x1))
+        # Source bounding box of the tile, clipped to the image; pixels mapped outside of it stay zero
+        sx0 = max(int(np.floor(map_x.min())), 0)
+        sx1 = min(int(np.floor(map_x.max())) + 2, src_width)
+        sy0 = max(int(np.floor(map_y.min())), 0)
+        sy1 = min(int(np.floor(map_y.max())) + 2, src_height)
+        if sx0 >= sx1 or sy0 >= sy1:
+            output[y0:y1, x0:x1] = 0
+            return
+        map_x -= sx0
+        map_y -= sy0
+        source = np.ascontiguousarray(image[sy0:sy1, sx0:sx1])
+        output[y0:y1, x0:x1] = cv2.remap(source, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        tiles = [executor.submit(warp_tile, y0, x0) for y0 in range(0, height, tile_size) for x0 in range(0, width, tile_size)]
+        for tile in tiles:
+            tile.result()
+    return output
+
+def warp_image_homography(image, matrix, dsize, tile_size=1024, workers=None, output=None):
+    """
+    Warps an image with a homography like `cv2.warpPerspective`, using the tiled executor `warp_image_tiled`.
+
+    Parameters:
+    - image (numpy.ndarray): The image to warp.
+    - matrix (np.array): (3x3) homography matrix mapping the image onto the output grid. An affine
+                       transformation is passed as its (3x3) homogeneous matrix.
+    - dsize (tuple): Size (width, height) of the output image.
+    - tile_size (int, optional): Side of the square output tiles in pixels. Defaults to 1024.
+    - workers (int, optional): Number of threads. Defaults to None, the number of CPUs.
+    - output (numpy.ndarray, optional): Array to write the warped image into. Defaults to None.
+
+    Returns:
+    - numpy.ndarray: The warped image.
+    """
+    return warp_image_tiled(image, lambda rows, columns: homography_remap_fields(matrix, rows, columns), dsize, tile_size, workers, output)
+
+def read_image(image, flags=cv2.IMREAD_COLOR, full_resolution=False):
+    """
+    Returns an image as a NumPy array, decoding it from disk only when a file path is given.
+
+    Parameters:
+    - image (str, np.array or LazyWarp): Path to the image file, an already decoded image in BGR (or grayscale) layout,
+                                       or a deferred warp.
+    - flags (int, optional): OpenCV read flag, either `cv2.IMREAD_COLOR` or `cv2.IMREAD_GRAYSCALE`. Defaults to `cv2.IMREAD_COLOR`.
+    - full_resolution (bool, optional): For a `LazyWarp`, return the full-resolution warp instead of its
+                                      low-resolution preview. Defaults to False.
+
+    Returns:
+    - np.array: The decoded image, converted to the layout requested by `flags`.
+
+    Notes:
+        This lets every preprocessing step accept in-memory arrays produced by earlier steps (e.g. CLAHE)
+        as well as file paths, so intermediate images never need to be written to disk and decoded again.
+    """
+    if isinstance(image, str):
+        return cv2.imread(image, flags)
+    if isinstance(image, LazyWarp):
+        image = image.compute() if full_resolution else image.preview
+    if flags == cv2.IMREAD_GRAYSCALE and image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if flags == cv2.IMREAD_COLOR and image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
+
+UNET_SIZE_MULTIPLE = 64 # the UNet downsamples the 1/8 latent three more times, so its input sides must be multiples of 64
+
+def grid_size(img_size):
+    """
+    Returns the (height, width) of a working grid.
+
+    Parameters:
+    - img_size (int or tuple): Side of a square grid, or (height, width) of a rectangular one.
+
+    Returns:
+    - tuple: (height, width) of the grid.
+    """
+    return (img_size, img_size) if np.ndim(img_size) == 0 else tuple(img_size)
+
+def grid_dsize(img_size):
+    """
+    Returns the (width, height) of a working grid, in the order `cv2.resize` and `PIL.Image.resize` expect.
+
+    Parameters:
+    - img_size (int or tuple): Side of a square grid, or (height, width) of a rectangular one.
+
+    Returns:
+    - tuple: (width, height) of the grid.
+    """
+    return grid_size(img_size)[::-1]
+
+def padded_grid_size(img_size, multiple=UNET_SIZE_MULTIPLE):
+    """
+    Returns the (height, width) of a working grid rounded up to the next multiple accepted by the UNet.
+
+    Parameters:
+    - img_size (int or tuple): Side of a square grid, or (height, width) of a rectangular one.
+    - multiple (int, optional): Multiple the sides are rounded up to. Defaults to UNET_SIZE_MULTIPLE.
+
+    Returns:
+    - tuple: (height, width) of the padded grid. Images are padded at the bottom and right, so the grid itself
+             stays at the top left.
+    """
+    return tuple(-(-side // multiple) * multiple for side in grid_size(img_size))
+
+def scaled_grid_size(img_size, side):
+    """
+    Returns a grid with the aspect ratio of `img_size` whose longer side is `side`.
+
+    Parameters:
+    - img_size (int or tuple): Side of a square grid, or (height, width) of a rectangular one.
+    - side (int): Longer side of the scaled grid.
+
+    Returns:
+    - tuple: (height, width) of the scaled grid.
+    """
+    height, width = grid_size(img_size)
+    scale = side / max(height, width)
+    return (int(round(height * scale)), int(round(width * scale)))
+
+def as_points(points):
+    """
+    Converts points to the compact (N, 2) float32 array of (x, y) coordinates used throughout the pipeline.
+
+    Parameters:
+    - points (array-like): (N, 2) array, list of (x, y) tuples, or an empty list.
+
+    Returns:
+    - np.array: (N, 2) float32 array; the input itself if it already is one.
+    """
+    return np.asarray(points, dtype=np.float32).reshape(-1, 2)
+
 def compute_boundary(image, mean_intensity):
     """
     Compute the boundary of an image based on its mean intensity.
@@ -570,22 +992,75 @@ def is_within_boundary(kp, boundaries):
     upper, lower, left, right = boundaries
     return left <= kp.pt[0] <= right and upper <= kp.pt[1] <= lower
 
+
+def fov_mask(image, img_size, threshold=10):
+    """
+    Compute the mask of the retinal field of view (FOV) of an image on the img_size grid.
+
+    Parameters:
+    - image (str, np.array or LazyWarp): The image, as accepted by `read_image`.
+    - img_size (int or tuple): Working grid, a side length or (height, width).
+    - threshold (int, optional): Intensity above which a pixel belongs to the FOV. Defaults to 10.
+
+    Returns:
+    - np.array: (H, W) boolean mask, True inside the FOV.
+
+    Notes:
+        Fundus images are black outside the circular FOV. The image is median filtered first so that isolated noisy
+        pixels in the black surround do not count as FOV.
+    """
+    gray = cv2.resize(read_image(image, cv2.IMREAD_GRAYSCALE), grid_dsize(img_size), interpolation=cv2.INTER_AREA)
+    return cv2.medianBlur(gray, 5) > threshold
+
+def resize_fov_mask(mask, img_size):
+    """
+    Resize a field of view mask to another working grid.
+
+    Parameters:
+    - mask (np.array): (H, W) boolean FOV mask from `fov_mask`.
+    - img_size (int or tuple): Target grid, a side length or (height, width).
+
+    Returns:
+    - np.array: The boolean mask on the img_size grid.
+    """
+    return cv2.resize(mask.astype(np.uint8), grid_dsize(img_size), interpolation=cv2.INTER_NEAREST) > 0
+
+def fov_bounding_box(mask, multiple=UNET_SIZE_MULTIPLE):
+    """
+    Compute the bounding box of a field of view mask, grown outwards to multiples of `multiple`.
+
+    Parameters:
+    - mask (np.array): (H, W) boolean FOV mask from `fov_mask`.
+    - multiple (int, optional): The box edges are aligned to multiples of this. Defaults to UNET_SIZE_MULTIPLE.
+
+    Returns:
+    - tuple: upper, lower, left and right boundaries, as returned by `compute_boundary`. The whole grid if the mask is empty.
+
+    Notes:
+        Aligning the box to multiples of 64 makes the crop a valid UNet input and puts its features exactly on the
+        feature grid of the uncropped image, whatever the stride of the chosen up-sampling block.
+    """
+    upper, lower, left, right = compute_boundary(mask.astype(np.uint8), 0)
+    upper, left = upper // multiple * multiple, left // multiple * multiple
+    lower, right = -(-lower // multiple) * multiple, -(-right // multiple) * multiple
+    return upper, lower, left, right
+
 def SIFT_top_n_keypoints(image_path, N=250, img_shape=256, max_dist=25):
     """
     Detect top N keypoints in the given image using SIFT, considering constraints on distance, boundary, and collinearity.
 
     Parameters:
-    - image_path (str): Path to the input image.
+    - image_path (str or np.array): Path to the input image, or the already decoded image.
     - N (int): Number of keypoints to select. Defaults to 250.
-    - img_shape (int): The size to which the image should be resized. Defaults to 256.
+    - img_shape (int or tuple): The size to which the image should be resized, a side length or (height, width). Defaults to 256.
     - max_dist (int): Minimum distance between selected keypoints. Defaults to 25.
 
     Returns:
-    - list: List of keypoints' positions in the form (x, y).
+    - np.array: (N, 2) array of the keypoints' positions (x, y).
     """
     # Load image
-    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    image = cv2.resize(image, (img_shape, img_shape))
+    image = read_image(image_path, cv2.IMREAD_GRAYSCALE)
+    image = cv2.resize(image, grid_dsize(img_shape))
 
     # Initialize SIFT detector
     sift = cv2.SIFT_create()
@@ -601,52 +1076,58 @@ def SIFT_top_n_keypoints(image_path, N=250, img_shape=256, max_dist=25):
     boundaries = compute_boundary(image, mean_intensity)
 
     # Select top N keypoints
-    selected_keypoints = []
+    selected_keypoints = np.empty((N, 2), dtype=np.float32)
+    num_selected = 0
     for keypoint in keypoints:
         # Check if the keypoint is within the boundary
         if is_within_boundary(keypoint, boundaries):
             # Check if the pixel intensity at the keypoint is greater than the threshold (not black)
             if image[int(keypoint.pt[1]), int(keypoint.pt[0])] > mean_intensity:
                 # Check if the keypoint is far from existing selected keypoints
-                if all(cv2.norm(np.array(keypoint.pt) - np.array(kp.pt)) > max_dist for kp in selected_keypoints):
-                    selected_keypoints.append(keypoint)
+                if np.all(np.sum((selected_keypoints[:num_selected] - keypoint.pt) ** 2, axis=1) > max_dist ** 2):
+                    selected_keypoints[num_selected] = keypoint.pt
+                    num_selected += 1
 
             # Break if N keypoints are selected
-            if len(selected_keypoints) == N:
+            if num_selected == N:
                 break
 
-    return [kp.pt for kp in selected_keypoints]
+    return selected_keypoints[:num_selected]
 
-def select_random_points(img, num_points=100, img_size=1200,offset=0.01,window_size = 51,max_attempts_per_point=50):
+def select_random_points(img, num_points=100, img_size=1200,offset=0.01,window_size = 51,max_attempts_per_point=50,seed=None):
     """
     Selects a specified number of random points from an image, ensuring that each point is centered in a region
     meeting a defined intensity threshold within the image. The image is resized to a specified size, and points
     are chosen randomly, with each potential point undergoing validation against criteria before being accepted.
 
     Parameters:
-    - img (str): Path to the image file.
+    - img (str or np.array): Path to the image file, or the already decoded image.
     - num_points (int, optional): The number of random points to select. Defaults to 100.
-    - img_size (int, optional): The size to which the image is resized (assumed square). Defaults to 1200.
+    - img_size (int or tuple, optional): The size to which the image is resized, a side length or (height, width). Defaults to 1200.
     - offset (float, optional): Proportional offset to exclude points near the edges, represented as a fraction of
                               the image dimensions. Defaults to 0.01.
     - window_size (int, optional): Size of the square window used to check pixel intensity around each point.
                                  Defaults to 51.
     - max_attempts_per_point (int, optional): The maximum number of attempts allowed to find a suitable point
                                             that meets the criteria. Defaults to 50.
+    - seed (int, optional): Seed of the sampler. Defaults to None, a seed derived from the pixels of the resized image.
 
     Returns:
-    - list of tuples: A list where each tuple represents the (y, x) coordinates of a selected point.
+    - np.array: (N, 2) array of the (y, x) coordinates of the selected points, i.e. (column, row).
 
     Notes:
-        The function converts the image to grayscale and resizes it to img_size x img_size. It avoids selecting
+        The function converts the image to grayscale and resizes it to the img_size grid. It avoids selecting
         points near the image boundary by applying a boundary offset calculated from the 'offset' parameter.
         Each point must be centered in a window (defined by 'window_size') where all pixels have an intensity
         greater than or equal to 5. If the function fails to find a suitable point after 'max_attempts_per_point'
         for any location, it stops and returns the points found up to that moment.
+        The sampler has its own random state instead of the global one of the `random` module, so the points of an
+        image do not depend on which thread samples them (see `prefetch_case`) or on what else drew random numbers.
     """
 
-    image = cv2.resize(cv2.imread(img, cv2.IMREAD_GRAYSCALE), (img_size, img_size))
+    image = cv2.resize(read_image(img, cv2.IMREAD_GRAYSCALE), grid_dsize(img_size))
     h, w = image.shape
+    rng = random.Random(seed if seed is not None else hashlib.sha1(np.ascontiguousarray(image).tobytes()).hexdigest())
     boundary_offset = int(offset * h)
     pts = []
     window_offset = window_size // 2  # Calculate the offset from the center of the window
@@ -654,8 +1135,8 @@ def select_random_points(img, num_points=100, img_size=1200,offset=0.01,window_s
     while len(pts) < num_points:
         attempts = 0
         while attempts < max_attempts_per_point:
-            x = random.randint(boundary_offset + window_offset, h - boundary_offset - window_offset - 1)
-            y = random.randint(boundary_offset + window_offset, w - boundary_offset - window_offset - 1)
+            x = rng.randint(boundary_offset + window_offset, h - boundary_offset - window_offset - 1)
+            y = rng.randint(boundary_offset + window_offset, w - boundary_offset - window_offset - 1)
 
             # Define the window boundaries
             x_lower = x - window_offset
@@ -673,7 +1154,7 @@ def select_random_points(img, num_points=100, img_size=1200,offset=0.01,window_s
             print("Maximum attempts reached, unable to find sufficient points with the specified criteria.")
             break  # Break outer loop if max attempts is reached without finding a point
 
-    return pts
+    return as_points(pts)
 
 def CLAHE_plot_cond(image,disp_clip):
     """
@@ -759,13 +1240,14 @@ def compute_plot_Flori21_AUC(landmark_errors,clss='All'):
         success_rate = successful_count / len(landmark_errors_sorted)
         success_rates.append(success_rate * 100) # convert to percentage
     # Plot the curve
-    plt.plot(thresholds, success_rates, label="Success Rate Curve")
-    plt.xlabel("Threshold")
-    plt.ylabel("Success Rate (%)")
-    plt.title("Success Rate vs. Threshold")
-    plt.legend()
-    plt.grid(True)
-    plt.show()
+    fig, ax = new_figure()
+    ax.plot(thresholds, success_rates, label="Success Rate Curve")
+    ax.set_xlabel("Threshold")
+    ax.set_ylabel("Success Rate (%)")
+    ax.set_title("Success Rate vs. Threshold")
+    ax.legend()
+    ax.grid(True)
+    show_figure(fig)
     # Compute AUC
     auc = np.sum(success_rates) / 10000 # normalize to 0-1
     if clss =='All':
@@ -774,6 +1256,307 @@ def compute_plot_Flori21_AUC(landmark_errors,clss='All'):
         print("AUC for {} class of Images:".format(clss), auc)
 
 
+class ResultWriter:
+    """
+    Writes result figures and images to disk on background threads, off the registration's critical path.
+
+    Writes are queued in a bounded queue: once `max_pending` writes are waiting, the caller blocks until a thread
+    catches up, so a slow disk throttles the pipeline instead of letting figures and full-resolution images pile up
+    in memory.
+    """
+    def __init__(self, workers=2, max_pending=8):
+        """
+        Initialize the ResultWriter object and start its threads.
+
+        Parameters:
+        - workers (int, optional): Number of writer threads; 0 writes synchronously in the caller. Defaults to 2.
+        - max_pending (int, optional): Number of queued writes from which `submit` blocks. Defaults to 8.
+        """
+        self.pid = os.getpid()
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.figure_lock = threading.Lock()
+        self.failures = []
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def run(self):
+        """
+        Body of a writer thread: performs queued writes until the process exits or the writer is closed.
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            write, path, content = item
+            try:
+                write(path, content)
+            except Exception as error:
+                self.failures.append((path, error))
+            finally:
+                self.queue.task_done()
+
+    def submit(self, write, path, content, synchronous=False):
+        """
+        Queue a write, blocking while the queue is full.
+
+        Parameters:
+        - write (callable): Called as `write(path, content)` on a writer thread.
+        - path (str): Destination file path.
+        - content: The figure or image to write.
+        - synchronous (bool, optional): Write right away in the caller instead. Defaults to False.
+        """
+        if self.workers == 0 or synchronous:
+            try:
+                write(path, content)
+            except Exception as error:
+                self.failures.append((path, error))
+        else:
+            self.queue.put((write, path, content))
+
+    def write_image(self, path, image):
+        """
+        Encode an image and write it to `path`, like `cv2.imwrite`.
+        """
+        if not cv2.imwrite(path, image):
+            raise IOError("cv2.imwrite could not write the image")
+
+    def write_figure(self, path, fig):
+        """
+        Render a figure to `path`. Rendering is serialized, as matplotlib shares its font cache between figures.
+        """
+        with self.figure_lock:
+            fig.savefig(path)
+
+    def image(self, path, image):
+        """
+        Queue an image for writing to `path`. The array must not be modified afterwards.
+        """
+        self.submit(self.write_image, path, image)
+
+    def figure(self, path, fig):
+        """
+        Queue a matplotlib figure for saving to `path`. The figure must not be modified afterwards.
+
+        Only standalone Agg figures (see `new_figure`) are rendered on a writer thread. Figures managed by pyplot, which
+        is not thread-safe, are saved right away in the caller, before they are shown or closed.
+        """
+        self.submit(self.write_figure, path, fig, synchronous=fig.canvas.manager is not None)
+
+    def flush(self):
+        """
+        Block until every queued write is on disk, reporting the writes that failed.
+        """
+        self.queue.join()
+        for path, error in self.failures:
+            print("Could not write {0}: {1}".format(path, error))
+        self.failures = []
+
+    def close(self):
+        """
+        Flush the queued writes and stop the writer threads.
+        """
+        self.flush()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+def result_writer():
+    """
+    Returns the result writer of the current process, creating it on first use.
+
+    Returns:
+    - ResultWriter: The writer, configured by `writer_workers` and `writer_queue_size`.
+
+    Notes:
+        Writer threads do not survive a fork, so each forked worker process gets its own writer. Queued writes are
+        flushed when the interpreter exits; pool workers exit without running exit handlers and flush through
+        `finish_and_flush` instead.
+    """
+    global _result_writer
+    if _result_writer is None or _result_writer.pid != os.getpid():
+        _result_writer = ResultWriter(writer_workers, writer_queue_size)
+        atexit.register(_result_writer.flush)
+    return _result_writer
+
+_result_writer = None
+
+def flush_results():
+    """
+    Barrier: blocks until every figure and image queued by the current process is on disk.
+    """
+    if _result_writer is not None and _result_writer.pid == os.getpid():
+        _result_writer.flush()
+
+def close_results():
+    """
+    Flushes the writes queued by the current process and stops its writer threads; the next write starts new ones.
+    """
+    global _result_writer
+    if _result_writer is not None and _result_writer.pid == os.getpid():
+        _result_writer.close()
+    _result_writer = None
+
+OUTPUT_LEVELS = ('metrics', 'transforms', 'thumbnails', 'full') # each level also writes everything the previous ones do
+
+def output_enabled(level):
+    """
+    Returns whether the outputs of an output level are written at the configured `output_level`.
+
+    Parameters:
+    - level (str): One of `OUTPUT_LEVELS`: 'metrics' (printed errors only), 'transforms' (plus the transformation
+                 matrices as text files), 'thumbnails' (plus the figures and downscaled PNG images) or 'full' (plus the
+                 full-resolution PNG images).
+
+    Returns:
+    - bool: True if `output_level` is `level` or a more verbose one.
+
+    Raises:
+    - ValueError: If `level` or `output_level` is not an output level.
+    """
+    for name in (level, output_level):
+        if name not in OUTPUT_LEVELS:
+            raise ValueError("Unknown output level '{0}': expected one of {1}.".format(name, ', '.join(OUTPUT_LEVELS)))
+    return OUTPUT_LEVELS.index(output_level) >= OUTPUT_LEVELS.index(level)
+
+def save_transform(rpth, num, name, matrix):
+    """
+    Exports a transformation matrix as a text file, through the background `result_writer`.
+
+    Parameters:
+    - rpth (str): Directory path where the file will be saved.
+    - num (int or str): Identifier used to differentiate the output file names.
+    - name (str): Prefix of the file name, e.g. 'Homography_Matrix'.
+    - matrix (np.array): The matrix or coefficients to save.
+    """
+    result_writer().submit(np.savetxt, os.path.join(rpth, name + '_' + str(num) + '_.txt'), np.atleast_2d(matrix))
+
+def new_figure(nrows=1, ncols=1, figsize=None):
+    """
+    Creates a figure and its axes like `plt.subplots`.
+
+    Parameters:
+    - nrows, ncols (int, optional): Grid of axes. Default to 1.
+    - figsize (tuple, optional): Figure size in inches. Defaults to None, the matplotlib default.
+
+    Returns:
+    - tuple: (figure, axes), `axes` being a single Axes or an array of them like `plt.subplots`.
+
+    Notes:
+        Unless the figure is to be shown (see `show_figure`), it lives on a standalone Agg canvas that pyplot never
+        tracks, so it is freed as soon as it is saved and dropped, rather than accumulating in pyplot's list of open
+        figures over a run, and it can be saved on a writer thread.
+    """
+    if show_figures and multiprocessing.parent_process() is None:
+        return plt.subplots(nrows, ncols, figsize=figsize)
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.subplots(nrows, ncols)
+
+def show_figure(fig):
+    """
+    Displays a figure if `show_figures` is set, then releases it from pyplot.
+
+    Parameters:
+    - fig (matplotlib.figure.Figure): Figure created by `new_figure`.
+
+    Notes:
+        Figures drawn in the worker processes of `run_cases` are never displayed.
+    """
+    if show_figures and multiprocessing.parent_process() is None:
+        plt.show()
+    plt.close(fig)
+
+def correspondence_colors(num_points):
+    """
+    Returns the colors used to tell corresponding landmarks apart in the correspondence figures.
+
+    Parameters:
+    - num_points (int): Number of landmarks.
+
+    Returns:
+    - np.array: (num_points, 4) RGBA colors in [0, 1]; a cyclic colormap is used beyond 15 landmarks.
+    """
+    if num_points > 15:
+        cmap = plt.get_cmap('tab20')
+    else:
+        cmap = ListedColormap(["red", "yellow", "blue", "lime", "magenta", "indigo", "orange", "cyan", "darkgreen",
+                               "maroon", "black", "white", "chocolate", "gray", "blueviolet"])
+    return np.array([cmap(x) for x in range(num_points)])
+
+def add_landmarks(ax, landmarks, colors, radius1=4, radius2=1):
+    """
+    Marks color-coded landmarks on an image axes with a translucent disc and an opaque center dot each.
+
+    Parameters:
+    - ax (matplotlib.axes.Axes): Axes showing the image.
+    - landmarks (np.array): (N, 2) landmarks in pixel coordinates of the image.
+    - colors (np.array): (N, 4) RGBA colors in [0, 1] of the landmarks (see `correspondence_colors`).
+    - radius1 (float, optional): Radius in pixels of the translucent discs. Defaults to 4.
+    - radius2 (float, optional): Radius in pixels of the center dots. Defaults to 1.
+
+    Notes:
+        All the discs, and all the dots, form a single collection, so the cost of drawing hardly grows with the
+        number of landmarks, unlike one `plt.Circle` patch per point. Radii are in data units as with the patches.
+    """
+    landmarks = as_points(landmarks)
+    if len(landmarks) == 0:
+        return
+    for radius, alpha in ((radius1, 0.5), (radius2, None)):
+        ax.add_collection(EllipseCollection(2 * radius, 2 * radius, 0, units='xy', offsets=landmarks, offset_transform=ax.transData,
+                                            facecolors=colors, edgecolors='white', alpha=alpha), autolim=False)
+
+def draw_correspondences(panels, landmark_sets, colors, titles, suptitle, note=None, radius1=4, radius2=1):
+    """
+    Draws images side by side with their color-coded landmarks straight onto a numpy canvas with OpenCV, the
+    fast-render counterpart of the matplotlib correspondence figures.
+
+    Parameters:
+    - panels (list of np.array): RGB images of the same size.
+    - landmark_sets (list of np.array): (N, 2) landmarks of each panel, in pixel coordinates of the panel.
+    - colors (np.array): (N, 4) RGBA colors in [0, 1] of the landmarks (see `correspondence_colors`).
+    - titles (list of str): Title of each panel.
+    - suptitle (str): Title of the canvas.
+    - note (str, optional): Caption written under the panels. Defaults to None.
+    - radius1 (int, optional): Radius of the translucent disc marking a landmark. Defaults to 4.
+    - radius2 (int, optional): Radius of the opaque dot at its center. Defaults to 1.
+
+    Returns:
+    - np.array: The canvas in BGR layout, ready for `cv2.imwrite`.
+
+    Notes:
+        Landmarks are drawn with sub-pixel accuracy (4 fractional bits). Rendering costs a few milliseconds,
+        against a few hundred for the matplotlib figure.
+    """
+    height, width = panels[0].shape[:2]
+    margin, header, footer = 10, 60, 30 if note else 10
+    canvas = np.full((header + height + footer, len(panels) * (width + margin) + margin, 3), 255, np.uint8)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    def put_centered(text, cx, y, scale, thickness):
+        (w, _), _ = cv2.getTextSize(text, font, scale, thickness)
+        cv2.putText(canvas, text, (int(cx - w / 2), y), font, scale, (0, 0, 0), thickness, cv2.LINE_AA)
+    put_centered(suptitle, canvas.shape[1] / 2, 22, 0.6, 2)
+    rgb = [tuple(int(round(255 * c)) for c in color[:3]) for color in colors]
+    for k, (panel, landmarks, title) in enumerate(zip(panels, landmark_sets, titles)):
+        x0 = margin + k * (width + margin)
+        points = np.rint(as_points(landmarks) * 16).astype(int).tolist()
+        discs = panel.copy()
+        for (x, y), color in zip(points, rgb):
+            cv2.circle(discs, (x, y), radius1 * 16, color, -1, cv2.LINE_AA, shift=4)
+        # translucent discs first, then the opaque outlines and center dots, like the alpha=0.5 matplotlib patches
+        panel = cv2.addWeighted(discs, 0.5, panel, 0.5, 0)
+        for (x, y), color in zip(points, rgb):
+            cv2.circle(panel, (x, y), radius1 * 16, (255, 255, 255), 1, cv2.LINE_AA, shift=4)
+            cv2.circle(panel, (x, y), radius2 * 16, color, -1, cv2.LINE_AA, shift=4)
+        canvas[header:header + height, x0:x0 + width] = panel
+        put_centered(title, x0 + width / 2, header - 8, 0.5, 1)
+    if note:
+        put_centered(note, canvas.shape[1] / 2, header + height + 20, 0.45, 1)
+    return cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR)
+
 def plot_landmark_errors(landmark_errors,rpth,chrs='All',disable_outliers=False):
     """
     Plots a graph of landmark errors over successive iterations to provide a visual analysis of registration accuracy
@@ -794,26 +1577,29 @@ def plot_landmark_errors(landmark_errors,rpth,chrs='All',disable_outliers=False)
     - None: This function does not return any value but saves the plot to the specified path and displays it.
 
     Notes:
+        Nothing is drawn below the 'thumbnails' `output_level`.
         This plot is useful for tracking improvements or deteriorations in landmark detection algorithms over time.
         It automatically filters out error values set to 10000, considering them as outliers, unless disable_outliers
         is set to True.
         The function saves the plot in the directory specified by `rpth` and names it 'Landmark_Error_Plot.png'.
     """
+    if not output_enabled('thumbnails'):
+        return
     landmark_errors=outliers_plot_condition(landmark_errors,disable_outliers)
     samples = list(range(0, len(landmark_errors)))
     avg_error = sum(landmark_errors) / len(landmark_errors)
-    plt.figure(figsize=(12, 7))
-    plt.plot(samples, landmark_errors, marker='o', linestyle='-', color='#2C3E50', label="Landmark Error")
-    plt.axhline(y=avg_error, color='#E74C3C', linestyle='--', label=f"Average Error: {avg_error:.3f}")
-    plt.title("Mean Landmark Error for the entire Database Housing {} images".format(chrs), fontsize=14, fontweight='bold')
-    plt.xlabel("Iteration Number", fontsize=14)
-    plt.ylabel("Landmark Error", fontsize=14)
-    plt.xticks(samples, [f"Case {i}" for i in samples], rotation=45)
-    plt.grid(True, which='both', linestyle='--', linewidth=0.5)
-    plt.legend(fontsize=12)
-    plt.tight_layout()
-    plt.savefig(os.path.join(rpth,'Landmark_Error_Plot.png'))
-    plt.show();
+    fig, ax = new_figure(figsize=(12, 7))
+    ax.plot(samples, landmark_errors, marker='o', linestyle='-', color='#2C3E50', label="Landmark Error")
+    ax.axhline(y=avg_error, color='#E74C3C', linestyle='--', label=f"Average Error: {avg_error:.3f}")
+    ax.set_title("Mean Landmark Error for the entire Database Housing {} images".format(chrs), fontsize=14, fontweight='bold')
+    ax.set_xlabel("Iteration Number", fontsize=14)
+    ax.set_ylabel("Landmark Error", fontsize=14)
+    ax.set_xticks(samples, [f"Case {i}" for i in samples], rotation=45)
+    ax.grid(True, which='both', linestyle='--', linewidth=0.5)
+    ax.legend(fontsize=12)
+    fig.set_layout_engine('tight') # laid out when drawn, i.e. in the writer under its figure_lock
+    result_writer().figure(os.path.join(rpth,'Landmark_Error_Plot.png'), fig)
+    show_figure(fig)
 
 def image_point_correspondences(images,img_size,landmarks1,landmarks2,rpth,num,snum,disp_size=256,disp_clip=0.0):
     """
@@ -825,8 +1611,8 @@ def image_point_correspondences(images,img_size,landmarks1,landmarks2,rpth,num,s
     matching is crucial.
 
     Parameters:
-    - images (list of str): File paths to the two images (source and target images).
-    - img_size (int): The size to which images should be resized, specified as width and height (assumed square).
+    - images (list of str or np.array): File paths to, or decoded arrays of, the two images (source and target images).
+    - img_size (int or tuple of int): The size to which images should be resized, a side length or (height, width).
     - landmarks1 (list of tuples): Landmark points on the first image (source image).
     - landmarks2 (list of tuples): Corresponding landmark points on the second image (target image).
     - rpth (str): Path where the resultant visualization should be saved.
@@ -839,19 +1625,29 @@ def image_point_correspondences(images,img_size,landmarks1,landmarks2,rpth,num,s
     - None: This function directly displays the image using matplotlib and saves the output visualization to disk.
 
     Notes:
-        The function uses OpenCV for reading and resizing images. It employs a CLAHE function to enhance image contrast.
-        Matplotlib is used for visualizing the images and landmarks. The color map switches based on the number
+        Nothing is drawn below the 'thumbnails' `output_level`.
+        The function uses OpenCV for reading and resizing images. With `fast_render` the figure is drawn with OpenCV
+        as well (see `draw_correspondences`). It employs a CLAHE function to enhance image contrast.
+        Matplotlib is used for visualizing the images and landmarks (see `add_landmarks`). The color map switches based on the number
         of landmarks; if there are more than 15 landmarks, a cyclic colormap is used to differentiate them.
         This function is particularly useful for visualizing transformations and registrations in medical imaging or
         similar fields where point correspondence is critical.
     """
-    image1 = CLAHE_plot_cond(cv2.cvtColor(cv2.resize(cv2.imread(images[0]),(disp_size,disp_size)), cv2.COLOR_BGR2RGB),disp_clip)
-    image2 = CLAHE_plot_cond(cv2.cvtColor(cv2.resize(cv2.imread(images[1]),(disp_size,disp_size)), cv2.COLOR_BGR2RGB),disp_clip)
-    landmarks1 = coordinates_rescaling(landmarks1,img_size,img_size,disp_size)
-    landmarks2 = coordinates_rescaling(landmarks2,img_size,img_size,disp_size)
+    if not output_enabled('thumbnails'):
+        return
+    image1 = CLAHE_plot_cond(cv2.cvtColor(cv2.resize(read_image(images[0]),(disp_size,disp_size)), cv2.COLOR_BGR2RGB),disp_clip)
+    image2 = CLAHE_plot_cond(cv2.cvtColor(cv2.resize(read_image(images[1]),(disp_size,disp_size)), cv2.COLOR_BGR2RGB),disp_clip)
+    landmarks1 = coordinates_rescaling(landmarks1,*grid_size(img_size),disp_size)
+    landmarks2 = coordinates_rescaling(landmarks2,*grid_size(img_size),disp_size)
     assert len(landmarks1) == len(landmarks2), f"points lengths are incompatible: {len(landmarks1)} != {len(landmarks2)}."
     num_points = len(landmarks1)
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 6))
+    colors = correspondence_colors(num_points)
+    note = "Note: {0} point correspondences were identified by the model for stage-{1}".format(num_points, snum)
+    path = os.path.join(rpth,'Stage'+str(snum)+'Point_Correspondences'+str(num)+'.png')
+    if fast_render:
+        result_writer().image(path, draw_correspondences([image1, image2], [landmarks1, landmarks2], colors, ['Fixed Image', 'Moving Image'], "Stage-{} Point Correspondences".format(snum), note))
+        return
+    fig, (ax1, ax2) = new_figure(1, 2, figsize=(12, 6))
     fig.suptitle("Stage-{} Point Correspondences".format(snum), fontsize=14, fontweight='bold', y=0.925)
     ax1.set_title('Fixed Image')
     ax2.set_title('Moving Image')
@@ -859,27 +1655,11 @@ def image_point_correspondences(images,img_size,landmarks1,landmarks2,rpth,num,s
     ax2.axis('off')
     ax1.imshow(image1)
     ax2.imshow(image2)
-    if num_points > 15:
-        cmap = plt.get_cmap('tab20')
-    else:
-        cmap = ListedColormap(["red", "yellow", "blue", "lime", "magenta", "indigo", "orange", "cyan", "darkgreen",
-                               "maroon", "black", "white", "chocolate", "gray", "blueviolet"])
-    colors = np.array([cmap(x) for x in range(len(landmarks1))])
-    radius1, radius2 = 4, 1
-    for point1, point2, color in zip(landmarks1, landmarks2, colors):
-        x1, y1 = point1
-        circ1_1 = plt.Circle((x1, y1), radius1, facecolor=color, edgecolor='white', alpha=0.5)
-        circ1_2 = plt.Circle((x1, y1), radius2, facecolor=color, edgecolor='white')
-        ax1.add_patch(circ1_1)
-        ax1.add_patch(circ1_2)
-        x2, y2 = point2
-        circ2_1 = plt.Circle((x2, y2), radius1, facecolor=color, edgecolor='white', alpha=0.5)
-        circ2_2 = plt.Circle((x2, y2), radius2, facecolor=color, edgecolor='white')
-        ax2.add_patch(circ2_1)
-        ax2.add_patch(circ2_2)
-    plt.figtext(0.5, 0.115, "Note: {0} point correspondences were identified by the model for stage-{1}".format(len(landmarks1), snum), ha='center', fontweight='bold', fontsize=8.5)
-    plt.savefig(os.path.join(rpth,'Stage'+str(snum)+'Point_Correspondences'+str(num)+'.png'))
-    plt.show();
+    add_landmarks(ax1, landmarks1, colors)
+    add_landmarks(ax2, landmarks2, colors)
+    fig.text(0.5, 0.115, note, ha='center', fontweight='bold', fontsize=8.5)
+    result_writer().figure(path, fig)
+    show_figure(fig)
 
 def original_image_point_correspondences(images,orig_moving_image_pth,img_size, landmarks1, landmarks2, landmarks3, rpth, num, disp_size=256,disp_clip=0.0):
     """
@@ -890,7 +1670,7 @@ def original_image_point_correspondences(images,orig_moving_image_pth,img_size,
     Parameters:
     - images (list of np.array): List containing three images representing fixed, moving, and transformed states.
     - orig_moving_image_pth (str): Path to the original moving image, used to update the second image in the list.
-    - img_size (tuple): Original dimensions (width, height) of the images prior to any processing.
+    - img_size (int or tuple of int): Working grid of the landmarks, a side length or (height, width).
     - landmarks1 (list of tuples): Coordinates of landmarks in the fixed image.
     - landmarks2 (list of tuples): Coordinates of landmarks in the original moving image.
     - landmarks3 (list of tuples): Coordinates of landmarks in the transformed image.
@@ -903,14 +1683,32 @@ def original_image_point_correspondences(images,orig_moving_image_pth,img_size,
     - AssertionError: If the number of landmarks in any list does not match the others.
 
     Notes:
+        Nothing is drawn below the 'thumbnails' `output_level`.
         The images are resized to `disp_size` for display.
         Landmarks are also rescaled to match the display size.
         A colormap is applied to distinguish between different landmarks; a larger colormap is used if landmarks exceed 15.
+        With `fast_render` the figure is drawn with OpenCV (see `draw_correspondences`).
     """
     assert len(landmarks1) == len(landmarks2) == len(landmarks3), "All landmarks lists must have the same length."
-    images[1]=cv2.imread(orig_moving_image_pth) # replacing the deformed image with the original moving image for displaying final results
+    if not output_enabled('thumbnails'):
+        return
+    images[1]=read_image(orig_moving_image_pth) # replacing the deformed image with the original moving image for displaying final results
     num_points = len(landmarks1)
-    fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(18, 6))
+    image1 = CLAHE_plot_cond(cv2.cvtColor(cv2.resize(images[0],(disp_size,disp_size)), cv2.COLOR_BGR2RGB),disp_clip)
+    image2 = CLAHE_plot_cond(cv2.cvtColor(cv2.resize(images[1],(disp_size,disp_size)), cv2.COLOR_BGR2RGB),disp_clip)
+    image3 = CLAHE_plot_cond(cv2.cvtColor(cv2.resize(images[2].astype(np.uint8),(disp_size,disp_size)), cv2.COLOR_BGR2RGB),disp_clip)
+
+    landmarks1 = coordinates_rescaling(landmarks1,*grid_size(img_size),disp_size)
+    landmarks2 = coordinates_rescaling(landmarks2,*grid_size(img_size),disp_size)
+    landmarks3 = coordinates_rescaling(landmarks3,*grid_size(img_size),disp_size)
+
+    colors = correspondence_colors(num_points)
+    path = os.path.join(rpth, 'Final_Registration_Results_for_case' + str(num) + '.png')
+    if fast_render:
+        result_writer().image(path, draw_correspondences([image1, image2, image3], [landmarks1, landmarks2, landmarks3], colors, ['Fixed Image', 'Moving Image', 'Deformed Image'], "Final Registration Results by Composing Transformations Estimated in Two Stages"))
+        return
+
+    fig, (ax1, ax2, ax3) = new_figure(1, 3, figsize=(18, 6))
     fig.suptitle("Final Registration Results by Composing Transformations Estimated in Two Stages", fontsize=14, fontweight='bold',y=0.925)
 
     ax1.set_title('Fixed Image')
@@ -921,129 +1719,81 @@ def original_image_point_correspondences(images,orig_moving_image_pth,img_size,
     ax2.axis('off')
     ax3.axis('off')
 
-    ax1.imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(images[0],(disp_size,disp_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    ax2.imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(images[1],(disp_size,disp_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    ax3.imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(images[2].astype(np.uint8),(disp_size,disp_size)), cv2.COLOR_BGR2RGB),disp_clip))
-
-    landmarks1 = coordinates_rescaling(landmarks1,img_size,img_size,disp_size)
-    landmarks2 = coordinates_rescaling(landmarks2,img_size,img_size,disp_size)
-    landmarks3 = coordinates_rescaling(landmarks3,img_size,img_size,disp_size)
+    ax1.imshow(image1)
+    ax2.imshow(image2)
+    ax3.imshow(image3)
 
-    if num_points > 15:
-        cmap = plt.get_cmap('tab20')
-    else:
-        cmap = ListedColormap(["red", "yellow", "blue", "lime", "magenta", "indigo", "orange", "cyan", "darkgreen",
-                               "maroon", "black", "white", "chocolate", "gray", "blueviolet"])
+    add_landmarks(ax1, landmarks1, colors)
+    add_landmarks(ax2, landmarks2, colors)
+    add_landmarks(ax3, landmarks3, colors)
 
-    colors = np.array([cmap(x) for x in range(num_points)])
-    radius1, radius2 = 4, 1
-
-    for point1, point2, point3, color in zip(landmarks1, landmarks2, landmarks3, colors):
-        # Landmarks for Image 1
-        x1, y1 = point1
-        circ1_1 = plt.Circle((x1, y1), radius1, facecolor=color, edgecolor='white', alpha=0.5)
-        circ1_2 = plt.Circle((x1, y1), radius2, facecolor=color, edgecolor='white')
-        ax1.add_patch(circ1_1)
-        ax1.add_patch(circ1_2)
-
-        # Landmarks for Image 2
-        x2, y2 = point2
-        circ2_1 = plt.Circle((x2, y2), radius1, facecolor=color, edgecolor='white', alpha=0.5)
-        circ2_2 = plt.Circle((x2, y2), radius2, facecolor=color, edgecolor='white')
-        ax2.add_patch(circ2_1)
-        ax2.add_patch(circ2_2)
-
-        # Landmarks for Image 3
-        x3, y3 = point3
-        circ3_1 = plt.Circle((x3, y3), radius1, facecolor=color, edgecolor='white', alpha=0.5)
-        circ3_2 = plt.Circle((x3, y3), radius2, facecolor=color, edgecolor='white')
-        ax3.add_patch(circ3_1)
-        ax3.add_patch(circ3_2)
-
-    plt.savefig(os.path.join(rpth, 'Final_Registration_Results_for_case' + str(num) + '.png'))
-    plt.show();
+    result_writer().figure(path, fig)
+    show_figure(fig)
 
 def coordinates_rescaling_high_scale(pnts,H,W,img_shape):
     """
     Rescale a list of coordinates based on given height and width ratios.
 
     Parameters:
-    - pnts (list of tuples): List of (x, y) coordinates to be rescaled.
+    - pnts (np.array): (N, 2) array (or list of tuples) of (x, y) coordinates to be rescaled.
     - H (int): Original height.
     - W (int): Original width.
-    - img_shape (int): Desired image dimension (assumes square shape).
+    - img_shape (tuple): Desired image dimensions (height, width).
 
     Returns:
-    - list of tuples: List of rescaled (x, y) coordinates.
+    - np.array: (N, 2) array of rescaled (x, y) coordinates.
     """
-    scaled_points=[]
-    for row in pnts:
-        a = (row[0]/W)*img_shape[1]
-        b = (row[1]/H)*img_shape[0]
-        scaled_points.append((a,b))
-    return scaled_points
+    return as_points(pnts) * np.float32([img_shape[1] / W, img_shape[0] / H])
 
 def transform_points_affine(moving_points, affine_matrix):
     """
     Transform the moving points using the given affine matrix.
 
     Parameters:
-    - moving_points: List of (x, y) tuples
-    - affine_matrix: (3x3) affine matrix
+    - moving_points: (N, 2) array (or list of (x, y) tuples)
+    - affine_matrix: (3x3) or (2x3) affine matrix
 
     Returns:
-    - List of (x, y) tuples representing transformed points
+    - (N, 2) array of the transformed points
     """
-    points_array = np.array(moving_points)
-    homogeneous_points = np.hstack([points_array, np.ones((len(moving_points), 1))])
-    transformed_points = np.dot(homogeneous_points, affine_matrix.T)
-    return [tuple(point) for point in transformed_points[:, :2]]
+    affine_matrix = np.asarray(affine_matrix, dtype=np.float64)
+    return as_points(as_points(moving_points) @ affine_matrix[:2, :2].T + affine_matrix[:2, 2])
 
 def transform_points_homography(moving_points, homography_matrix):
     """
     Transform the moving points using the given homography matrix.
 
     Parameters:
-    - moving_points: List of (x, y) tuples
+    - moving_points: (N, 2) array (or list of (x, y) tuples)
     - homography_matrix: (3x3) homography matrix
 
     Returns:
-    - List of (x, y) tuples representing transformed points
+    - (N, 2) array of the transformed points
     """
-    points_array = np.array(moving_points)
-    homogeneous_points = np.hstack([points_array, np.ones((len(moving_points), 1))])
-    transformed_points = np.dot(homogeneous_points, homography_matrix.T)
+    homogeneous_points = np.hstack([as_points(moving_points), np.ones((len(moving_points), 1))])
+    transformed_points = np.dot(homogeneous_points, np.asarray(homography_matrix, dtype=np.float64).T)
     transformed_points /= transformed_points[:, 2][:, np.newaxis]  # Normalize by z-coordinate
-    return [tuple(point[:2]) for point in transformed_points]
+    return as_points(transformed_points[:, :2])
 
 def transform_points_third_order_polynomial(moving_points, coefficients):
     """
     Transform the moving points using the given third-order polynomial coefficients.
 
     Parameters:
-    - moving_points: List of (x, y) tuples
+    - moving_points: (N, 2) array (or list of (x, y) tuples)
     - coefficients: Array of 20 coefficients for the third-order polynomial transformation
 
     Returns:
-    - List of (x, y) tuples representing transformed points
+    - (N, 2) array of the transformed points
     """
     if len(coefficients) != 20:
         raise ValueError("Coefficients should have a shape of (20,).")
 
-    # Extract the coefficients
-    a1, a2, a3, a4, a5, a6, a7, a8, a9, a10, \
-    a11, a12, a13, a14, a15, a16, a17, a18, a19, a20 = coefficients
+    # x' = a1*x**3 + a2*x**2*y + a3*x*y**2 + a4*y**3 + a5*x**2 + a6*x*y + a7*y**2 + a8*x + a9*y + a10, y' with a11..a20
+    coefficients = np.asarray(coefficients, dtype=np.float64).reshape(2, -1).T
+    transformed_points = polynomial_design_matrix(as_points(moving_points), THIRD_ORDER_EXPONENTS) @ coefficients
 
-    transformed_points = []
-    for x, y in moving_points:
-        # Compute new x' and y' for each point using third-order polynomial
-        x_prime = (a1*x**3 + a2*x**2*y + a3*x*y**2 + a4*y**3 +
-                   a5*x**2 + a6*x*y + a7*y**2 + a8*x + a9*y + a10)
-        y_prime = (a11*x**3 + a12*x**2*y + a13*x*y**2 + a14*y**3 +
-                   a15*x**2 + a16*x*y + a17*y**2 + a18*x + a19*y + a20)
-        transformed_points.append((x_prime, y_prime))
-
-    return transformed_points
+    return as_points(transformed_points)
 
 def transform_points_quadratic(points, coefficients):
     """
@@ -1051,11 +1801,11 @@ def transform_points_quadratic(points, coefficients):
     typically used in image processing and computer vision tasks to deform points according to a quadratic model.
 
     Parameters:
-    - points (list of tuples): A list of points, where each point is represented as a tuple (x, y).
+    - points (np.array): (N, 2) array (or list of (x, y) tuples) of the points.
     - coefficients (list): A list of 12 coefficients for the quadratic transformation model.
 
     Returns:
-    - list: A list of tuples representing the deformed points.
+    - np.array: (N, 2) array of the deformed points.
 
     Raises:
     - ValueError: If the number of coefficients is not equal to 12, as the quadratic model requires exactly 12 coefficients.
@@ -1070,15 +1820,10 @@ def transform_points_quadratic(points, coefficients):
     if len(coefficients) != 12:
         raise ValueError("Coefficients should have a shape of (12,).")
 
-    a1, a2, a3, a4, a5, a6, a7, a8, a9, a10, a11, a12 = coefficients
-
-    deformed = []
-    for x, y in points:
-        x_prime = a1*x + a2*y + a3*x*y + a4*x**2 + a5*y**2 + a6
-        y_prime = a7*x + a8*y + a9*x*y + a10*x**2 + a11*y**2 + a12
-        deformed.append((x_prime, y_prime))
+    coefficients = np.asarray(coefficients, dtype=np.float64).reshape(2, -1).T
+    deformed = polynomial_design_matrix(as_points(points), QUADRATIC_EXPONENTS) @ coefficients
 
-    return deformed
+    return as_points(deformed)
 
 def compute_landmark_error_fixed_space(polynomial_matrix,fixed_points,moving_points,new_image_size,image_size):
     """
@@ -1128,36 +1873,166 @@ def compute_landmark_error(fixed_points,fixed_image_size,moving_points,moving_im
     mle = np.mean(errors)
     return mle
 
-def compute_third_order_polynomial_matrix(landmarks1, landmarks2):
+THIRD_ORDER_EXPONENTS = ((3, 0), (2, 1), (1, 2), (0, 3), (2, 0), (1, 1), (0, 2), (1, 0), (0, 1), (0, 0)) # (x, y) powers of a1..a10
+QUADRATIC_EXPONENTS = ((1, 0), (0, 1), (1, 1), (2, 0), (0, 2), (0, 0)) # (x, y) powers of a1..a6
+POLYNOMIAL_MODELS = {'quadratic': QUADRATIC_EXPONENTS, 'third_order': THIRD_ORDER_EXPONENTS}
+
+def polynomial_design_matrix(points, exponents):
     """
-    Compute coefficients for the third-order polynomial transformation.
+    Builds the design matrix of a polynomial in x and y with array operations.
 
     Parameters:
-    - landmarks1 (list): List of (x, y) tuples of landmarks in the first image.
-    - landmarks2 (list): List of (x, y) tuples of landmarks in the second image.
+    - points (array-like): (N, 2) array or list of (x, y) tuples.
+    - exponents (tuple of tuples): The K (x, y) powers of the monomials, e.g. `THIRD_ORDER_EXPONENTS`.
 
     Returns:
-    - np.array: Coefficients of the third-order polynomial transformation.
+    - np.array: (N, K) float64 matrix whose column k holds x**i * y**j for the k-th (i, j) in `exponents`.
     """
-    if len(landmarks1) != len(landmarks2) or len(landmarks1) < 10:
-        raise ValueError("Both landmarks should have the same number of points, and at least 10 points are required.")
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    degree = max(max(i, j) for i, j in exponents)
+    powers = np.ones((degree + 1,) + points.shape) # powers[d] = (x**d, y**d)
+    for d in range(1, degree + 1):
+        np.multiply(powers[d - 1], points, out=powers[d])
+    A = np.empty((len(points), len(exponents)))
+    for k, (i, j) in enumerate(exponents):
+        np.multiply(powers[i, :, 0], powers[j, :, 1], out=A[:, k])
+    return A
+
+def point_normalisation(points):
+    """
+    Computes the centre and scale that map a point set into [-1, 1], for well-conditioned polynomial fits.
 
-    A = []
-    B = []
+    Parameters:
+    - points (np.array): (N, 2) array of (x, y) coordinates.
 
-    for (x, y), (x_prime, y_prime) in zip(landmarks1, landmarks2):
-        # For x'
-        A.append([x**3, x**2 * y, x * y**2, y**3, x**2, x * y, y**2, x, y, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-        # For y'
-        A.append([0, 0, 0, 0, 0, 0, 0, 0, 0, 0, x**3, x**2 * y, x * y**2, y**3, x**2, x * y, y**2, x, y, 1])
+    Returns:
+    - tuple: The centre (np.array of 2) and the isotropic scale (float) of the points.
+    """
+    centre = (points.min(axis=0) + points.max(axis=0)) / 2
+    scale = np.abs(points - centre).max()
+    return centre, (scale if scale > 0 else 1.0)
 
-        B.extend([x_prime, y_prime])
+def polynomial_basis_change(exponents, centre, scale):
+    """
+    Computes the matrix converting the coefficients of a polynomial in normalised coordinates
+    u = (x - cx) / scale, v = (y - cy) / scale into the coefficients of the same polynomial in x and y.
+
+    Parameters:
+    - exponents (tuple of tuples): The K (x, y) powers of the monomials. Every power obtained by lowering
+                                 one of them must also be present, as in `THIRD_ORDER_EXPONENTS`.
+    - centre (array): The centre (cx, cy) of the normalisation.
+    - scale (float): The scale of the normalisation.
 
-    A = np.array(A)
-    B = np.array(B)
+    Returns:
+    - np.array: (K, K) matrix T such that the coefficients in x, y are T @ (coefficients in u, v).
+    """
+    index = {power: k for k, power in enumerate(exponents)}
+    cx, cy = centre
+    T = np.zeros((len(exponents), len(exponents)))
+    for k, (i, j) in enumerate(exponents):
+        # u**i * v**j = scale**-(i+j) * sum_a,b C(i,a) C(j,b) (-cx)**(i-a) (-cy)**(j-b) x**a y**b
+        for a in range(i + 1):
+            for b in range(j + 1):
+                T[index[(a, b)], k] += math.comb(i, a) * math.comb(j, b) * (-cx) ** (i - a) * (-cy) ** (j - b) / scale ** (i + j)
+    return T
+
+def irls_least_squares(A, b, loss='huber', max_iterations=50, tolerance=1e-3):
+    """
+    Solves A x = b by iteratively reweighted least squares (IRLS), down-weighting equations with large residuals.
+
+    Parameters:
+    - A (np.array): (N, K) design matrix, shared by all right-hand sides.
+    - b (np.array): (N, M) right-hand sides; row i holds the M coordinates of observation i.
+    - loss (str, optional): Robust loss, 'huber' or 'tukey'. Defaults to 'huber'.
+    - max_iterations (int, optional): Maximum number of reweighting iterations. Defaults to 50.
+    - tolerance (float, optional): Iterations stop once no weight changes by more than this. Defaults to 1e-3.
+
+    Returns:
+    - tuple: The (K, M) solution and the (N,) final weights of the observations (0 for rejected outliers with 'tukey').
+
+    Notes:
+        A is factorised once, A = QR. Each iteration then only solves the K x K system (Q^T W Q) z = Q^T W b and
+        recovers x from R x = z, instead of refactorising the weighted problem. Residuals are the Euclidean norms over
+        the M coordinates and are scaled by their median absolute value (MAD); the Huber threshold is 1.345 and the
+        Tukey threshold 4.685 times that scale.
+    """
+    Q, R = np.linalg.qr(A)
+    diagonal = np.abs(np.diag(R))
+    if diagonal.min() <= 1e-10 * diagonal.max():
+        # Rank deficient: plain least squares, without reweighting
+        return np.linalg.lstsq(A, b, rcond=None)[0], np.ones(len(A))
+    solution = np.linalg.solve(R, Q.T @ b)
+    weights = np.ones(len(A))
+    for _ in range(max_iterations):
+        residuals = np.linalg.norm(A @ solution - b, axis=1)
+        sigma = 1.4826 * np.median(residuals)
+        if sigma <= 0:
+            break # exact fit of the majority
+        if loss == 'huber':
+            new_weights = np.minimum(1, 1.345 * sigma / np.maximum(residuals, 1e-300))
+        elif loss == 'tukey':
+            new_weights = np.clip(1 - (residuals / (4.685 * sigma)) ** 2, 0, None) ** 2
+        else:
+            raise ValueError("Unknown loss '{}': expected 'huber' or 'tukey'.".format(loss))
+        if np.count_nonzero(new_weights) < A.shape[1]:
+            break # too few observations left to determine the model
+        converged = np.abs(new_weights - weights).max() < tolerance
+        weights = new_weights
+        weighted_Q = Q * weights[:, np.newaxis]
+        solution = np.linalg.solve(R, np.linalg.solve(Q.T @ weighted_Q, weighted_Q.T @ b))
+        if converged:
+            break
+    return solution, weights
+
+def compute_polynomial_matrix(landmarks1, landmarks2, exponents, loss=None):
+    """
+    Fits a polynomial transformation mapping landmarks1 onto landmarks2 by linear least squares.
+
+    Parameters:
+    - landmarks1 (array-like): (N, 2) array or list of (x, y) tuples of landmarks in the first image.
+    - landmarks2 (array-like): (N, 2) array or list of (x, y) tuples of landmarks in the second image.
+    - exponents (tuple of tuples): The K (x, y) powers of the monomials of the polynomial.
+    - loss (str, optional): None for ordinary least squares, or 'huber'/'tukey' for a robust fit by
+                          `irls_least_squares`. Defaults to None.
+
+    Returns:
+    - np.array: The 2*K coefficients, first the K of x' and then the K of y', in the order of `exponents`.
+
+    Notes:
+        x' and y' share the same design matrix, so they are solved as one N x K problem with two right-hand
+        sides rather than a block-diagonal 2N x 2K one. The source points are normalised to [-1, 1] for the
+        solve, which keeps the problem well conditioned at 4000-pixel scales, and the coefficients are then
+        converted back to pixel coordinates.
+    """
+    landmarks1 = np.asarray(landmarks1, dtype=np.float64).reshape(-1, 2)
+    landmarks2 = np.asarray(landmarks2, dtype=np.float64).reshape(-1, 2)
+    centre, scale = point_normalisation(landmarks1)
+    A = polynomial_design_matrix((landmarks1 - centre) / scale, exponents)
+    if loss is None:
+        solution, _, _, _ = np.linalg.lstsq(A, landmarks2, rcond=None)
+    else:
+        solution, _ = irls_least_squares(A, landmarks2, loss)
+    coefficients = polynomial_basis_change(exponents, centre, scale) @ solution # (K, 2)
+    return coefficients.T.reshape(-1)
+
+def compute_third_order_polynomial_matrix(landmarks1, landmarks2, loss=None):
+    """
+    Compute coefficients for the third-order polynomial transformation.
+
+    Parameters:
+    - landmarks1 (list): List of (x, y) tuples of landmarks in the first image.
+    - landmarks2 (list): List of (x, y) tuples of landmarks in the second image.
+    - loss (str, optional): None for ordinary least squares, or 'huber'/'tukey' to fit by iteratively reweighted
+                          least squares, which limits the influence of leftover outliers. Defaults to None.
+
+    Returns:
+    - np.array: Coefficients of the third-order polynomial transformation.
+    """
+    if len(landmarks1) != len(landmarks2) or len(landmarks1) < 10:
+        raise ValueError("Both landmarks should have the same number of points, and at least 10 points are required.")
 
-    # Solve the linear system
-    coefficients, _, _, _ = np.linalg.lstsq(A, B, rcond=None)
+    # Normalised, vectorised least squares (see compute_polynomial_matrix)
+    coefficients = compute_polynomial_matrix(landmarks1, landmarks2, THIRD_ORDER_EXPONENTS, loss)
 
     return coefficients  # The shape of coefficients is (20,)
 
@@ -1175,54 +2050,100 @@ def compute_quadratic_matrix(landmarks1, landmarks2):
     if len(landmarks1) != len(landmarks2) or len(landmarks1) < 6:
         raise ValueError("Both landmarks should have the same number of points, and at least 6 points are required.")
 
-    A = []
-    B = []
+    # Normalised, vectorised least squares (see compute_polynomial_matrix)
+    coefficients = compute_polynomial_matrix(landmarks1, landmarks2, QUADRATIC_EXPONENTS)
 
-    for (x, y), (x_prime, y_prime) in zip(landmarks1, landmarks2):
-        A.append([x, y, x*y, x*x, y*y, 1, 0, 0, 0, 0, 0, 0])
-        A.append([0, 0, 0, 0, 0, 0, x, y, x*y, x*x, y*y, 1])
+    return coefficients
 
-        B.append(x_prime)
-        B.append(y_prime)
 
-    A = np.array(A)
-    B = np.array(B)
+def batched_least_squares(A, b, weights=None):
+    """
+    Solves a stack of (weighted) linear least-squares problems A x = b with one QR factorisation per problem.
 
-    # Solve the linear system
-    coefficients, _, _, _ = np.linalg.lstsq(A, B, rcond=None)
+    Parameters:
+    - A (np.array): (B, N, K) design matrices.
+    - b (np.array): (B, N, M) right-hand sides, all solved from the same factorisation.
+    - weights (np.array, optional): (B, N) or (N,) non-negative weights of the equations. Defaults to None, all ones.
 
-    return coefficients
+    Returns:
+    - tuple: Contains two items:
+        - np.array: (B, K, M) solutions.
+        - np.array: (B,) boolean flags, False where A is rank deficient and the solution is not defined.
+    """
+    if weights is not None:
+        root_weights = np.sqrt(np.broadcast_to(np.asarray(weights, dtype=np.float64), A.shape[:2]))[:, :, np.newaxis]
+        A, b = A * root_weights, b * root_weights
+    Q, R = np.linalg.qr(A) # A = QR, with R (B, KxK) upper triangular
+    diagonal = np.abs(np.diagonal(R, axis1=1, axis2=2))
+    valid = diagonal.min(axis=1) > 1e-10 * np.maximum(diagonal.max(axis=1), 1e-300)
+    R[~valid] = np.eye(R.shape[-1]) # keep the solve defined; flagged as invalid
+    return np.linalg.solve(R, np.swapaxes(Q, 1, 2) @ b), valid
+
+def compute_affine_matrices(landmarks1, landmarks2, weights=None):
+    """
+    Fits many affine transformations at once, one per batch of landmark correspondences, by (weighted) least squares.
+
+    Parameters:
+    - landmarks1 (np.array): (B, N, 2) source points of the B batches (a single (N, 2) set is treated as B=1).
+    - landmarks2 (np.array): (B, N, 2) corresponding target points.
+    - weights (np.array, optional): (B, N) or (N,) non-negative weights of the correspondences. Defaults to None,
+                                  all ones.
 
+    Returns:
+    - tuple: Contains two items:
+        - np.array: (B, 3x3) affine matrices mapping landmarks1 onto landmarks2.
+        - np.array: (B,) boolean flags, False where the points of a batch are degenerate (e.g. collinear) and the
+                    matrix is not defined; those matrices are filled with NaN.
 
-def compute_affine_matrix(landmarks1, landmarks2):
+    Notes:
+        Each batch is solved from one QR factorisation of its design matrix [x y 1], shared by the x' and y' outputs,
+        instead of inverting the normal equations (which squares the condition number). Points are centred and scaled
+        per batch before factorising. With N=3 this fits the minimal samples of a RANSAC loop in a single call.
+    """
+    landmarks1 = np.asarray(landmarks1, dtype=np.float64)
+    landmarks2 = np.asarray(landmarks2, dtype=np.float64)
+    if landmarks1.ndim == 2:
+        landmarks1, landmarks2 = landmarks1[np.newaxis], landmarks2[np.newaxis]
+    num_batches, num_points = landmarks1.shape[:2]
+
+    # Normalise each batch: u = (x - centre) / scale
+    centre = landmarks1.mean(axis=1, keepdims=True)
+    scale = np.abs(landmarks1 - centre).max(axis=(1, 2), keepdims=True)
+    scale[scale == 0] = 1
+    A = np.concatenate([(landmarks1 - centre) / scale, np.ones((num_batches, num_points, 1))], axis=2)
+    solution, valid = batched_least_squares(A, landmarks2, weights) # (B, 3, 2): columns are the x' and y' rows
+
+    # Undo the normalisation: [x' y'] = solution.T @ [(x - c) / s, 1]
+    matrices = np.zeros((num_batches, 3, 3))
+    matrices[:, :2, :2] = np.swapaxes(solution[:, :2], 1, 2) / scale
+    matrices[:, :2, 2] = solution[:, 2] - np.einsum('bij,bj->bi', matrices[:, :2, :2], centre[:, 0])
+    matrices[:, 2, 2] = 1
+    matrices[~valid] = np.nan
+    return matrices, valid
+
+def compute_affine_matrix(landmarks1, landmarks2, weights=None):
     """
     Compute the Affine matrix using provided landmarks.
 
     Parameters:
     - landmarks1: List of (x, y) tuples from the source image.
     - landmarks2: List of (x, y) tuples from the target image.
+    - weights: Optional list of non-negative weights, one per correspondence. Defaults to None, all ones.
 
     Returns:
     - Affine matrix.
+
+    Raises:
+    - np.linalg.LinAlgError: If the points are degenerate (e.g. all collinear).
     """
     if len(landmarks1) != len(landmarks2) or len(landmarks1) < 6:
         raise ValueError("Both landmarks should have the same number of points, and at least 6 points are required.")
 
-    A = np.array([[xs, ys, 1] for xs, ys in landmarks1])
-
-    X = np.array([xt for xt, yt in landmarks2])
-    Y = np.array([yt for xt, yt in landmarks2])
-
-    # Solve for the variables x1, y1, and z1
-    sol1 = np.dot(np.dot(np.linalg.inv(np.dot(A.T,A)),A.T),X)
-    sol2 = np.dot(np.dot(np.linalg.inv(np.dot(A.T,A)),A.T),Y)
-
-    # Extract the variables
-    x1, y1, z1 = sol1
-    x2, y2, z2 = sol2
-    affine_matrix = np.array([[x1,y1,z1],
-                           [x2,y2,z2],
-                           [0, 0, 1]])
+    # One QR factorisation shared by x' and y' (see compute_affine_matrices)
+    affine_matrices, valid = compute_affine_matrices(landmarks1, landmarks2, weights)
+    if not valid[0]:
+        raise np.linalg.LinAlgError("Singular matrix: the landmarks do not determine an affine transformation.")
+    affine_matrix = affine_matrices[0]
 
     return affine_matrix
 
@@ -1240,7 +2161,7 @@ def compute_homography_matrix(landmarks1, landmarks2):
     homography_matrix, _ = cv2.findHomography(np.array(landmarks1), np.array(landmarks2))
     return homography_matrix
 
-def transform_points_third_order_polynomial_matrix(landmarks1, landmarks2,img_size,new_img_size):
+def transform_points_third_order_polynomial_matrix(landmarks1, landmarks2,img_size,new_img_size,loss=None):
     """
     Computes a third-order polynomial transformation matrix based on rescaled landmark points from one image space
     to another. This transformation is typically used for tasks like geometric transformation of images where precise
@@ -1250,10 +2171,13 @@ def transform_points_third_order_polynomial_matrix(landmarks1, landmarks2,img_si
     - landmarks1 (list of tuples): List of original landmark points in the source image given as (x, y) tuples.
     - landmarks2 (list of tuples): List of corresponding landmark points in the target image given as (x, y) tuples.
                                  The points in landmarks2 should correspond one-to-one with those in landmarks1.
-    - img_size (int): Original size of the images from which the landmarks were extracted. This is used to help
-                    rescale points for accurate computation of the transformation matrix.
-    - new_img_size (int): New size to which the points will be rescaled before computing the transformation matrix.
+    - img_size (int or tuple of int): Original size of the images from which the landmarks were extracted, a side
+                    length or (height, width). This is used to help rescale points for accurate computation of the
+                    transformation matrix.
+    - new_img_size (int or tuple of int): New size, a side length or (height, width), to which the points will be
+                        rescaled before computing the transformation matrix.
                         This should reflect the size of the image space into which the points will be transformed.
+    - loss (str, optional): Robust loss of the fit, 'huber' or 'tukey', or None for ordinary least squares. Defaults to None.
 
     Returns:
     - numpy.ndarray: A transformation matrix which can be used to map the points from the space defined by landmarks1
@@ -1265,9 +2189,9 @@ def transform_points_third_order_polynomial_matrix(landmarks1, landmarks2,img_si
         This function involves rescaling coordinates, calculating a transformation matrix, and is typically used in image processing
         tasks where geometric transformations are necessary for alignment and registration.
     """
-    landmarks1 = coordinates_rescaling(landmarks1,img_size,img_size,new_img_size)
-    landmarks2 = coordinates_rescaling(landmarks2,img_size,img_size,new_img_size)
-    third_order_polynomial_matrix  = compute_third_order_polynomial_matrix(landmarks1, landmarks2)
+    landmarks1 = coordinates_rescaling(landmarks1,*grid_size(img_size),new_img_size)
+    landmarks2 = coordinates_rescaling(landmarks2,*grid_size(img_size),new_img_size)
+    third_order_polynomial_matrix  = compute_third_order_polynomial_matrix(landmarks1, landmarks2, loss)
     return third_order_polynomial_matrix
 
 def transform_points_quadratic_matrix(landmarks1, landmarks2,img_size,new_img_size):
@@ -1283,8 +2207,8 @@ def transform_points_quadratic_matrix(landmarks1, landmarks2,img_size,new_img_si
     - landmarks1 (list of tuples): List of (x, y) tuples representing original landmarks in the source image.
     - landmarks2 (list of tuples): List of (x, y) tuples representing target landmarks in the target image,
                                  corresponding to landmarks1.
-    - img_size (int): The original size (width and height, assumed square) of the images from which the landmarks were extracted.
-    - new_img_size (int): The new size (width and height, assumed square) to which the images and landmarks are rescaled
+    - img_size (int or tuple of int): The original size, a side length or (height, width), of the images from which the landmarks were extracted.
+    - new_img_size (int or tuple of int): The new size, a side length or (height, width), to which the images and landmarks are rescaled
                         before computing the transformation matrix.
 
     Returns:
@@ -1295,13 +2219,176 @@ def transform_points_quadratic_matrix(landmarks1, landmarks2,img_size,new_img_si
         Ensure that the number of points in landmarks1 and landmarks2 are equal and that they correspond to each other in order.
         This function is essential in image processing tasks where precise transformations are necessary for image alignment and registration.
     """
-    landmarks1 = coordinates_rescaling(landmarks1,img_size,img_size,new_img_size)
-    landmarks2 = coordinates_rescaling(landmarks2,img_size,img_size,new_img_size)
+    landmarks1 = coordinates_rescaling(landmarks1,*grid_size(img_size),new_img_size)
+    landmarks2 = coordinates_rescaling(landmarks2,*grid_size(img_size),new_img_size)
     quadratic_matrix = compute_quadratic_matrix(landmarks1, landmarks2)
     return quadratic_matrix
 
 
-def warp_image_third_order_polynomial(image, coefficients):
+
+def polynomial_remap_fields(coefficients, exponents, rows, width, columns=None):
+    """
+    Evaluates a polynomial transformation over a band of image rows and returns it as an OpenCV remap field.
+
+    Parameters:
+    - coefficients (array): The 2*K coefficients of the transformation, first the K coefficients of x' and then the K of y'.
+    - exponents (tuple of tuples): The K (x, y) powers of the monomials the coefficients refer to, e.g. `THIRD_ORDER_EXPONENTS`.
+    - rows (np.array): The y coordinates of the rows to evaluate.
+    - width (int): Width of the output image; x runs over 0..width-1.
+    - columns (np.array, optional): The x coordinates to evaluate instead of 0..width-1.
+
+    Returns:
+    - tuple: Two float32 arrays of shape (len(rows), width) (or (len(rows), len(columns))) holding x' and y'
+             for every pixel of the band.
+
+    Notes:
+        Within a row y is constant, so the polynomial is first collapsed (in float64, once per row) into one coefficient
+        per power of x, and is then evaluated over x with Horner's scheme in float32, in place, in a single buffer per
+        coordinate. No `np.indices` grid or per-monomial temporaries are allocated.
+    """
+    num_terms = len(exponents)
+    degree = max(i for i, _ in exponents)
+    x = np.arange(width, dtype=np.float32) if columns is None else np.asarray(columns, dtype=np.float32)
+    y = np.asarray(rows, dtype=np.float64)
+    fields = []
+    for coeffs in (coefficients[:num_terms], coefficients[num_terms:]):
+        # Coefficient of x**i for every row: c_i(y) = sum_j a_ij * y**j
+        row_coeffs = np.zeros((degree + 1, len(y)))
+        for a, (i, j) in zip(coeffs, exponents):
+            row_coeffs[i] += a * y ** j
+        row_coeffs = row_coeffs.astype(np.float32)[:, :, np.newaxis]
+        # Horner's scheme in x
+        field = np.repeat(row_coeffs[degree], len(x), axis=1)
+        for i in range(degree - 1, -1, -1):
+            field *= x
+            field += row_coeffs[i]
+        fields.append(field)
+    return fields[0], fields[1]
+
+def coarse_grid_nodes(start, stop, grid_step):
+    """
+    Lays out the control-grid nodes covering the pixel range start..stop-1 for `coarse_polynomial_remap_fields`.
+
+    Parameters:
+    - start (int): First pixel coordinate to cover.
+    - stop (int): One past the last pixel coordinate to cover.
+    - grid_step (int): Spacing of the control grid in pixels.
+
+    Returns:
+    - tuple: The index of the first node and the pixel coordinates of the nodes, as a float64 array.
+
+    Notes:
+        Node k sits at (k + 0.5) * grid_step - 0.5, which is where `cv2.resize` places the source samples when it
+        upsamples by `grid_step`, so a resized node array lines up with the pixel grid. One node is added on each
+        side so that every covered pixel is interpolated between two real nodes.
+    """
+    first = int(np.floor((start + 0.5) / grid_step - 0.5))
+    last = int(np.floor((stop - 0.5) / grid_step - 0.5)) + 1
+    return first, (np.arange(first, last + 1) + 0.5) * grid_step - 0.5
+
+def coarse_polynomial_remap_fields(coefficients, exponents, rows, width, grid_step=16, columns=None):
+    """
+    Approximates `polynomial_remap_fields` by evaluating the transformation on a coarse control grid only and
+    interpolating the dense remap field from it.
+
+    Parameters:
+    - coefficients (array): The 2*K coefficients of the transformation (see `polynomial_remap_fields`).
+    - exponents (tuple of tuples): The K (x, y) powers of the monomials the coefficients refer to.
+    - rows (np.array): The y coordinates of the rows to evaluate, a contiguous increasing range.
+    - width (int): Width of the output image; x runs over 0..width-1.
+    - grid_step (int, optional): Spacing of the control grid in pixels. Defaults to 16.
+    - columns (np.array, optional): A contiguous increasing range of x coordinates to evaluate instead of 0..width-1.
+
+    Returns:
+    - tuple: Two float32 arrays of shape (len(rows), width) (or (len(rows), len(columns))) holding the
+             interpolated x' and y'.
+
+    Notes:
+        The polynomial is evaluated exactly at about 1/grid_step**2 of the pixels and the field is upsampled with
+        `cv2.resize` (bilinear, which is exact in float32). Bilinear is used rather than OpenCV's bicubic kernel
+        because the latter does not reproduce linear functions and would bias the field by a fraction of a pixel.
+        Use `polynomial_interpolation_error` to bound the error before relying on it.
+    """
+    y0, y1 = int(rows[0]), int(rows[-1]) + 1
+    x0, x1 = (0, width) if columns is None else (int(columns[0]), int(columns[-1]) + 1)
+    first_row, node_rows = coarse_grid_nodes(y0, y1, grid_step)
+    first_col, node_cols = coarse_grid_nodes(x0, x1, grid_step)
+    node_x, node_y = polynomial_remap_fields(coefficients, exponents, node_rows, None, columns=node_cols)
+    dsize = (len(node_cols) * grid_step, len(node_rows) * grid_step)
+    top, left = y0 - first_row * grid_step, x0 - first_col * grid_step
+    fields = []
+    for nodes in (node_x, node_y):
+        field = cv2.resize(nodes, dsize, interpolation=cv2.INTER_LINEAR)
+        fields.append(field[top:top + y1 - y0, left:left + x1 - x0])
+    return fields[0], fields[1]
+
+def polynomial_interpolation_error(coefficients, exponents, height, width, grid_step=16):
+    """
+    Computes the worst-case error of the coarse-grid field of `coarse_polynomial_remap_fields` against exact
+    evaluation of the polynomial.
+
+    Parameters:
+    - coefficients (array): The 2*K coefficients of the transformation (see `polynomial_remap_fields`).
+    - exponents (tuple of tuples): The K (x, y) powers of the monomials the coefficients refer to.
+    - height (int): Height of the output image.
+    - width (int): Width of the output image.
+    - grid_step (int, optional): Spacing of the control grid in pixels. Defaults to 16.
+
+    Returns:
+    - float: The largest distance in pixels between the interpolated and the exact mapped position.
+
+    Notes:
+        Bilinear interpolation is furthest from a smooth field in the middle of the grid cells, so the field is
+        compared there, where the interpolated value is the mean of the four corner nodes.
+    """
+    _, node_rows = coarse_grid_nodes(0, height, grid_step)
+    _, node_cols = coarse_grid_nodes(0, width, grid_step)
+    nodes = polynomial_remap_fields(coefficients, exponents, node_rows, None, columns=node_cols)
+    centres = polynomial_remap_fields(coefficients, exponents, node_rows[:-1] + grid_step / 2, None,
+                                      columns=node_cols[:-1] + grid_step / 2)
+    errors = []
+    for node, centre in zip(nodes, centres):
+        node = node.astype(np.float64)
+        interpolated = (node[:-1, :-1] + node[:-1, 1:] + node[1:, :-1] + node[1:, 1:]) / 4
+        errors.append(interpolated - centre)
+    return float(np.sqrt(errors[0] ** 2 + errors[1] ** 2).max())
+
+def warp_image_polynomial(image, coefficients, exponents, tile_size=1024, tolerance=None, grid_step=16, workers=None, output=None):
+    """
+    Deforms an image with a polynomial transformation, resampling all channels in one pass with `cv2.remap`
+    on the tiled executor `warp_image_tiled`.
+
+    Parameters:
+    - image (numpy.ndarray): The image to deform, either two-dimensional (grayscale) or three-dimensional
+                           (color, up to four channels).
+    - coefficients (array): The 2*K coefficients of the transformation (see `polynomial_remap_fields`).
+    - exponents (tuple of tuples): The K (x, y) powers of the monomials the coefficients refer to.
+    - tile_size (int, optional): Side of the square output tiles, which caps the memory used by the remap field.
+                               Defaults to 1024.
+    - tolerance (float, optional): Largest error in pixels accepted from the coarse-grid field of
+                                 `coarse_polynomial_remap_fields`. If the worst-case error is within it the field is
+                                 interpolated, otherwise (or if None) it is evaluated exactly. Defaults to None.
+    - grid_step (int, optional): Spacing in pixels of the control grid of the coarse-grid field. Defaults to 16.
+    - workers (int, optional): Number of threads. Defaults to None, the number of CPUs.
+    - output (numpy.ndarray, optional): Array to write the deformed image into, e.g. a `numpy.memmap`.
+                                      Defaults to None, a new in-memory array.
+
+    Returns:
+    - numpy.ndarray: The deformed image (`output` if one was given), with the same shape and dtype as the input image.
+
+    Notes:
+        Pixels are bilinearly interpolated and areas mapped from outside the image are filled with zeros.
+    """
+    height, width = image.shape[:2]
+    remap_fields = lambda rows, columns: polynomial_remap_fields(coefficients, exponents, rows, None, columns=columns)
+    if tolerance is not None:
+        error = polynomial_interpolation_error(coefficients, exponents, height, width, grid_step)
+        print("Coarse-grid warp field: worst-case error {:.4f} px (tolerance {} px)".format(error, tolerance))
+        if error <= tolerance:
+            remap_fields = lambda rows, columns: coarse_polynomial_remap_fields(coefficients, exponents, rows, None, grid_step, columns=columns)
+    return warp_image_tiled(image, remap_fields, (width, height), tile_size, workers, output)
+
+def warp_image_third_order_polynomial(image, coefficients, tile_size=1024, tolerance=None, grid_step=16, workers=None, output=None):
     """
     Applies a third-order polynomial transformation to an image using provided coefficients, effectively deforming the image.
 
@@ -1309,60 +2396,32 @@ def warp_image_third_order_polynomial(image, coefficients):
     - image (numpy.ndarray): The image to deform, provided as a numpy array. The array can be either
                            two-dimensional (grayscale image) or three-dimensional (color image).
     - coefficients (list or array): An array of 20 coefficients for the third-order polynomial transformation.
+    - tile_size (int, optional): Side of the square output tiles warped at a time, to cap memory. Defaults to 1024.
+    - tolerance (float, optional): Sub-pixel error accepted to use the coarse-grid field instead of exact evaluation
+                                 (see `warp_image_polynomial`). Defaults to None, always exact.
+    - grid_step (int, optional): Spacing in pixels of the coarse control grid. Defaults to 16.
+    - workers (int, optional): Number of threads warping tiles in parallel. Defaults to None, the number of CPUs.
+    - output (numpy.ndarray, optional): Array (e.g. memory-mapped) to write the deformed image into. Defaults to None.
 
     Raises:
     - ValueError: If the number of coefficients provided is not 20, an error is raised due to the requirement
                 of exactly 20 coefficients to perform the transformation.
 
     Returns:
-    - numpy.ndarray: The deformed image as a numpy array of the same shape as the input image.
+    - numpy.ndarray: The deformed image as a numpy array of the same shape and dtype as the input image.
 
     Notes:
         The deformation is defined by a polynomial transformation that adjusts the coordinates of each pixel
         based on the polynomial defined by the coefficients.
-        This function supports both grayscale and color images. For color images, the transformation is applied
-        to each color channel independently.
-        The transformation involves calculating new pixel positions and mapping the original pixel values
-        to these new positions using spline interpolation of order 1.
+        The polynomial is evaluated in float32 with Horner's scheme and all channels are resampled together
+        with bilinear interpolation, tile by tile on a thread pool (see `warp_image_polynomial`).
     """
     if len(coefficients) != 20:
         raise ValueError("Coefficients should have a shape of (20,).")
 
-    # Extract the coefficients
-    a1, a2, a3, a4, a5, a6, a7, a8, a9, a10, \
-    a11, a12, a13, a14, a15, a16, a17, a18, a19, a20 = coefficients
+    return warp_image_polynomial(image, coefficients, THIRD_ORDER_EXPONENTS, tile_size, tolerance, grid_step, workers, output)
 
-    # Check if the image is grayscale or colored
-    if len(image.shape) == 2:
-        height, width = image.shape
-        output = np.zeros((height, width))
-        channels = 1
-        image = image[:, :, np.newaxis]  # add an additional dimension for consistency
-    else:
-        height, width, channels = image.shape
-        output = np.zeros((height, width, channels))
-
-    # Generate the coordinates
-    coordinates = np.indices((height, width))
-    x_coords = coordinates[1]
-    y_coords = coordinates[0]
-
-    # Compute new x' and y' for every x and y using third-order polynomial
-    x_prime = (a1*x_coords**3 + a2*x_coords**2*y_coords + a3*x_coords*y_coords**2 + a4*y_coords**3 +
-               a5*x_coords**2 + a6*x_coords*y_coords + a7*y_coords**2 + a8*x_coords + a9*y_coords + a10)
-    y_prime = (a11*x_coords**3 + a12*x_coords**2*y_coords + a13*x_coords*y_coords**2 + a14*y_coords**3 +
-               a15*x_coords**2 + a16*x_coords*y_coords + a17*y_coords**2 + a18*x_coords + a19*y_coords + a20)
-
-    # Map the old image pixels to the new deformed positions
-    for c in range(channels):  # for each channel
-        output[:, :, c] = map_coordinates(image[:, :, c], [y_prime, x_prime], order=1, mode='constant', cval=0.0)
-
-    if channels == 1:
-        return output[:, :, 0]  # return as 2D grayscale image
-    else:
-        return output
-
-def warp_image_quadratic_matrix(image, coefficients):
+def warp_image_quadratic_matrix(image, coefficients, tile_size=1024, tolerance=None, grid_step=16, workers=None, output=None):
     """
     Applies a quadratic transformation to deform an image using provided coefficients.
 
@@ -1370,56 +2429,86 @@ def warp_image_quadratic_matrix(image, coefficients):
     - image (numpy.ndarray): The image to deform, represented as a numpy array. This array can be
                            either two-dimensional (grayscale image) or three-dimensional (color image).
     - coefficients (list or array): A list or array of 12 coefficients defining the quadratic transformation.
+    - tile_size (int, optional): Side of the square output tiles warped at a time, to cap memory. Defaults to 1024.
+    - tolerance (float, optional): Sub-pixel error accepted to use the coarse-grid field instead of exact evaluation
+                                 (see `warp_image_polynomial`). Defaults to None, always exact.
+    - grid_step (int, optional): Spacing in pixels of the coarse control grid. Defaults to 16.
+    - workers (int, optional): Number of threads warping tiles in parallel. Defaults to None, the number of CPUs.
+    - output (numpy.ndarray, optional): Array (e.g. memory-mapped) to write the deformed image into. Defaults to None.
 
     Raises:
     - ValueError: If the number of coefficients provided is not equal to 12, raises an error indicating
                 that exactly 12 coefficients are required for the transformation.
 
     Returns:
-    - numpy.ndarray: The deformed image as a numpy array of the same shape as the input image.
+    - numpy.ndarray: The deformed image as a numpy array of the same shape and dtype as the input image.
 
     Notes:
         The deformation involves calculating new pixel coordinates using the quadratic equation defined
         by the coefficients and then mapping the original pixel values to these new coordinates.
-        The function checks if the image is in grayscale or color and processes each channel independently.
-        The mapping of pixels uses spline interpolation of order 1 for accuracy and fills any areas outside
-        the transformed coordinates with zeros.
+        All channels are resampled together with bilinear interpolation (see `warp_image_polynomial`),
+        and any areas outside the transformed coordinates are filled with zeros.
     """
     if len(coefficients) != 12:
         raise ValueError("Coefficients should have a shape of (12,).")
 
-    a1, a2, a3, a4, a5, a6, a7, a8, a9, a10, a11, a12 = coefficients
+    return warp_image_polynomial(image, coefficients, QUADRATIC_EXPONENTS, tile_size, tolerance, grid_step, workers, output)
 
-    # Check if the image is grayscale or colored
-    if len(image.shape) == 2:
-        height, width = image.shape
-        output = np.zeros((height, width))
-        channels = 1
-        image = image[:, :, np.newaxis]  # add an additional dimension for consistency
-    else:
-        height, width, channels = image.shape
-        output = np.zeros((height, width, channels))
-
-    # Generate the coordinates
-    coordinates = np.indices((height, width))
-    x_coords = coordinates[1]
-    y_coords = coordinates[0]
-
-    # Compute new x' and y' for every x and y
-    x_prime = a1*x_coords + a2*y_coords + a3*x_coords*y_coords + a4*x_coords**2 + a5*y_coords**2 + a6
-    y_prime = a7*x_coords + a8*y_coords + a9*x_coords*y_coords + a10*x_coords**2 + a11*y_coords**2 + a12
+def save_intermediate_images(rpth, num, fixed_image, moving_image, deformed_image):
+    """
+    Exports the fixed, moving and deformed images of a registration stage as PNG files.
 
-    # Map the old image pixels to the new deformed positions
-    for c in range(channels):  # for each channel
-        output[:, :, c] = map_coordinates(image[:, :, c], [y_prime, x_prime], order=1, mode='constant', cval=0.0)
+    Parameters:
+    - rpth (str): Directory path where the images will be saved.
+    - num (int or str): Identifier used to differentiate the output file names.
+    - fixed_image (np.array): The fixed image.
+    - moving_image (np.array): The moving image.
+    - deformed_image (np.array): The moving image after registration.
 
-    if channels == 1:
-        return output[:, :, 0]  # return as 2D grayscale image
-    else:
-        return output
+    Notes:
+        The files are a side output for inspection only; the next stage receives the images in memory. They are
+        written in the background by `result_writer`, downscaled to `thumbnail_size` at the 'thumbnails' `output_level`
+        and not at all below it.
+    """
+    if not output_enabled('thumbnails'):
+        return
+    if not output_enabled('full'):
+        # thumbnails share the aspect ratio of the fixed image, as a low-resolution deformed image may not have it
+        height, width = fixed_image.shape[:2]
+        scale = min(1.0, thumbnail_size / max(height, width))
+        dsize = (max(1, round(width * scale)), max(1, round(height * scale)))
+        fixed_image, moving_image, deformed_image = [cv2.resize(image, dsize, interpolation=cv2.INTER_AREA) for image in (fixed_image, moving_image, deformed_image)]
+    writer = result_writer()
+    writer.image(os.path.join(rpth, 'Fixed_' + str(num) + '_.png'), fixed_image)
+    writer.image(os.path.join(rpth, 'Moving_' + str(num) + '_.png'), moving_image)
+    writer.image(os.path.join(rpth,'Deformed_Image_'+str(num)+'_.png'),deformed_image)
+
+def show_registration_stage(fixed_image, moving_image, deformed_image, img_size, title, disp_clip=0.0):
+    """
+    Displays the fixed, moving and deformed images of a registration stage side by side.
 
+    Parameters:
+    - fixed_image (np.array): The fixed image.
+    - moving_image (np.array): The moving image.
+    - deformed_image (np.array): The moving image after registration, at any resolution.
+    - img_size (int or tuple of int): Size of the working grid the images are displayed at.
+    - title (str): Title of the figure.
+    - disp_clip (float, optional): CLAHE clip limit used to enhance the displayed images. Defaults to 0.0.
 
-def compute_third_order_polynomial_matrix_and_plot(images, img_size, landmarks1, landmarks2, rpth, num,snum,disp_clip=0.0, orig_fxd_size=(4000,4000),orig_mvg_size=(4000,4000)):
+    Notes:
+        The figure is only for display: nothing is drawn unless `show_figures` is set.
+    """
+    if not show_figures:
+        return
+    fig, axs = new_figure(1, 3, figsize=(18, 6))
+    fig.suptitle(title, fontsize=14, fontweight='bold', y=0.93)
+    for ax, image, name in zip(axs, [fixed_image, moving_image, deformed_image], ['Fixed Image', 'Moving Image', 'Deformed Image']):
+        ax.imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(image.astype(np.uint8),grid_dsize(img_size)), cv2.COLOR_BGR2RGB),disp_clip))
+        ax.set_title(name)
+        ax.axis('off')
+    show_figure(fig)
+
+def compute_third_order_polynomial_matrix_and_plot(images, img_size, landmarks1, landmarks2, rpth, num,snum,disp_clip=0.0, orig_fxd_size=(4000,4000),orig_mvg_size=(4000,4000),save_images=True,warp_tolerance=None,loss=None):
     """
     Computes a third-order polynomial transformation matrix based on landmark correspondences
     between two images and applies this transformation to align one image with another. This function
@@ -1427,14 +2516,18 @@ def compute_third_order_polynomial_matrix_and_plot(images, img_size, landmarks1,
     visibility.
 
     Parameters:
-    - images (list of str): Paths to the source and target images.
-    - img_size (int): The dimensions (height and width) to which the images should be resized.
+    - images (list of str or np.array): Paths to, or decoded arrays of, the source and target images.
+    - img_size (int or tuple of int): The size to which the images should be resized, a side length or (height, width).
     - landmarks1 (list of tuples): Coordinates of landmarks in the source image.
     - landmarks2 (list of tuples): Corresponding coordinates of landmarks in the target image.
     - rpth (str): Path to the directory where the resultant images will be saved.
     - num (int): An identifier number for differentiating the output file names.
     - snum (int): Stage number for referencing in output.
     - disp_clip (float, optional): Clipping limit for the CLAHE algorithm, used for contrast enhancement of the image, for display purposes. Default is 0.0.
+    - save_images (bool, optional): Whether to also export the fixed, moving and deformed images as PNG files to `rpth`. Default is True.
+    - warp_tolerance (float, optional): Sub-pixel error accepted to warp the full-resolution image with the
+                                      coarse-grid field instead of exact evaluation. Defaults to None, always exact.
+    - loss (str, optional): Robust loss ('huber' or 'tukey') of the IRLS polynomial fit, or None for ordinary least squares. Default is None.
 
     Raises:
     - ValueError: If the list of landmarks from the source image is empty.
@@ -1442,7 +2535,7 @@ def compute_third_order_polynomial_matrix_and_plot(images, img_size, landmarks1,
     Returns:
     tuple: Contains three elements:
         - imags (list of np.array): The original fixed and moving images along with the transformed image.
-        - imgs (list of str): Paths to the saved output images.
+        - imgs (list of np.array): The deformed and fixed images, handed to the next stage in memory.
         - coefficients (np.array): Coefficients of the third-order polynomial used for the transformation.
 
     Notes:
@@ -1451,24 +2544,21 @@ def compute_third_order_polynomial_matrix_and_plot(images, img_size, landmarks1,
         The images are displayed and saved with enhanced contrast to aid in visual assessment of the registration quality.
     """
     imgs,imags=[],[]
-    img1 = cv2.resize(cv2.imread(images[0]),orig_fxd_size[::-1])
-    img2 = cv2.resize(cv2.imread(images[1]),orig_mvg_size[::-1],interpolation=cv2.INTER_LINEAR) # since moving image is of size (3072(H),3900(W))
+    img1 = cv2.resize(read_image(images[0]),orig_fxd_size[::-1])
+    img2 = cv2.resize(read_image(images[1], full_resolution=True),orig_mvg_size[::-1],interpolation=cv2.INTER_LINEAR) # since moving image is of size (3072(H),3900(W))
 
     imags.append(img1)
     imags.append(img2)
 
-    landmarks1_orig_res= coordinates_rescaling_high_scale(landmarks1,img_size,img_size,orig_fxd_size)
-    landmarks2_orig_res= coordinates_rescaling_high_scale(landmarks2,img_size,img_size,orig_mvg_size)
+    landmarks1_orig_res= coordinates_rescaling_high_scale(landmarks1,*grid_size(img_size),orig_fxd_size)
+    landmarks2_orig_res= coordinates_rescaling_high_scale(landmarks2,*grid_size(img_size),orig_mvg_size)
 
     # Check if the list is not empty
-    if not landmarks1:  raise ValueError("Input list cannot be empty")
-
-    # Check and delte the temporary folder if it exists
-    if os.path.exists(os.path.join(os.getcwd(),'temp_dir')): shutil.rmtree(os.path.join(os.getcwd(),'temp_dir'))
+    if len(landmarks1) == 0:  raise ValueError("Input list cannot be empty")
 
     # Compute the third-order polynomial transformation matrix for image warping
-    poly_coefficients_low = compute_third_order_polynomial_matrix(landmarks2, landmarks1)
-    poly_coefficients_orig = compute_third_order_polynomial_matrix(landmarks2_orig_res, landmarks1_orig_res)
+    poly_coefficients_low = compute_third_order_polynomial_matrix(landmarks2, landmarks1, loss)
+    poly_coefficients_orig = compute_third_order_polynomial_matrix(landmarks2_orig_res, landmarks1_orig_res, loss)
 
     print("Polynomial Coefficients (Low Resolution):")
     print(poly_coefficients_low)
@@ -1481,36 +2571,23 @@ def compute_third_order_polynomial_matrix_and_plot(images, img_size, landmarks1,
     poly_coefficients_orig = poly_coefficients_orig.astype(np.float32)
 
     # Apply the transformation using third-order polynomial
-    transformed_image = warp_image_third_order_polynomial(img2, poly_coefficients_orig.flatten())
+    transformed_image = warp_image_third_order_polynomial(img2, poly_coefficients_orig.flatten(), tolerance=warp_tolerance)
+    transformed_image = np.clip(np.rint(transformed_image), 0, 255).astype(np.uint8) # 8-bit, like a decoded image, for the next stage
     imags.append(transformed_image)
 
-    # Display and save the images
-    fig, axs = plt.subplots(1, 3, figsize=(18, 6))
-    fig.suptitle("Stage-{} Results: Registration Using Third Order Polynomial Transformation".format(snum), fontsize=14, fontweight='bold', y=0.93)
-
-    axs[0].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(img1,(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[0].set_title('Fixed Image')
-    axs[0].axis('off')
-
-    axs[1].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(img2,(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[1].set_title('Moving Image')
-    axs[1].axis('off')
+    # Display the images
+    show_registration_stage(img1, img2, transformed_image, img_size, "Stage-{} Results: Registration Using Third Order Polynomial Transformation".format(snum), disp_clip)
 
-    axs[2].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(transformed_image.astype(np.uint8),(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[2].set_title('Deformed Image')
-    axs[2].axis('off')
-
-    plt.show();
+    # handing the deformed and fixed images over to the next stage in memory
+    imgs.append(transformed_image)
+    imgs.append(img1)
 
     # saving intermediary results for better visualization
-    imgs.append(os.path.join(rpth, 'Deformed_Image_' + str(num) + '_.png'))
-    imgs.append(os.path.join(rpth, 'Fixed_' + str(num) + '_.png'))
-    cv2.imwrite(os.path.join(rpth, 'Fixed_' + str(num) + '_.png'), img1)
-    cv2.imwrite(os.path.join(rpth, 'Moving_' + str(num) + '_.png'), img2)
-    cv2.imwrite(os.path.join(rpth,'Deformed_Image_'+str(num)+'_.png'),transformed_image);
+    if save_images:
+        save_intermediate_images(rpth, num, img1, img2, transformed_image)
     return imgs,imags,poly_coefficients_low
 
-def compute_affine_matrix_and_plot(images,img_size,landmarks1, landmarks2,rpth,num,snum,disp_clip=0.0, orig_fxd_size=(4000,4000),orig_mvg_size=(4000,4000)):
+def compute_affine_matrix_and_plot(images,img_size,landmarks1, landmarks2,rpth,num,snum,disp_clip=0.0, orig_fxd_size=(4000,4000),orig_mvg_size=(4000,4000),save_images=True):
     """
     Computes an affine transformation matrix based on provided landmarks from two images and applies
     this transformation to visually compare the source, target, and transformed images.
@@ -1521,18 +2598,19 @@ def compute_affine_matrix_and_plot(images,img_size,landmarks1, landmarks2,rpth,n
     The images are enhanced using CLAHE for better visibility and are saved to the specified path.
 
     Parameters:
-    - images (list of str): File paths for the source and target images.
-    - img_size (int): The size (width and height) to which the images will be resized.
+    - images (list of str or np.array): File paths for, or decoded arrays of, the source and target images.
+    - img_size (int or tuple of int): The size to which the images will be resized, a side length or (height, width).
     - landmarks1 (list of tuples): Landmark points (x, y) on the source image.
     - landmarks2 (list of tuples): Corresponding landmark points (x, y) on the target image.
     - rpth (str): Directory path where the resultant images will be saved.
     - num (int): Identifier number used to differentiate the output file names.
     - snum (int): Stage number for referencing in output.
     - disp_clip (float, optional): Clipping limit for the CLAHE algorithm, used for contrast enhancement of the image, for display purposes. Default is 0.0.
+    - save_images (bool, optional): Whether to also export the fixed, moving and deformed images as PNG files to `rpth`. Default is True.
 
     Returns:
     - tuple: Contains two items:
-        - imgs (list of str): Paths to the saved images.
+        - imgs (list of np.array): The deformed and fixed images, handed to the next stage in memory.
         - affine_matrix (numpy.ndarray): The computed affine transformation matrix.
 
     Raises:
@@ -1544,20 +2622,17 @@ def compute_affine_matrix_and_plot(images,img_size,landmarks1, landmarks2,rpth,n
         Enhanced contrast is used to aid in the visual assessment of image registration quality.
     """
     imgs,imags=[],[]
-    img1 = cv2.resize(cv2.imread(images[0]),orig_fxd_size)
-    img2 = cv2.resize(cv2.imread(images[1]),orig_mvg_size[::-1],interpolation=cv2.INTER_LINEAR) # since moving image is of size (3072(H),3900(W))
+    img1 = cv2.resize(read_image(images[0]),orig_fxd_size)
+    img2 = cv2.resize(read_image(images[1], full_resolution=True),orig_mvg_size[::-1],interpolation=cv2.INTER_LINEAR) # since moving image is of size (3072(H),3900(W))
 
     imags.append(img1)
     imags.append(img2)
 
-    landmarks1_orig_res= coordinates_rescaling_high_scale(landmarks1,img_size,img_size,orig_fxd_size)
-    landmarks2_orig_res= coordinates_rescaling_high_scale(landmarks2,img_size,img_size,orig_mvg_size)
+    landmarks1_orig_res= coordinates_rescaling_high_scale(landmarks1,*grid_size(img_size),orig_fxd_size)
+    landmarks2_orig_res= coordinates_rescaling_high_scale(landmarks2,*grid_size(img_size),orig_mvg_size)
 
     # Check if the list is not empty
-    if not landmarks1:  raise ValueError("Input list cannot be empty")
-
-    # Check and delte the temporary folder if it exists
-    if os.path.exists(os.path.join(os.getcwd(),'temp_dir')): shutil.rmtree(os.path.join(os.getcwd(),'temp_dir'))
+    if len(landmarks1) == 0:  raise ValueError("Input list cannot be empty")
 
     # Compute the Affine transformation matrix for image warping
     affine_matrix_low = compute_affine_matrix(landmarks2,landmarks1)
@@ -1573,37 +2648,23 @@ def compute_affine_matrix_and_plot(images,img_size,landmarks1, landmarks2,rpth,n
     affine_matrix_low = affine_matrix_low.astype(np.float32)
     affine_matrix_orig = affine_matrix_orig.astype(np.float32)
 
-    # Apply the affine transformation using cv2.warpAffine
-    transformed_image = cv2.warpAffine(img2, affine_matrix_orig[:2], (img2.shape[1], img2.shape[0]))
+    # Apply the affine transformation with the tiled warp executor
+    transformed_image = warp_image_homography(img2, affine_matrix_orig, (img2.shape[1], img2.shape[0]))
     imags.append(transformed_image)
 
-    # Display and save the images
-    fig, axs = plt.subplots(1, 3, figsize=(18, 6))
-    fig.suptitle("Stage-{} Results: Registration Using Affine Transformation".format(snum), fontsize=14, fontweight='bold', y=0.93)
-
-    axs[0].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(img1,(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[0].set_title('Fixed Image')
-    axs[0].axis('off')
-
-    axs[1].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(img2,(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[1].set_title('Moving Image')
-    axs[1].axis('off')
+    # Display the images
+    show_registration_stage(img1, img2, transformed_image, img_size, "Stage-{} Results: Registration Using Affine Transformation".format(snum), disp_clip)
 
-    axs[2].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(transformed_image.astype(np.uint8),(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[2].set_title('Deformed Image')
-    axs[2].axis('off')
-
-    plt.show();
+    # handing the deformed and fixed images over to the next stage in memory
+    imgs.append(transformed_image)
+    imgs.append(img1)
 
     # saving intermediary results for better visualization
-    imgs.append(os.path.join(rpth, 'Deformed_Image_' + str(num) + '_.png'))
-    imgs.append(os.path.join(rpth, 'Fixed_' + str(num) + '_.png'))
-    cv2.imwrite(os.path.join(rpth, 'Fixed_' + str(num) + '_.png'), img1)
-    cv2.imwrite(os.path.join(rpth, 'Moving_' + str(num) + '_.png'), img2)
-    cv2.imwrite(os.path.join(rpth,'Deformed_Image_'+str(num)+'_.png'),transformed_image);
+    if save_images:
+        save_intermediate_images(rpth, num, img1, img2, transformed_image)
     return imgs,imags,affine_matrix_low
 
-def compute_quadratic_matrix_and_plot(images,img_size,landmarks1, landmarks2,rpth,num,snum,disp_clip=0.0, orig_fxd_size=(4000,4000),orig_mvg_size=(4000,4000)):
+def compute_quadratic_matrix_and_plot(images,img_size,landmarks1, landmarks2,rpth,num,snum,disp_clip=0.0, orig_fxd_size=(4000,4000),orig_mvg_size=(4000,4000),save_images=True,warp_tolerance=None):
     """
     Computes a quadratic transformation matrix from source to target landmarks and applies this transformation
     to the source image. The transformed source image is displayed alongside the original source and target images,
@@ -1614,8 +2675,8 @@ def compute_quadratic_matrix_and_plot(images,img_size,landmarks1, landmarks2,rpt
     result, along with the original images, is displayed and saved for comparison.
 
     Parameters:
-    - images (list of str): File paths for the source and target images.
-    - img_size (int): The size (width and height) to which the images will be resized.
+    - images (list of str or np.array): File paths for, or decoded arrays of, the source and target images.
+    - img_size (int or tuple of int): The size to which the images will be resized, a side length or (height, width).
     - landmarks1 (list of tuples): Landmark points (x, y) on the source image.
     - landmarks2 (list of tuples): Corresponding landmark points (x, y) on the target image.
     - rpth (str): Directory path where the resultant images will be saved.
@@ -1623,10 +2684,13 @@ def compute_quadratic_matrix_and_plot(images,img_size,landmarks1, landmarks2,rpt
     - cll (float, optional): Clipping limit for the CLAHE algorithm used in contrast enhancement. Default is 1.5.
     - snum (int): Stage number used for displaying in the title of the plot.
     - disp_clip (float, optional): Clipping limit for the CLAHE algorithm, used for contrast enhancement of the image, for display purposes. Default is 0.0.
+    - save_images (bool, optional): Whether to also export the fixed, moving and deformed images as PNG files to `rpth`. Default is True.
+    - warp_tolerance (float, optional): Sub-pixel error accepted to warp the full-resolution image with the
+                                      coarse-grid field instead of exact evaluation. Defaults to None, always exact.
 
     Returns:
     - tuple: Contains three items:
-        - imgs (list of str): File paths where the output images are saved.
+        - imgs (list of np.array): The deformed and fixed images, handed to the next stage in memory.
         - imags (list of np.array): List containing the numpy arrays of the original and transformed images.
         - quadratic_matrix (numpy.ndarray): The computed quadratic transformation matrix.
 
@@ -1641,20 +2705,17 @@ def compute_quadratic_matrix_and_plot(images,img_size,landmarks1, landmarks2,rpt
         This function is particularly useful in applications such as image registration and geometric transformations.
     """
     imgs,imags=[],[]
-    img1 = cv2.resize(cv2.imread(images[0]),orig_fxd_size)
-    img2 = cv2.resize(cv2.imread(images[1]),orig_mvg_size[::-1],interpolation=cv2.INTER_LINEAR) # since moving image is of size (3072(H),3900(W))
+    img1 = cv2.resize(read_image(images[0]),orig_fxd_size)
+    img2 = cv2.resize(read_image(images[1], full_resolution=True),orig_mvg_size[::-1],interpolation=cv2.INTER_LINEAR) # since moving image is of size (3072(H),3900(W))
 
     imags.append(img1)
     imags.append(img2)
 
-    landmarks1_orig_res= coordinates_rescaling_high_scale(landmarks1,img_size,img_size,orig_fxd_size)
-    landmarks2_orig_res= coordinates_rescaling_high_scale(landmarks2,img_size,img_size,orig_mvg_size)
+    landmarks1_orig_res= coordinates_rescaling_high_scale(landmarks1,*grid_size(img_size),orig_fxd_size)
+    landmarks2_orig_res= coordinates_rescaling_high_scale(landmarks2,*grid_size(img_size),orig_mvg_size)
 
     # Check if the list is not empty
-    if not landmarks1:  raise ValueError("Input list cannot be empty")
-
-    # Check and delte the temporary folder if it exists
-    if os.path.exists(os.path.join(os.getcwd(),'temp_dir')): shutil.rmtree(os.path.join(os.getcwd(),'temp_dir'))
+    if len(landmarks1) == 0:  raise ValueError("Input list cannot be empty")
 
     # # Compute the Quadratic transformation matrix for image warping
     quadratic_matrix_low = compute_quadratic_matrix(landmarks2, landmarks1)
@@ -1671,55 +2732,45 @@ def compute_quadratic_matrix_and_plot(images,img_size,landmarks1, landmarks2,rpt
     quadratic_matrix_orig = quadratic_matrix_orig.astype(np.float32)
 
     # Apply the quadratic transformation using cv2.warpquadratic
-    transformed_image =  warp_image_quadratic_matrix(img2, quadratic_matrix_orig)
+    transformed_image =  warp_image_quadratic_matrix(img2, quadratic_matrix_orig, tolerance=warp_tolerance)
     transformed_image = cv2.resize(transformed_image,  (img2.shape[1], img2.shape[0]))
+    transformed_image = np.clip(np.rint(transformed_image), 0, 255).astype(np.uint8) # 8-bit, like a decoded image, for the next stage
     imags.append(transformed_image)
 
-    # Display and save the images
-    fig, axs = plt.subplots(1, 3, figsize=(18, 6))
-    fig.suptitle("Stage-{} Results: Registration Using Quadratic Transformation".format(snum), fontsize=14, fontweight='bold', y=0.93)
-
-    axs[0].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(img1,(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[0].set_title('Fixed Image')
-    axs[0].axis('off')
-
-    axs[1].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(img2,(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[1].set_title('Moving Image')
-    axs[1].axis('off')
+    # Display the images
+    show_registration_stage(img1, img2, transformed_image, img_size, "Stage-{} Results: Registration Using Quadratic Transformation".format(snum), disp_clip)
 
-    axs[2].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(transformed_image.astype(np.uint8),(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[2].set_title('Deformed Image')
-    axs[2].axis('off')
-
-    plt.show();
+    # handing the deformed and fixed images over to the next stage in memory
+    imgs.append(transformed_image)
+    imgs.append(img1)
 
     # saving intermediary results for better visualization
-    imgs.append(os.path.join(rpth, 'Deformed_Image_' + str(num) + '_.png'))
-    imgs.append(os.path.join(rpth, 'Fixed_' + str(num) + '_.png'))
-    cv2.imwrite(os.path.join(rpth, 'Fixed_' + str(num) + '_.png'), img1)
-    cv2.imwrite(os.path.join(rpth, 'Moving_' + str(num) + '_.png'), img2)
-    cv2.imwrite(os.path.join(rpth,'Deformed_Image_'+str(num)+'_.png'),transformed_image);
+    if save_images:
+        save_intermediate_images(rpth, num, img1, img2, transformed_image)
     return imgs,imags,quadratic_matrix_low
 
 
-def compute_homography_matrix_and_plot(images, img_size, landmarks1, landmarks2, rpth, num,snum,disp_clip=0.0,orig_fxd_size=(4000,4000),orig_mvg_size=(4000,4000)):
+def compute_homography_matrix_and_plot(images, img_size, landmarks1, landmarks2, rpth, num,snum,disp_clip=0.0,orig_fxd_size=(4000,4000),orig_mvg_size=(4000,4000),save_images=True,lazy_warp=False):
     """
     Computes the homography transformation matrix based on landmark correspondences between two images
     and applies this transformation to the source image. The function displays the original source and
     target images along with the transformed source image. It also saves these images to disk.
 
     Parameters:
-    - images (list of str): Paths to the source and target images.
-    - img_size (int): The size to which both images will be resized.
+    - images (list of str or np.array): Paths to, or decoded arrays of, the source and target images.
+    - img_size (int or tuple of int): The size to which both images will be resized, a side length or (height, width).
     - landmarks1 (list of tuples): Landmark points (x, y) from the source image.
     - landmarks2 (list of tuples): Corresponding landmark points (x, y) from the target image.
     - rpth (str): The directory path where the resultant images will be saved.
     - num (int): An identifier number used to differentiate the output file names.
     - snum (int): Stage number used for displaying in the title of the plot.
     - disp_clip (float, optional): Clipping limit for the CLAHE algorithm, used for contrast enhancement of the image, for display purposes. Default is 0.0.
+    - save_images (bool, optional): Whether to also export the fixed, moving and deformed images as PNG files to `rpth`. Default is True.
+    - lazy_warp (bool, optional): If True, the moving image is warped straight into the `img_size` grid used by the next stage,
+                                and the full-resolution warp is deferred (see `LazyWarp`) until a final output asks for it. Default is False.
 
     Returns:
-    - tuple: A tuple containing the paths to the saved images, a list of image arrays including the transformed image,
+    - tuple: A tuple containing the deformed and fixed images for the next stage, a list of image arrays including the transformed image,
            and the computed homography matrix.
 
     Raises:
@@ -1733,20 +2784,17 @@ def compute_homography_matrix_and_plot(images, img_size, landmarks1, landmarks2,
     """
     imgs,imags=[],[]
 
-    img1 = cv2.resize(cv2.imread(images[0]),orig_fxd_size[::-1])
-    img2 = cv2.resize(cv2.imread(images[1]),orig_mvg_size[::-1],interpolation=cv2.INTER_LINEAR) # since moving image is of size (3072(H),3900(W))
+    img1 = cv2.resize(read_image(images[0]),orig_fxd_size[::-1])
+    img2 = cv2.resize(read_image(images[1], full_resolution=True),orig_mvg_size[::-1],interpolation=cv2.INTER_LINEAR) # since moving image is of size (3072(H),3900(W))
 
     imags.append(img1)
     imags.append(img2)
 
-    landmarks1_orig_res= coordinates_rescaling_high_scale(landmarks1,img_size,img_size,orig_fxd_size)
-    landmarks2_orig_res= coordinates_rescaling_high_scale(landmarks2,img_size,img_size,orig_mvg_size)
+    landmarks1_orig_res= coordinates_rescaling_high_scale(landmarks1,*grid_size(img_size),orig_fxd_size)
+    landmarks2_orig_res= coordinates_rescaling_high_scale(landmarks2,*grid_size(img_size),orig_mvg_size)
 
     # Check if the list is not empty
-    if not landmarks1:  raise ValueError("Input list cannot be empty")
-
-    # Check and delte the temporary folder if it exists
-    if os.path.exists(os.path.join(os.getcwd(),'temp_dir')): shutil.rmtree(os.path.join(os.getcwd(),'temp_dir'))
+    if len(landmarks1) == 0:  raise ValueError("Input list cannot be empty")
 
     # Compute homography matrix for image warping
     homography_matrix_low = compute_homography_matrix(landmarks1, landmarks2)
@@ -1762,34 +2810,28 @@ def compute_homography_matrix_and_plot(images, img_size, landmarks1, landmarks2,
     homography_matrix_low = homography_matrix_low.astype(np.float32)
     homography_matrix_orig = homography_matrix_orig.astype(np.float32)
 
-    # Apply the homography transformation using cv2.warpPerspective
-    transformed_image=cv2.warpPerspective(img2, homography_matrix_orig, (img2.shape[1], img2.shape[0]))
+    # Apply the homography transformation with the tiled warp executor
+    if lazy_warp:
+        # Compose the homography with the resize to img_size so that only the low-resolution grid is warped now
+        moving_low = cv2.resize(img2, grid_dsize(img_size), interpolation=cv2.INTER_AREA)
+        composed_matrix = resize_matrix((img2.shape[1], img2.shape[0]), grid_dsize(img_size)) @ homography_matrix_orig @ np.linalg.inv(resize_matrix((img2.shape[1], img2.shape[0]), grid_dsize(img_size)))
+        transformed_image = LazyWarp(img2, homography_matrix_orig, (img2.shape[1], img2.shape[0]), cv2.warpPerspective(moving_low, composed_matrix, grid_dsize(img_size)))
+        transformed_image_low = transformed_image.preview
+    else:
+        transformed_image=warp_image_homography(img2, homography_matrix_orig, (img2.shape[1], img2.shape[0]))
+        transformed_image_low = cv2.resize(transformed_image.astype(np.uint8),grid_dsize(img_size))
     imags.append(transformed_image)
 
-    # Display and save the images
-    fig, axs = plt.subplots(1, 3, figsize=(18, 6))
-    fig.suptitle("Stage-{} Results: Registration Using Homography Transformation".format(snum), fontsize=14, fontweight='bold', y=0.93)
-
-    axs[0].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(img1,(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[0].set_title('Fixed Image')
-    axs[0].axis('off')
+    # Display the images
+    show_registration_stage(img1, img2, transformed_image_low, img_size, "Stage-{} Results: Registration Using Homography Transformation".format(snum), disp_clip)
 
-    axs[1].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(img2,(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[1].set_title('Moving Image')
-    axs[1].axis('off')
-
-    axs[2].imshow(CLAHE_plot_cond(cv2.cvtColor(cv2.resize(transformed_image.astype(np.uint8),(img_size,img_size)), cv2.COLOR_BGR2RGB),disp_clip))
-    axs[2].set_title('Deformed Image')
-    axs[2].axis('off')
-
-    plt.show();
+    # handing the deformed and fixed images over to the next stage in memory
+    imgs.append(transformed_image)
+    imgs.append(img1)
 
     # saving intermediary results for better visualization
-    imgs.append(os.path.join(rpth, 'Deformed_Image_' + str(num) + '_.png'))
-    imgs.append(os.path.join(rpth, 'Fixed_' + str(num) + '_.png'))
-    cv2.imwrite(os.path.join(rpth, 'Fixed_' + str(num) + '_.png'), img1)
-    cv2.imwrite(os.path.join(rpth, 'Moving_' + str(num) + '_.png'), img2)
-    cv2.imwrite(os.path.join(rpth,'Deformed_Image_'+str(num)+'_.png'),transformed_image);
+    if save_images:
+        save_intermediate_images(rpth, num, img1, img2, read_image(transformed_image, full_resolution=True))
     return imgs,imags,homography_matrix_low
 
 def landmark_error(point, transformed_point):
@@ -1797,26 +2839,26 @@ def landmark_error(point, transformed_point):
     Computes the Euclidean distance between the original point and the transformed point.
 
     Parameters:
-    - point (tuple): Original point (x, y).
-    - transformed_point (tuple): Transformed point (x, y).
+    - point (tuple or np.array): Original point (x, y), or an (N, 2) array of points.
+    - transformed_point (tuple or np.array): Transformed point (x, y), or an (N, 2) array of points.
 
     Returns:
-    - float: Euclidean distance.
+    - float or np.array: Euclidean distance, or the (N,) distances between corresponding points.
     """
-    return np.linalg.norm(np.array(point) - np.array(transformed_point))
+    return np.linalg.norm(np.asarray(point, dtype=np.float64) - np.asarray(transformed_point, dtype=np.float64), axis=-1)
 
 def estimate_affine_transformation(points):
     """
     Estimates the affine transformation matrix using point correspondences.
 
     Parameters:
-    - points (np.array): Array of point correspondences.
+    - points (np.array): (N, 2, 2) array (or list of pairs) of point correspondences.
 
     Returns:
     - np.array: Affine transformation matrix.
     """
-    src_pts = np.float32([point[0] for point in points])
-    dst_pts = np.float32([point[1] for point in points])
+    points = np.asarray(points, dtype=np.float32)
+    src_pts, dst_pts = np.ascontiguousarray(points[:, 0]), np.ascontiguousarray(points[:, 1])
     affine_matrix, _ = cv2.estimateAffinePartial2D(src_pts, dst_pts)
     return affine_matrix
 
@@ -1825,7 +2867,7 @@ def estimate_homography_matrix(points):
     Estimates the homography matrix given a set of point correspondences.
 
     Parameters:
-    - points: A list of tuples, where each tuple contains two (x, y) tuples.
+    - points: A list of tuples, where each tuple contains two (x, y) tuples, or the equivalent (N, 2, 2) array.
               The first tuple in each pair is from the first set of points (set1),
               and the second tuple is the corresponding point in the second set (set2).
 
@@ -1834,12 +2876,8 @@ def estimate_homography_matrix(points):
     """
 
     # Separate the points into two sets
-    set1 = [point[0] for point in points]
-    set2 = [point[1] for point in points]
-
-    # Convert to numpy arrays
-    set1 = np.array(set1, dtype=np.float32)
-    set2 = np.array(set2, dtype=np.float32)
+    points = np.asarray(points, dtype=np.float32)
+    set1, set2 = np.ascontiguousarray(points[:, 0]), np.ascontiguousarray(points[:, 1])
 
     # Estimate the homography matrix
     homography_matrix, _ = cv2.findHomography(set1, set2, cv2.RANSAC)
@@ -1856,35 +2894,29 @@ def remove_outliers_based_on_error_affine(set1, set2, threshold=20):
     threshold are considered outliers and are excluded from the results.
 
     Parameters:
-    - set1 (list of tuples): A list of (x, y) tuples representing coordinates of points in the first image.
-    - set2 (list of tuples): A list of (x, y) tuples representing corresponding coordinates of points in the
+    - set1 (list of tuples or np.array): A list of (x, y) tuples (or (N, 2) array) representing coordinates of points in the first image.
+    - set2 (list of tuples or np.array): A list of (x, y) tuples (or (N, 2) array) representing corresponding coordinates of points in the
                            second image. The indices in `set1` and `set2` must correspond.
     - threshold (float, optional): The maximum allowed error distance between the original and transformed
                                  points for them to be considered inliers. Default value is 20.
 
     Returns:
-    - tuple of lists: Returns two lists (updated_set1, updated_set2) containing the inlier points from
-                    `set1` and `set2` respectively.
+    - np.array: Indices of the inlier pairs, in increasing order. `set1[indices]` and `set2[indices]` (see
+                `select_points`) are the inlier points.
     Notes:
         It is critical that `set1` and `set2` are of equal length and that the points correspond correctly,
         as any misalignment could result in incorrect calculations and poor results.
         This function is typically used in image processing and computer vision tasks where alignment and
         transformation of point sets between images is required, particularly in stereo vision and motion tracking.
     """
-    points = list(zip(set1, set2))
-    affine_matrix = estimate_affine_transformation(points)
-    updated_set1 = []
-    updated_set2 = []
-
-    for point1, point2 in zip(set1, set2):
-        transformed_point = transform_points_affine([point1], affine_matrix)[0]
-        error = landmark_error(point2, transformed_point)
+    set1 = np.asarray(set1, dtype=np.float64).reshape(-1, 2)
+    set2 = np.asarray(set2, dtype=np.float64).reshape(-1, 2)
+    affine_matrix = estimate_affine_transformation(np.stack([set1, set2], axis=1))
 
-        if error <= threshold:
-            updated_set1.append(point1)
-            updated_set2.append(point2)
-
-    return updated_set1, updated_set2
+    # Transform all points in one matrix multiply and keep those within the threshold
+    transformed_points = set1 @ affine_matrix[:, :2].T + affine_matrix[:, 2]
+    errors = landmark_error(set2, transformed_points)
+    return np.flatnonzero(errors <= threshold)
 
 def remove_outliers_based_on_error_homography(set1, set2, threshold=20):
     """
@@ -1896,15 +2928,15 @@ def remove_outliers_based_on_error_homography(set1, set2, threshold=20):
     threshold are considered outliers and are excluded from the results.
 
     Parameters:
-    - set1 (list of tuples): A list of (x, y) tuples representing coordinates of points in the first image.
-    - set2 (list of tuples): A list of (x, y) tuples representing corresponding coordinates of points in the
+    - set1 (list of tuples or np.array): A list of (x, y) tuples (or (N, 2) array) representing coordinates of points in the first image.
+    - set2 (list of tuples or np.array): A list of (x, y) tuples (or (N, 2) array) representing corresponding coordinates of points in the
                            second image. The indices in `set1` and `set2` must correspond.
     - threshold (float, optional): The maximum allowed error distance between the original and transformed
                                  points for them to be considered inliers. Default value is 20.
 
     Returns:
-    - tuple of lists: Returns two lists (updated_set1, updated_set2) containing the inlier points from
-                        `set1` and `set2` respectively.
+    - np.array: Indices of the inlier pairs, in increasing order. `set1[indices]` and `set2[indices]` (see
+                `select_points`) are the inlier points.
     Notes:
         Ensure that `set1` and `set2` are of equal length and that the points correspond correctly,
         as any misalignment could result in incorrect calculations and poor results.
@@ -1912,50 +2944,242 @@ def remove_outliers_based_on_error_homography(set1, set2, threshold=20):
         alignment and transformation of point sets between images are required, especially in applications
         like panorama stitching and object tracking.
     """
-    points = list(zip(set1, set2))
-    homography_matrix = estimate_homography_matrix(points)
-    updated_set1 = []
-    updated_set2 = []
+    set1 = np.asarray(set1, dtype=np.float64).reshape(-1, 2)
+    set2 = np.asarray(set2, dtype=np.float64).reshape(-1, 2)
+    homography_matrix = estimate_homography_matrix(np.stack([set1, set2], axis=1))
+
+    # Transform all points in one matrix multiply and keep those within the threshold
+    transformed_points = apply_transformations('homography', homography_matrix[np.newaxis], set1)[0]
+    errors = landmark_error(set2, transformed_points)
+    return np.flatnonzero(errors <= threshold)
+
+def compute_homography_matrices(landmarks1, landmarks2):
+    """
+    Fits many homographies at once with the normalised direct linear transformation (DLT), one per batch of
+    landmark correspondences.
+
+    Parameters:
+    - landmarks1 (np.array): (B, N, 2) source points, N >= 4.
+    - landmarks2 (np.array): (B, N, 2) corresponding target points.
+
+    Returns:
+    - tuple: The (B, 3x3) homography matrices and (B,) boolean flags, False for degenerate point sets (matrices
+             filled with NaN).
+    """
+    landmarks1 = np.asarray(landmarks1, dtype=np.float64)
+    landmarks2 = np.asarray(landmarks2, dtype=np.float64)
+
+    def normalisation(points):
+        # Hartley normalisation: centroid at the origin, mean distance sqrt(2)
+        centre = points.mean(axis=1)
+        scale = np.sqrt(2) / np.maximum(np.linalg.norm(points - centre[:, np.newaxis], axis=2).mean(axis=1), 1e-12)
+        T = np.zeros((len(points), 3, 3))
+        T[:, 0, 0] = T[:, 1, 1] = scale
+        T[:, :2, 2] = -scale[:, np.newaxis] * centre
+        T[:, 2, 2] = 1
+        return (points - centre[:, np.newaxis]) * scale[:, np.newaxis, np.newaxis], T
+
+    (u, T1), (v, T2) = normalisation(landmarks1), normalisation(landmarks2)
+    num_batches, num_points = u.shape[:2]
+    M = np.zeros((num_batches, 2 * num_points, 9))
+    M[:, 0::2, 0:2] = -u
+    M[:, 0::2, 2] = -1
+    M[:, 0::2, 6:8] = u * v[:, :, 0:1]
+    M[:, 0::2, 8] = v[:, :, 0]
+    M[:, 1::2, 3:5] = -u
+    M[:, 1::2, 5] = -1
+    M[:, 1::2, 6:8] = u * v[:, :, 1:2]
+    M[:, 1::2, 8] = v[:, :, 1]
+    _, singular_values, vh = np.linalg.svd(M)
+    matrices = np.linalg.inv(T2) @ vh[:, -1].reshape(-1, 3, 3) @ T1
+    valid = (singular_values[:, 7] > 1e-8 * singular_values[:, 0]) & (np.abs(matrices[:, 2, 2]) > 1e-12)
+    matrices[valid] /= matrices[valid, 2, 2][:, np.newaxis, np.newaxis]
+    matrices[~valid] = np.nan
+    return matrices, valid
+
+def fit_transformations(model, landmarks1, landmarks2, weights=None):
+    """
+    Fits a batch of transformations of one family, e.g. one per RANSAC sample.
+
+    Parameters:
+    - model (str): Transformation family, one of 'affine', 'homography', 'quadratic' or 'third_order'.
+    - landmarks1 (np.array): (B, N, 2) source points.
+    - landmarks2 (np.array): (B, N, 2) corresponding target points.
+    - weights (np.array, optional): (B, N) weights of the correspondences (ignored for 'homography'). Defaults to None.
+
+    Returns:
+    - tuple: The (B, ...) transformation parameters, as used by `apply_transformations`, and (B,) validity flags.
+             Matrices are (3x3); polynomial coefficients are (K, 2) arrays in the order of the exponent tables.
+    """
+    if model == 'affine':
+        return compute_affine_matrices(landmarks1, landmarks2, weights)
+    elif model == 'homography':
+        return compute_homography_matrices(landmarks1, landmarks2)
+    exponents = POLYNOMIAL_MODELS[model]
+    return batched_least_squares(polynomial_design_matrix(landmarks1.reshape(-1, 2), exponents).reshape(landmarks1.shape[:2] + (-1,)), landmarks2, weights)
+
+def apply_transformations(model, params, points):
+    """
+    Maps one set of points through a batch of transformations of one family.
+
+    Parameters:
+    - model (str): Transformation family, one of 'affine', 'homography', 'quadratic' or 'third_order'.
+    - params (np.array): (B, ...) transformation parameters from `fit_transformations`.
+    - points (np.array): (N, 2) points to transform.
+
+    Returns:
+    - np.array: (B, N, 2) transformed points; points sent to infinity by a homography are set to inf.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if model in POLYNOMIAL_MODELS:
+        return polynomial_design_matrix(points, POLYNOMIAL_MODELS[model]) @ params
+    homogeneous = np.concatenate([points, np.ones((len(points), 1))], axis=1) @ np.swapaxes(params, 1, 2)
+    if model == 'affine':
+        return homogeneous[:, :, :2]
+    w = homogeneous[:, :, 2:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        transformed = homogeneous[:, :, :2] / w
+    transformed[np.broadcast_to(np.abs(w) < 1e-12, transformed.shape)] = np.inf
+    return transformed
+
+def ransac_transformation(set1, set2, model='affine', threshold=20, confidence=0.999, max_iterations=5000, batch_size=256, seed=0):
+    """
+    Robustly estimates a transformation mapping set1 onto set2 with a vectorised RANSAC, scoring a whole batch of
+    hypotheses per NumPy call.
+
+    Parameters:
+    - set1 (array-like): (N, 2) array or list of (x, y) tuples of source points.
+    - set2 (array-like): (N, 2) array or list of (x, y) tuples of corresponding target points.
+    - model (str, optional): Transformation family, one of 'affine', 'homography', 'quadratic' or 'third_order'.
+                           Defaults to 'affine'.
+    - threshold (float, optional): Largest transfer error, in pixels, of an inlier. Defaults to 20.
+    - confidence (float, optional): Probability of having drawn at least one all-inlier sample when stopping.
+                                  Defaults to 0.999.
+    - max_iterations (int, optional): Upper bound on the number of hypotheses. Defaults to 5000.
+    - batch_size (int, optional): Number of hypotheses fitted and scored per call. Defaults to 256.
+    - seed (int, optional): Seed of the sampler, so that results are reproducible. Defaults to 0.
 
-    for point1, point2 in zip(set1, set2):
-        transformed_point = transform_points_homography([point1], homography_matrix)[0]
-        error = landmark_error(point2, transformed_point)
+    Returns:
+    - tuple: Contains two items:
+        - np.array: The transformation refitted on all inliers: a (3x3) matrix for 'affine' and 'homography', or the
+                    2*K coefficients for 'quadratic' and 'third_order' (as `compute_quadratic_matrix` and
+                    `compute_third_order_polynomial_matrix` return them).
+        - np.array: (N,) boolean inlier mask.
+
+    Notes:
+        Hypotheses are fitted from minimal samples (3, 4, 6 or 10 points) in normalised coordinates and scored with the
+        truncated quadratic (MSAC) cost sum(min(e**2, threshold**2)), which ranks hypotheses with equal inlier counts by
+        how well they fit. After each batch, the number of hypotheses needed to reach `confidence` is re-estimated from
+        the best inlier ratio so far, so clean sets stop after one batch. The best model is refitted by least squares
+        on its inliers and the inliers are recomputed once with the refitted model.
+    """
+    set1 = np.asarray(set1, dtype=np.float64).reshape(-1, 2)
+    set2 = np.asarray(set2, dtype=np.float64).reshape(-1, 2)
+    sample_size = {'affine': 3, 'homography': 4, 'quadratic': len(QUADRATIC_EXPONENTS), 'third_order': len(THIRD_ORDER_EXPONENTS)}[model]
+    if len(set1) < sample_size:
+        raise ValueError("At least {} point pairs are required to fit a {} transformation.".format(sample_size, model))
+
+    # Score in normalised coordinates; polynomials also fit there for conditioning
+    centre, scale = point_normalisation(np.concatenate([set1, set2]))
+    src, dst, limit = (set1 - centre) / scale, (set2 - centre) / scale, threshold / scale
+    rng = np.random.default_rng(seed)
+    best_cost, best_inliers = np.inf, None
+    iterations, required = 0, max_iterations
+    while iterations < min(required, max_iterations):
+        samples = rng.random((batch_size, len(src))).argpartition(sample_size - 1, axis=1)[:, :sample_size]
+        params, valid = fit_transformations(model, src[samples], dst[samples])
+        errors = np.linalg.norm(apply_transformations(model, params[valid], src) - dst, axis=2)
+        errors = np.nan_to_num(errors, nan=np.inf)
+        costs = np.minimum(errors, limit) ** 2
+        costs = costs.sum(axis=1)
+        iterations += batch_size
+        if len(costs) and costs.min() < best_cost:
+            best = np.argmin(costs)
+            best_cost, best_inliers = costs[best], errors[best] <= limit
+            # Hypotheses needed to draw one all-inlier sample with the given confidence
+            all_inlier_probability = best_inliers.mean() ** sample_size
+            if all_inlier_probability >= 1:
+                break
+            if all_inlier_probability > 1e-12:
+                required = np.log(1 - confidence) / np.log(1 - all_inlier_probability)
+
+    if best_inliers is None or best_inliers.sum() < sample_size:
+        return None, np.zeros(len(set1), dtype=bool)
+
+    # Least-squares refit on the inliers, then one more inlier pass with the refitted model
+    for _ in range(2):
+        if model == 'affine':
+            matrices, valid = compute_affine_matrices(set1[best_inliers], set2[best_inliers])
+            transformation = matrices[0] if valid[0] else None
+        elif model == 'homography':
+            transformation, _ = cv2.findHomography(set1[best_inliers], set2[best_inliers], 0)
+        else:
+            transformation = compute_polynomial_matrix(set1[best_inliers], set2[best_inliers], POLYNOMIAL_MODELS[model])
+        if transformation is None:
+            break
+        params = transformation.reshape(2, -1).T if model in POLYNOMIAL_MODELS else transformation
+        errors = np.linalg.norm(apply_transformations(model, params[np.newaxis], set1)[0] - set2, axis=1)
+        inliers = errors <= threshold
+        if inliers.sum() < sample_size or np.array_equal(inliers, best_inliers):
+            break
+        best_inliers = inliers
+    return transformation, best_inliers
+
+def select_points(points, indices):
+    """
+    Selects a subset of points, keeping the container type of the input.
 
-        if error <= threshold:
-            updated_set1.append(point1)
-            updated_set2.append(point2)
+    Parameters:
+    - points (np.array or list of tuples): The points to select from.
+    - indices (np.array): Indices of the points to keep.
 
-    return updated_set1, updated_set2
+    Returns:
+    - np.array or list: `points[indices]` for arrays, otherwise a list of the selected points.
+    """
+    if isinstance(points, np.ndarray):
+        return points[indices]
+    return [points[i] for i in indices]
 
-def filter_outlier_cond(computed,original,criteria='affine', thresh=20):
+def filter_outlier_cond(computed,original,criteria='affine', thresh=20, estimator='ransac'):
     """
     Filters out outliers based on a specified condition.
 
-    This function processes two sets of points (computed and original) and filters out outliers based on a specified criteria (either 'affine' or 'homography'). The function uses either homography matrix estimation or affine error-based methods to identify and remove outliers.
+    This function processes two sets of points (computed and original) and filters out outliers based on a specified criteria ('affine', 'homography', 'quadratic' or 'third_order'). The function uses either the vectorised RANSAC engine or the OpenCV-based homography and affine error methods to identify and remove outliers.
 
     Parameters:
     - computed (list of tuples): List of computed points as (x, y) coordinates.
     - original (list of tuples): List of original points as (x, y) coordinates to compare against.
-    - criteria (str, optional): The criteria to use for filtering outliers. Options are 'affine' or 'homography'. Defaults to 'affine'.
+    - criteria (str, optional): The criteria to use for filtering outliers. Options are 'affine', 'homography', 'quadratic' or 'third_order'. Defaults to 'affine'.
     - thresh (int, optional): Threshold value used in the outlier removal process. Defaults to 20.
+    - estimator (str, optional): 'ransac' for `ransac_transformation`, or 'opencv' for the former OpenCV-based filters, which support 'affine' and 'homography' only. Defaults to 'ransac'.
 
     Returns:
-    - list: A list containing the filtered computed points after outlier removal.
-    - list: A list containing the filtered original points after outlier removal.
+    - list: A list containing the filtered computed points after outlier removal (an array if `computed` is one).
+    - list: A list containing the filtered original points after outlier removal (an array if `original` is one).
 
     Raises:
-    - AssertionError: If the length of the computed points is not 3.
+    - AssertionError: If fewer than 3 computed points are given.
+    - ValueError: If the estimator is unknown, or the 'opencv' estimator is asked for a criteria other than 'affine'
+                  or 'homography'.
 
     Notes:
-        If 'homography' is chosen as the criteria, the function estimates a homography matrix between the computed and original points and removes outliers based on the threshold.
+        With the 'ransac' estimator, a transformation of the chosen family is robustly fitted by `ransac_transformation` and the pairs whose transfer error exceeds the threshold are removed.
+        With 'opencv', if 'homography' is chosen as the criteria, the function estimates a homography matrix between the computed and original points and removes outliers based on the threshold.
         If 'affine' is chosen, it removes outliers based on affine transformation error exceeding the threshold.
     """
     assert len(computed) >= 3
-    if criteria=='homography':
-        computed,original = remove_outliers_based_on_error_homography(computed,original,thresh)
+    if estimator=='ransac':
+        _, inliers = ransac_transformation(computed,original,criteria,thresh)
+        inliers = np.flatnonzero(inliers)
+    elif estimator!='opencv':
+        raise ValueError("Unknown estimator '{}': expected 'ransac' or 'opencv'.".format(estimator))
+    elif criteria=='homography':
+        inliers = remove_outliers_based_on_error_homography(computed,original,thresh)
+    elif criteria=='affine':
+        inliers = remove_outliers_based_on_error_affine(computed,original,thresh)
     else:
-        computed,original = remove_outliers_based_on_error_affine(computed,original,thresh)
-    return computed,original
+        raise ValueError("Unsupported criteria '{}' for the 'opencv' estimator: expected 'affine' or 'homography'.".format(criteria))
+    return select_points(computed,inliers),select_points(original,inliers)
 
 def main_initialization(images,N,img_size,max_dist,offset,window_size,clip):
     """
@@ -1963,9 +3187,9 @@ def main_initialization(images,N,img_size,max_dist,offset,window_size,clip):
     and computing the Discrete Fourier Transform (DFT) for the given images.
 
     Parameters:
-        - images (list of str): List of image file paths that need processing.
+        - images (list of str or np.array): List of image file paths or decoded images that need processing.
         - N (int): Number of keypoints to detect or random points to select.
-        - img_size (tuple of int): The dimensions (width, height) to which images should be resized.
+        - img_size (int or tuple of int): The side length or (height, width) to which images should be resized.
         - max_dist (float): Maximum distance between keypoints for the SIFT algorithm.
         - offset (float): Offset used in the selection of random points.
         - window_size (int): Size of the window used in random point selection.
@@ -1973,83 +3197,82 @@ def main_initialization(images,N,img_size,max_dist,offset,window_size,clip):
 
     Returns:
         - tuple:
-            - images (list of np.array): The list of images after processing, possibly enhanced if CLAHE was applied.
-            - pts(list of tuples): the list of detected points after applying SIFT and Random point sampling on the image.
-            - dft (np.array): The result of the Discrete Fourier Transform applied on the images.
+            - images (list of str or np.array): The list of images after processing; in-memory arrays if CLAHE was applied.
+            - pts(np.array): (N, 2) array of the detected points after applying SIFT and Random point sampling on the image.
+            - dft (np.array): The result of the Discrete Fourier Transform applied on the images; with `fov_crop`, its
+                              `fov_masks` hold the field of view masks of the case.
 
     Notes:
         The function begins by extracting SIFT keypoints from the first image and augmenting these with randomly selected points.
         It then applies CLAHE if the clipping limit is specified and computes the DFT based on the keypoints and random points.
+        The field of view masks are computed once here, on the images before CLAHE, and reused by every featurization of
+        the case, retries included.
     """
     pts = SIFT_top_n_keypoints(images[0],N,img_size,max_dist)
-    pts = pts+select_random_points(images[0],N,img_size,offset,window_size)
+    pts = np.concatenate([pts, select_random_points(images[0],N,img_size,offset,window_size)])
+    masks = [fov_mask(image, img_size) for image in images] if fov_crop else None
     if clip > 0:
         images = CLAHE_Images(images, clip = clip)
-    dft = DFT(images,img_size,pts)
+    dft = DFT(images,img_size,pts,masks)
     return images,pts,dft
 
-def CLAHE_Images(imags,clip):
+def scratch_directory():
+    """
+    Returns the scratch directory of the current run, creating it on first use.
+
+    Returns:
+    - str: Path to a private temporary directory under the working directory.
+
+    Notes:
+        The directory is unique to this process (so concurrent runs in the same working directory never share it)
+        and is removed automatically when the interpreter exits. It is only created when something has to be spilled
+        to disk, as every preprocessing step otherwise passes images along in memory.
+    """
+    global _scratch_dir
+    if _scratch_dir is None:
+        _scratch_dir = tempfile.mkdtemp(prefix='RetinaRegNet_', dir=os.getcwd())
+        atexit.register(shutil.rmtree, _scratch_dir, ignore_errors=True)
+    return _scratch_dir
+
+_scratch_dir = None
+
+def CLAHE_Images(imags,clip,spill=False):
     """
-    Applies Contrast Limited Adaptive Histogram Equalization (CLAHE) to a list of image files to enhance
+    Applies Contrast Limited Adaptive Histogram Equalization (CLAHE) to a list of images to enhance
     their contrast. This method is particularly useful for improving the visibility of features in images
     that suffer from poor contrast.
 
     Parameters:
-    - imags (list of str): List of paths to the image files that need contrast enhancement.
+    - imags (list of str or np.array): List of image file paths or decoded images that need contrast enhancement.
     - clip (float): Clip limit for the CLAHE algorithm, which sets the threshold for contrast limiting.
                   The higher the clip limit, the more aggressive the contrast enhancement.
+    - spill (bool, optional): If True, the enhanced images are written to the run's scratch directory and their
+                            paths are returned instead of the arrays. Defaults to False.
 
     Returns:
-    - list of str: Returns a list of paths to the saved CLAHE-processed images. Each processed image is
-                 saved with a "CLAHE_" prefix in its filename to distinguish it from the original.
+    - list of np.array: The CLAHE-processed images, kept in memory so that they can be passed straight to the
+                      keypoint samplers and the featurizer. A list of file paths is returned instead when `spill` is True.
 
     Notes:
-        This function uses OpenCV's `createCLAHE` method to apply the CLAHE algorithm. Each image is
-        first converted to grayscale as CLAHE is typically applied to single-channel images for better
-        visualization of detail.
-        The images are processed in-place and saved in the same directory as the original, with 'CLAHE_'
-        prefixed to their original filenames.
+        Each image is first converted to grayscale as CLAHE is typically applied to single-channel images for
+        better visualization of detail (see `clahe`).
+        Spilled images are saved with a "CLAHE_" prefix in the scratch directory returned by `scratch_directory`,
+        which is private to the current run.
         It is recommended to adjust the `clip` parameter based on the specific requirements of the image
         content and the desired level of contrast enhancement.
     """
     imgs=[]
-    img_dir = os.path.join(os.getcwd(),'temp_dir')
-    clahe = cv2.createCLAHE(clipLimit=clip, tileGridSize=(8, 8))
-    os.makedirs(os.path.join(os.getcwd(),'temp_dir') ,exist_ok=True)
-    for img in imags:
-      fn,_ = os.path.splitext(os.path.basename(img))
-      ifn = os.path.join(img_dir,'CLAHE'+'_'+str(fn)+'.png')
-      imag = cv2.imread(img)
-      imag = Image.fromarray(np.uint8(imag))
-      imag = imag.convert('L')
-      img = np.asarray(imag)
-      image_equalized = clahe.apply(img)
-      image_equalized_img = Image.fromarray(np.uint8(image_equalized))
-      image_equalized = image_equalized_img.convert('RGB')
-      image_equalized = np.asarray(image_equalized)
-      cv2.imwrite(ifn,image_equalized);
-      imgs.append(ifn)
+    for i, img in enumerate(imags):
+      image_equalized = clahe(read_image(img), clip)
+      if spill:
+          fn = os.path.splitext(os.path.basename(img))[0] if isinstance(img, str) else str(i)
+          ifn = os.path.join(scratch_directory(),'CLAHE'+'_'+str(fn)+'.png')
+          cv2.imwrite(ifn,image_equalized);
+          image_equalized = ifn
+      imgs.append(image_equalized)
     return imgs
 
-def Feature_padding(feature_maps, size):
-    """
-    Pad feature maps to a uniform size using bilinear interpolation.
-
-    This function adjusts the size of each feature map in the input list to a specified uniform size using bilinear interpolation. This is typically used to standardize the size of feature maps obtained from different sources or processes.
-
-    Parameters:
-    - feature_maps (list of tensors): A list of feature map tensors to be resized.
-    - size (tuple): The target size for the feature maps as (height, width).
-
-    Returns:
-    - list: A list of uniformly sized feature maps.
-    """
-    uniform_feature_maps=[]
-    for feature in feature_maps:
-        uniform_feature_maps.append(F.interpolate(feature, size=size, mode='bilinear', align_corners=False))
-    return uniform_feature_maps
-
-def multi_resolution_features(orig_images,img_size,N,clip,offset,window_size,max_dist,timestep,up_ft_indices,multi_ch,multi_img_size,multi_iter):
+def multi_resolution_features(orig_images,img_size,N,clip,offset,window_size,max_dist,timestep,up_ft_indices,multi_ch,multi_img_size,multi_iter,prepared=None):
     """
     Generate multi-resolution features from images using SIFT, and Random Points.
 
@@ -2057,36 +3280,92 @@ def multi_resolution_features(orig_images,img_size,N,clip,offset,window_size,max
 
     Parameters:
     - orig_images (list of str): List of paths to the images to be processed.
-    - img_size (int): The size of the images for processing.
+    - img_size (int or tuple of int): The size of the images for processing, a side length or (height, width).
     - N (int): The number of keypoints to be used in SIFT.
     - clip (float): The clip limit for CLAHE.
     - max_dist (float): Maximum distance for keypoint selection in SIFT.
     - timestep (float): Timestep parameter for Diffusion Model initialization.
     - up_ft_indices (list): Indices for feature upsampling in the Diffusion Model.
     - multi_ch (bool): Flag to indicate multi-channel mode.
-    - multi_img_size (int): The size of the images for multi-resolution processing.
+    - multi_img_size (int): The size of the images for multi-resolution processing; the longer side of the grid of the
+                          first scale, which keeps the aspect ratio of img_size.
     - multi_iter (int): Number of iterations for multi-resolution processing.
+    - prepared (tuple, optional): Output of `main_initialization` for `orig_images`, whose preprocessed images and
+                                `DFT` are reused in single-channel mode instead of sampling the points again, and
+                                whose field of view masks are reused in both modes. Defaults to None.
 
     Returns:
-    - tuple: A tuple of source and target feature tensors.
+    - tuple: A tuple of source and target feature tensors, or of `MultiScaleFeatures` in multi-channel mode.
+
+    Notes:
+        In multi-channel mode the scales are no longer upsampled and concatenated into one
+        [1, multi_iter*C, H, W] map per image. They stay at their native resolution and
+        `DFT.compute_streamed_2d_correlation_maps` accumulates their correlations one scale at a time, so memory stays
+        flat as `multi_iter` grows.
     """
     if multi_ch:
-        src_fts,trg_fts =[],[]
+        src_ft,trg_ft = MultiScaleFeatures(grid_size(img_size)),MultiScaleFeatures(grid_size(img_size))
+        masks = prepared[2].fov_masks if prepared is not None else ([fov_mask(image, img_size) for image in orig_images] if fov_crop else None)
+        images = CLAHE_Images(orig_images, clip = clip) if clip > 0 else orig_images
         for i in range(multi_iter):
-            images,pts,dft = main_initialization(orig_images,N,multi_img_size*(i+1),max_dist,offset,window_size,clip)
-            src_ft1,trg_ft1 = dft.feature_upsampling(RetinaRegNet_Intialization(images,multi_img_size*(i+1),timestep,up_ft_indices))
-            src_fts.append(src_ft1)
-            trg_fts.append(trg_ft1)
-        src_fts = Feature_padding(src_fts,(img_size,img_size))
-        trg_fts = Feature_padding(trg_fts,(img_size,img_size))
-        src_ft = torch.cat(src_fts, dim=1)
-        trg_ft = torch.cat(trg_fts, dim=1)
+            scale_size = scaled_grid_size(img_size,multi_img_size*(i+1))
+            scale_masks = None if masks is None else [resize_fov_mask(mask, scale_size) for mask in masks]
+            ft = RetinaRegNet_Intialization(images,scale_size,timestep,up_ft_indices,feature_compression,feature_channels,scale_masks)
+            src_ft.append(ft[0:1],scale_size)
+            trg_ft.append(ft[1:],scale_size)
     else:
-        images,pts,dft = main_initialization(orig_images,N,img_size,max_dist,offset,window_size,clip)
-        src_ft,trg_ft = dft.feature_upsampling(RetinaRegNet_Intialization(images,img_size,timestep,up_ft_indices))
+        images,pts,dft = prepared if prepared is not None else main_initialization(orig_images,N,img_size,max_dist,offset,window_size,clip)
+        src_ft,trg_ft = dft.feature_upsampling(RetinaRegNet_Intialization(images,img_size,timestep,up_ft_indices,feature_compression,feature_channels,dft.fov_masks))
     return src_ft,trg_ft
 
-def landmarks_condition_check(orig_images, img_size, pts, t, uft, landmarks1, landmarks2, max_tries=2, num=100, iccl=3, outlier_cond='affine', thresh=20):
+retry_statistics = {'retried': 0, 'skipped': 0, 'useful': 0} # featurization retries run and useful, cases skipped
+
+def predict_retry_success(landmarks1, landmarks2, img_size, num, thresh, grid_cells=4):
+    """
+    Cheaply predicts whether re-featurizing an image pair can reach `num` matches, from the filtered matches of the
+    attempt that fell short.
+
+    Parameters:
+    - landmarks1 (np.array): (N, 2) filtered landmarks in the first image.
+    - landmarks2 (np.array): (N, 2) corresponding landmarks in the second image.
+    - img_size (int or tuple): Grid the landmarks live in, a side length or (height, width).
+    - num (int): Number of matches the retries aim for.
+    - thresh (float): Outlier threshold (px) the matches were filtered with.
+    - grid_cells (int, optional): The spread is measured on a grid_cells x grid_cells grid. Defaults to 4.
+
+    Returns:
+    - float: Score in [0, 1]; the product of the count, spread and residual terms below.
+
+    Notes:
+        count: N / num, capped at 1. A pair that only yields a handful of consistent matches rarely reaches the target
+        at another timestep.
+        spread: fraction of grid cells of the first image holding a match. Matches crowded into one region point at a
+        small overlap, which no featurization can fix.
+        residual: 1 - median affine residual / thresh. Inliers that only just pass the filter indicate a hard pair.
+        The score costs one affine fit, negligible next to a featurization of both images.
+    """
+    landmarks1, landmarks2 = as_points(landmarks1), as_points(landmarks2)
+    if len(landmarks1) < 6:
+        return 0.0
+    count = min(1.0, len(landmarks1) / num)
+    cells = np.clip((landmarks1 * grid_cells / np.float32(grid_dsize(img_size))).astype(int), 0, grid_cells - 1)
+    spread = len(np.unique(cells[:, 1] * grid_cells + cells[:, 0])) / grid_cells ** 2
+    try:
+        affine_matrix = compute_affine_matrix(landmarks1, landmarks2)
+    except np.linalg.LinAlgError:
+        return 0.0
+    residuals = landmark_error(apply_transformations('affine', affine_matrix[np.newaxis], landmarks1)[0], landmarks2)
+    residual = max(0.0, 1 - np.median(residuals) / thresh)
+    return count * spread * residual
+
+def print_retry_statistics():
+    """
+    Prints how many featurization retries were run and useful (i.e. improved the number of matches), and for how
+    many cases `predict_retry_success` skipped them, over the whole run.
+    """
+    print("Featurization retries: {retried} run, {useful} useful, skipped for {skipped} cases".format(**retry_statistics))
+
+def landmarks_condition_check(orig_images, img_size, pts, t, uft, landmarks1, landmarks2, max_tries=2, num=100, iccl=3, outlier_cond='affine', thresh=20, min_matches=None, min_score=None, fov_masks=None):
     """
     Iteratively attempts to improve image registration quality by enhancing image contrast and adjusting landmarks
     until certain quality conditions are met or a maximum number of attempts is reached. This function applies CLAHE
@@ -2095,7 +3374,7 @@ def landmarks_condition_check(orig_images, img_size, pts, t, uft, landmarks1, la
 
     Parameters:
     - orig_images (list of str): Paths to the original images to be processed.
-    - img_size (int): Size of the images to be processed, assumed to be square.
+    - img_size (int or tuple of int): Size of the images to be processed, a side length or (height, width).
     - pts (list): List of all sampled feature keypoints in the image
     - t (float): Threshold parameter for initializing the Diffusion Model.
     - uft (float): Parameter for extracting diffusion features from the diffusion model.
@@ -2106,6 +3385,12 @@ def landmarks_condition_check(orig_images, img_size, pts, t, uft, landmarks1, la
     - iccl (float, optional): Inverse consistency criteria limit used in landmark filtering. Defaults to 3.
     - outlier_cond (str, optional): Condition used to determine outliers. Defaults to 'affine'.
     - thresh (float, optional): Threshold used for filtering outliers. Defaults to 20.
+    - min_matches (int, optional): Number of landmarks from which the featurization is not retried even if fewer than
+                                 `num` were found, e.g. when a robust (IRLS) fit follows. Defaults to None, i.e. `num`.
+    - min_score (float, optional): Retries are skipped when `predict_retry_success` scores the first attempt below
+                                 this. Defaults to None, always retry.
+    - fov_masks (list of np.array, optional): Field of view masks of the images (see `main_initialization`), reused by
+                                            every retry. Defaults to None, no field of view restriction.
 
     Returns:
     - tuple: Depending on the success of the registration process, this function returns:
@@ -2121,20 +3406,27 @@ def landmarks_condition_check(orig_images, img_size, pts, t, uft, landmarks1, la
         The effectiveness of the registration process depends heavily on the quality and accuracy of the input landmarks.
         CLAHE and other image processing techniques may not always produce the desired results if the input images
         are of poor quality or the initial landmarks are inaccurately defined.
+        Retries stop as soon as one reaches `num` landmarks. The retries run and useful, and the cases whose retries
+        were skipped, are counted in `retry_statistics`.
     """
-    imgs,lim,land_marks1, land_marks2,list_landmarks_2, list_sim_scores,list_landmarks_1,temp = [], [], [], [], [],[],[],[]
+    lim,land_marks1, land_marks2,list_landmarks_2, list_sim_scores,list_landmarks_1,temp = [], [], [], [], [],[],[]
     tries, ch, = 0, 0
     assert len(landmarks1) == len(landmarks2), f"Points lengths are incompatible: {len(landmarks1)} != {len(landmarks2)}."
     landmarks2,landmarks1 = filter_outlier_cond(landmarks2,landmarks1,outlier_cond,thresh)
     list_landmarks_1.append(landmarks1)
-    imgs.append(orig_images)
     list_landmarks_2.append(landmarks2)
-    if len(landmarks2) < num:
+    if len(landmarks2) < num and (min_matches is None or len(landmarks2) < min_matches):
         print("Image Registration Unsuccessful for Original Set of Images")
+        if min_score is not None:
+            score = predict_retry_success(landmarks1, landmarks2, img_size, num, thresh)
+            if score < min_score:
+                print("Skipping {0} featurization retries: predicted success {1:.3f} < {2}".format(max_tries, score, min_score))
+                retry_statistics['skipped'] += 1
+                return orig_images, landmarks1, landmarks2
         while len(land_marks2) < num and tries< max_tries:
             print("Executing Trial", tries + 1)
-            dft = DFT(orig_images, img_size, pts)
-            src_ft,trg_ft = dft.feature_upsampling(RetinaRegNet_Intialization(orig_images,img_size,t + 75*tries,uft))
+            dft = DFT(orig_images, img_size, pts, fov_masks)
+            src_ft,trg_ft = dft.feature_upsampling(RetinaRegNet_Intialization(orig_images,img_size,t + 75*tries,uft,feature_compression,feature_channels,fov_masks))
             land_marks1,sim_score, land_marks2 = dft.feature_maps(src_ft,trg_ft,iccl)
             del src_ft
             del trg_ft
@@ -2142,15 +3434,19 @@ def landmarks_condition_check(orig_images, img_size, pts, t, uft, landmarks1, la
             gc.collect()
             land_marks2,land_marks1 = filter_outlier_cond(land_marks2,land_marks1,outlier_cond,thresh)
             list_landmarks_1.append(land_marks1)
-            imgs.append(images)
             list_landmarks_2.append(land_marks2)
             list_sim_scores.append(np.mean(sim_score))
+            retry_statistics['retried'] += 1
+            if len(land_marks2) > max(len(l) for l in list_landmarks_2[:-1]):
+                retry_statistics['useful'] += 1
             tries += 1
         for i in range(len(list_landmarks_2)):
             lim.append(len(list_landmarks_2[i]))
         idx = np.argmax(np.array(lim))
         return orig_images,list_landmarks_1[idx],list_landmarks_2[idx]
     else:
+        if len(landmarks2) < num:
+            print("Marginal number of matches ({}); relying on the robust fit instead of re-featurizing".format(len(landmarks2)))
         return orig_images, landmarks1, landmarks2
 
 def folder_structure(path):
@@ -2236,18 +3532,10 @@ def text_points_extraction(pnts):
     - pnts (str): Path to the text file containing point coordinates.
 
     Returns:
-    - tuple: Lists of fixed points and moving points.
+    - tuple: (N, 2) arrays of fixed points and moving points.
     """
-    fixed_pnts = []
-    moving_pnts = []
-    with open(pnts, 'r') as file:
-        for line in file:
-            points = [float(coord) for coord in line.strip().split(',')]
-            fps = tuple(points[:2])
-            lps = tuple(points[2:])
-            fixed_pnts.append(fps)
-            moving_pnts.append(lps)
-    return fixed_pnts,moving_pnts
+    points = np.loadtxt(pnts, delimiter=',', dtype=np.float32, ndmin=2)
+    return as_points(points[:, :2]),as_points(points[:, 2:4])
 
 def info_extraction(fixed,moving, pnts):
     """
@@ -2284,20 +3572,16 @@ def coordinates_rescaling(pnts,H,W,img_shape):
     Rescale a list of coordinates based on given height and width ratios.
 
     Parameters:
-    - pnts (list of tuples): List of (x, y) coordinates to be rescaled.
+    - pnts (np.array): (N, 2) array (or list of tuples) of (x, y) coordinates to be rescaled.
     - H (int): Original height.
     - W (int): Original width.
-    - img_shape (int): Desired image dimension (assumes square shape).
+    - img_shape (int or tuple): Desired image dimension, a side length or (height, width).
 
     Returns:
-    - list of tuples: List of rescaled (x, y) coordinates.
+    - np.array: (N, 2) array of rescaled (x, y) coordinates.
     """
-    scaled_points=[]
-    for row in pnts:
-        a = (row[0]/W)*img_shape
-        b = (row[1]/H)*img_shape
-        scaled_points.append((a,b))
-    return scaled_points
+    height, width = grid_size(img_shape)
+    return as_points(pnts) * np.float32([width / W, height / H])
 
 def coordinates_processing(image1,image2,fpnts,mpnts,img_shape=256):
     """
@@ -2308,7 +3592,7 @@ def coordinates_processing(image1,image2,fpnts,mpnts,img_shape=256):
     - image2 (str): Path to the second image.
     - fpnts (list of tuples): List of (x, y) coordinates related to the first image.
     - mpnts (list of tuples): List of (x, y) coordinates related to the second image.
-    - img_shape (int, optional): Desired image dimension for rescaling. Default is 256.
+    - img_shape (int or tuple, optional): Desired image dimension for rescaling, a side length or (height, width). Default is 256.
 
     Returns:
     - tuple: A tuple containing:
@@ -2334,7 +3618,7 @@ def feature_scaling(images,fixed_points,moving_points,img_shape):
     - images (list): List of tuples containing image paths for fixed and moving images.
     - fixed_points (list): List of fixed points corresponding to each image.
     - moving_points (list): List of moving points corresponding to each image.
-    - img_shape (int): Desired image dimension for rescaling.
+    - img_shape (int or tuple): Desired image dimension for rescaling, a side length or (height, width).
 
     Returns:
     - tuple: A tuple containing:
@@ -2386,15 +3670,134 @@ def data_preprocessing(path):
     images,fixed_points,moving_points=info_extraction(fixed,moving,pnts)
     return images,fixed_points,moving_points
 
-def RetinaRegNet_Intialization(filelist,img_size = 256,timestep = 75,up_ft_index = 2):
+sd_featurizers = {} # loaded featurizers by model id, see persistent_featurizer
+fixed_feature_cache = {} # diffusion features of the current fixed image by (image digest, size, timestep, up_ft_index)
+
+def load_featurizer(sd_id='stabilityai/stable-diffusion-2-1'):
+    """
+    Returns an `SDFeaturizer` for `sd_id`, loading the model only once per run when `persistent_featurizer` is set.
+
+    Parameters:
+    - sd_id (str, optional): Stable diffusion model ID. Defaults to 'stabilityai/stable-diffusion-2-1'.
+
+    Returns:
+    - SDFeaturizer: The featurizer.
+    """
+    if not persistent_featurizer:
+        return SDFeaturizer(sd_id=sd_id)
+    if sd_id not in sd_featurizers:
+        sd_featurizers[sd_id] = SDFeaturizer(sd_id=sd_id)
+    return sd_featurizers[sd_id]
+
+def fixed_image_features(dfm, img, img_tensor, timestep, up_ft_index, prompt):
+    """
+    Returns the diffusion features of the fixed image, computing them only once per (timestep, size, up_ft_index).
+
+    Parameters:
+    - dfm (SDFeaturizer): Featurizer used on a cache miss.
+    - img (PIL.Image): The resized fixed image; its pixels key the cache.
+    - img_tensor (torch.Tensor): The image tensor passed to the featurizer.
+    - timestep (int): Time step of the diffusion model.
+    - up_ft_index (int): Index of the up-sampling block the features are taken from.
+    - prompt (str): Prompt conditioning the featurizer.
+
+    Returns:
+    - torch.Tensor: The features, as returned by `SDFeaturizer.forward`.
+
+    Notes:
+        Within one case the fixed image is the same through stage 1, stage 2 and every retry of
+        `landmarks_condition_check`; only the moving image or the timestep changes. The key is a digest of the resized
+        pixels, so a different fixed image (the next case, or CLAHE-enhanced inputs) can never hit a stale entry, and
+        the cache is emptied as soon as one shows up, holding at most one entry per timestep and size.
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(img).tobytes()).hexdigest()
+    key = (digest, img.size, timestep, up_ft_index)
+    if key not in fixed_feature_cache:
+        if any(cached[0] != digest for cached in fixed_feature_cache):
+            fixed_feature_cache.clear()
+        fixed_feature_cache[key] = dfm.forward(img_tensor, timestep, up_ft_index, prompt=prompt, ensemble_size=8)
+    return fixed_feature_cache[key]
+
+def feature_match_agreement(features, reduced, samples=256, seed=0):
+    """
+    Measures how many feature matches survive a channel reduction.
+
+    Parameters:
+    - features (torch.Tensor): (2, C, h, w) original features of the moving and fixed image.
+    - reduced (torch.Tensor): (2, C', h, w) reduced features of the same pair.
+    - samples (int, optional): Number of moving-image pixels whose match is compared. Defaults to 256.
+    - seed (int, optional): Seed of the pixel sample. Defaults to 0.
+
+    Returns:
+    - float: Fraction of the sampled pixels whose best (cosine similarity) match in the fixed image is unchanged.
+
+    Notes:
+        The matches are taken at the native feature resolution, so the check costs a small fraction of the
+        full-resolution matching it estimates.
+    """
+    _, _, h, w = features.shape
+    generator = torch.Generator().manual_seed(seed)
+    index = torch.randperm(h*w, generator=generator)[:samples].to(features.device)
+    matches = []
+    for ft in (features, reduced):
+        source = F.normalize(ft[0].flatten(1).float(), dim=0)
+        target = F.normalize(ft[1].flatten(1).float(), dim=0)
+        matches.append((source[:, index].t() @ target).argmax(1))
+    return (matches[0] == matches[1]).float().mean().item()
+
+def compress_features(ft, method='pca', channels=64, seed=0):
+    """
+    Projects the diffusion features of an image pair onto fewer channels before matching.
+
+    Parameters:
+    - ft (torch.Tensor): (2, C, h, w) features of the moving and fixed image, as returned by the featurizer.
+    - method (str, optional): 'pca' fits the projection jointly on the pair; 'random' uses a fixed seeded Gaussian
+                            random projection. Defaults to 'pca'.
+    - channels (int, optional): Number of channels C' kept. Defaults to 64.
+    - seed (int, optional): Seed of the random projection. Defaults to 0.
+
+    Returns:
+    - torch.Tensor: (2, C', h, w) reduced features, or `ft` itself if it has no more than C' channels.
+
+    Notes:
+        Matching compares features by their dot products (cosine similarity). The uncentred PCA basis, i.e. the top
+        eigenvectors of the pair's C x C Gram matrix, keeps those dot products best, so the features are not centred.
+        The random projection is scaled by 1/sqrt(C') so that dot products are preserved in expectation.
+        The projection is linear, so applying it before `DFT.feature_upsampling` is the same as applying it after,
+        at a fraction of the cost. Every matching FLOP and byte downstream scales with C'/C.
+        The share of sampled matches left unchanged (`feature_match_agreement`) is printed.
+    """
+    n, C, h, w = ft.shape
+    if channels >= C:
+        return ft
+    X = ft.float().permute(0, 2, 3, 1).reshape(-1, C) # (2*h*w, C)
+    if method == 'pca':
+        _, eigenvectors = torch.linalg.eigh(X.t() @ X)
+        projection = eigenvectors[:, -channels:]
+    elif method == 'random':
+        generator = torch.Generator().manual_seed(seed)
+        projection = (torch.randn(C, channels, generator=generator) / math.sqrt(channels)).to(X.device)
+    else:
+        raise ValueError("Unknown feature compression '{}': expected 'pca' or 'random'.".format(method))
+    reduced = (X @ projection).reshape(n, h, w, channels).permute(0, 3, 1, 2).contiguous().to(ft.dtype)
+    agreement = feature_match_agreement(ft, reduced, seed=seed)
+    print("Feature compression ({0}): {1} -> {2} channels, {3:.1%} of sampled matches unchanged".format(method, C, channels, agreement))
+    return reduced
+
+def RetinaRegNet_Intialization(filelist,img_size = 256,timestep = 75,up_ft_index = 2,compression = None,channels = 64,fov_masks = None):
     """
     Initialize RetinaRegNet by processing a list of image files.
 
     Parameters:
-    - filelist (list of str): List of paths to image files for feature extraction.
-    - img_size (int, optional): Desired size for resizing images. Default is 256.
+    - filelist (list of str or np.array): List of image file paths or decoded (BGR) images for feature extraction.
+    - img_size (int or tuple, optional): Desired size for resizing images, a side length or (height, width). Default is 256.
     - timestep (int, optional): Time step for the intializing the diffusion model. Default is 75.
     - up_ft_index (int, optional): Index for the extracting diffusion features from the diffusion model . Default is 2
+    - compression (str, optional): Channel reduction of the features, 'pca' or 'random' (see `compress_features`).
+                                 Default is None, no reduction.
+    - channels (int, optional): Number of channels kept by the reduction. Default is 64.
+    - fov_masks (list of np.array, optional): Field of view masks of the images on the img_size grid; only their
+                                            bounding boxes are featurized. Default is None, the whole images.
 
     Returns:
     - ft (torch.Tensor): A tensor containing the Diffusion features of the images in the list.
@@ -2403,28 +3806,54 @@ def RetinaRegNet_Intialization(filelist,img_size = 256,timestep = 75,up_ft_index
         The function uses the SDFeaturizer from the 'stabilityai/stable-diffusion-2-1' model to extract stable diffusion features
         from each image. After processing all images, the extracted features are concatenated into a single tensor.
         To avoid memory issues, the function cleans up resources after processing.
+        Each image is resized to the img_size grid without distortion of a rectangular grid, then zero (black) padded
+        at the bottom and right to `padded_grid_size`, as the UNet needs sides that are multiples of 64.
+        `DFT.feature_upsampling` crops the padding off the features again.
+        With `fov_masks`, only the 64-aligned bounding box of the field of view (`fov_bounding_box`) goes through the
+        UNet. Its features are placed back on the feature grid of the whole image, with zeros outside the box.
+        The last image of `filelist` is the fixed image in both stages; its features are reused from
+        `fixed_feature_cache`, so a retry or stage 2 only feeds the new moving image through the UNet.
     """
     ft = []
     imglist = []
-    dfm = SDFeaturizer(sd_id='stabilityai/stable-diffusion-2-1')
-    for filename in filelist:
-        img = Image.open(filename).convert('RGB')
-        img = img.resize((img_size, img_size))
+    dfm = load_featurizer('stabilityai/stable-diffusion-2-1')
+    for index, filename in enumerate(filelist):
+        img = Image.fromarray(cv2.cvtColor(read_image(filename), cv2.COLOR_BGR2RGB))
+        img = img.resize(grid_dsize(img_size))
+        padded = Image.new('RGB', grid_dsize(padded_grid_size(img_size)))
+        padded.paste(img)
+        img = padded
+        if fov_masks is not None:
+            upper, lower, left, right = fov_bounding_box(fov_masks[index])
+            img = img.crop((left, upper, right, lower))
         imglist.append(img)
         img_tensor = (PILToTensor()(img) / 255.0 - 0.5) * 2
-        ft.append(dfm.forward(img_tensor,
-                               timestep,
-                               up_ft_index,
-                               prompt='FLoRI21',
-                               ensemble_size=8))
+        if index == len(filelist) - 1:
+            feature = fixed_image_features(dfm, img, img_tensor, timestep, up_ft_index, 'FLoRI21')
+        else:
+            feature = dfm.forward(img_tensor,
+                                   timestep,
+                                   up_ft_index,
+                                   prompt='FLoRI21',
+                                   ensemble_size=8)
+        if fov_masks is not None:
+            stride = (lower - upper) // feature.shape[2]
+            padded_height, padded_width = padded_grid_size(img_size)
+            canvas = feature.new_zeros((1, feature.shape[1], padded_height // stride, padded_width // stride))
+            canvas[:, :, upper // stride:lower // stride, left // stride:right // stride] = feature
+            feature = canvas
+        ft.append(feature)
     ft = torch.cat(ft, dim=0)
+    if compression is not None:
+        ft = compress_features(ft, compression, channels)
 
     del dfm
-    torch.cuda.empty_cache()
+    if not persistent_featurizer:
+        torch.cuda.empty_cache()
     gc.collect()
     return ft
 
-def main(orig_images,rpth,ifn,stage_num,img_size=256,up_ft_indices = 1,timestep = 75,N=50,offset=0.01,window_size=51,max_dist =5,iccl=3,outlier_cond='affine',thresh=20,max_tries=3,num=50,clip = 1.0, disp_clip=0.0, multi_ch=True,multi_iter=3, multi_img_size=256):
+def main(orig_images,rpth,ifn,stage_num,img_size=256,up_ft_indices = 1,timestep = 75,N=50,offset=0.01,window_size=51,max_dist =5,iccl=3,outlier_cond='affine',thresh=20,max_tries=3,num=50,clip = 1.0, disp_clip=0.0, multi_ch=True,multi_iter=3, multi_img_size=256, min_matches=None, retry_min_score=None, prepared=None):
     """
     Perform image registration and point correspondence using a series of processing steps.
 
@@ -2433,7 +3862,7 @@ def main(orig_images,rpth,ifn,stage_num,img_size=256,up_ft_indices = 1,timestep
     - rpth (str): Path to save the resulting registered images.
     - ifn (str): File name prefix for the saved images.
     - stage_num (int): Stage number for referencing in plots and outputs.
-    - img_size (int, optional): Size of the input images (default is 256).
+    - img_size (int or tuple of int, optional): Size of the input images, a side length or (height, width) (default is 256).
     - up_ft_indices (int, optional): Up-sampling factor for feature indices (default is 1).
     - timestep (int, optional): Time step for feature extraction (default is 75).
     - N (int, optional): Number of keypoints to extract (default is 50).
@@ -2450,63 +3879,226 @@ def main(orig_images,rpth,ifn,stage_num,img_size=256,up_ft_indices = 1,timestep
     - multi_ch (bool, optional): Flag indicating whether to use multi-channel processing (default is True).
     - multi_iter (int, optional): Number of iterations for multi-channel processing (default is 3).
     - multi_img_size (int, optional): Size of images for multi-channel processing (default is 256).
+    - min_matches (int, optional): Number of matches from which the featurization is not retried (default is None, i.e. `num`).
+    - retry_min_score (float, optional): Predicted retry success below which the featurization is not retried (default is None, always retry).
+    - prepared (tuple, optional): Output of `main_initialization` for `orig_images`, computed ahead of time (default is None).
 
     Returns:
-    - original (list): List of original image points.
-    - computed (list): List of computed image points after registration.
+    - original (np.array): (N, 2) array of original image points.
+    - computed (np.array): (N, 2) array of computed image points after registration.
 
     Note:
         This function performs various processing steps including feature extraction, feature matching,
         outlier removal, and image registration.
         It saves the resulting registered images in the specified directory.
-        If the image registration is unsuccessful, empty lists are returned for both original and computed points.
+        If the image registration is unsuccessful, empty arrays are returned for both original and computed points.
     """
-    images,pts,dft = main_initialization(orig_images,N,img_size,max_dist,offset,window_size,clip)
-    src_ft,trg_ft = multi_resolution_features(orig_images,img_size,N,clip,offset,window_size,max_dist,timestep,up_ft_indices,multi_ch,multi_img_size,multi_iter)
+    images,pts,dft = prepared if prepared is not None else main_initialization(orig_images,N,img_size,max_dist,offset,window_size,clip)
+    src_ft,trg_ft = multi_resolution_features(orig_images,img_size,N,clip,offset,window_size,max_dist,timestep,up_ft_indices,multi_ch,multi_img_size,multi_iter,(images,pts,dft))
     pnts,rmaxs, rspts = dft.feature_maps(src_ft,trg_ft,iccl)
     del src_ft
     del trg_ft
     torch.cuda.empty_cache()
     gc.collect()
-    images,original,computed = landmarks_condition_check(images, img_size, pts, timestep, up_ft_indices, pnts, rspts, max_tries, num, iccl, outlier_cond, thresh)
+    images,original,computed = landmarks_condition_check(images, img_size, pts, timestep, up_ft_indices, pnts, rspts, max_tries, num, iccl, outlier_cond, thresh, min_matches, retry_min_score, dft.fov_masks)
     if len(computed)!=0:
         image_point_correspondences(images[::-1],img_size,computed,original,rpth,ifn,stage_num,disp_clip=disp_clip)
         return original,computed
     else:
         print("Image Registration is Unsuccessful for the presented Images due to unsufficent Matching Features")
-        return [],[]
+        return as_points([]),as_points([])
     torch.cuda.empty_cache()
 
-images,fixed_points,moving_points = data_preprocessing('FLoRI21_DataPort')
-fixed_image_size,moving_image_size,max_image_size,scaled_fixed_points,scaled_moving_points,scaled_original_moving_points  = feature_scaling(images,fixed_points,moving_points,img_size)
+def prefetched_cases(cases, prefetch=None):
+    """
+    Yields the cases of an evaluation loop together with their prefetched inputs, preparing case i+1 in a background
+    thread while the caller works on case i.
+
+    Parameters:
+    - cases (iterable): Case arguments.
+    - prefetch (callable, optional): CPU-bound preparation of a case (decoding, keypoint sampling), called with the case
+                                   arguments. Defaults to None, in which case nothing is prepared.
+
+    Yields:
+    - tuple: (case, prepared), `prepared` being the output of `prefetch` for the case, or None.
+
+    Notes:
+        A single thread is enough: OpenCV releases the GIL while decoding and detecting keypoints, as does PyTorch
+        while the UNet runs, and only one case is ever prepared ahead so at most two cases are held in memory.
+    """
+    cases = list(cases)
+    if prefetch is None:
+        for case in cases:
+            yield case, None
+        return
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        upcoming = prefetcher.submit(prefetch, cases[0]) if cases else None
+        for k, case in enumerate(cases):
+            prepared = upcoming.result()
+            if k + 1 < len(cases):
+                upcoming = prefetcher.submit(prefetch, cases[k + 1])
+            yield case, prepared
+
+def finish_and_flush(finish, case):
+    """
+    Runs `finish` on a case in a worker process of `run_cases` and waits for the figures and images it queued.
+
+    Parameters:
+    - finish (callable): CPU-bound tail of a case.
+    - case: Input of `finish`.
+
+    Returns:
+    - The result of `finish`.
+    """
+    result = finish(case)
+    flush_results()
+    return result
+
+def run_cases(cases, register, finish, workers=2, prefetch=None):
+    """
+    Runs the cases of an evaluation loop, overlapping the CPU-bound tail of earlier cases with the featurizer-bound
+    part of later ones.
+
+    Parameters:
+    - cases (iterable): Case arguments, passed one at a time to `register`.
+    - register (callable): Featurizer-bound part of a case, called with the case arguments and the output of `prefetch`.
+                         It runs in this process, which owns the featurizer, in case order, and returns the (picklable)
+                         input of `finish`.
+    - finish (callable): CPU-bound tail of a case (warps, plots, image files, errors), run in a worker process. Must be
+                       a module-level function.
+    - workers (int, optional): Number of worker processes, which is also the number of finished-but-uncollected cases
+                             allowed before `register` waits for the oldest. 0 runs every case serially in this process.
+                             Defaults to 2.
+    - prefetch (callable, optional): CPU-bound preparation of a case, run one case ahead in a background thread
+                                   (see `prefetched_cases`). Defaults to None.
+
+    Returns:
+    - list: The results of `finish`, in case order.
 
-landmark_errors=[]
-for i in range(len(images)):
+    Notes:
+        The workers are forked, so they inherit the loaded data and settings of the script without re-running it; they
+        never touch the GPU. All of them are forked up front, before the prefetch thread starts and with the writer
+        threads stopped, as Python before 3.11 otherwise forks them on demand while those threads are running.
+        The bounded number of cases in flight keeps memory flat and makes the featurizer wait rather than queue up
+        work when the CPU stages are the bottleneck.
+    """
+    if workers == 0:
+        return [finish(register(case, prepared)) for case, prepared in prefetched_cases(cases, prefetch)]
+    results, pending = [], deque()
+    close_results()
+    context = multiprocessing.get_context('fork')
+    # every worker waits in its initializer until all of them exist, so the startup tasks below fork one worker each
+    startup = context.Barrier(workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=startup.wait) as pool:
+        for started in [pool.submit(int) for _ in range(workers)]:
+            started.result()
+        for case, prepared in prefetched_cases(cases, prefetch):
+            pending.append(pool.submit(finish_and_flush, finish, register(case, prepared)))
+            while len(pending) > workers:
+                results.append(pending.popleft().result())
+        while pending:
+            results.append(pending.popleft().result())
+    return results
+
+def prefetch_case(images):
+    """
+    Prepares the first stage of a FLoRI21 case ahead of its featurization: decodes both images and samples the points
+    to match on the moving one.
+
+    Parameters:
+    - images (list): (moving, fixed) image paths of the case.
+
+    Returns:
+    - tuple: (decoded images, output of `main_initialization`), as expected by `register_case`.
+
+    Notes:
+        The sampling settings must match the stage-1 `main` call in `register_case`.
+    """
+    decoded = [read_image(image) for image in images]
+    return decoded, main_initialization(decoded,N=1000,img_size=img_size,max_dist=5,offset=0.01,window_size=51,clip=0.0)
+
+def register_case(i, images, fixed_points, moving_points, fixed_image_size, moving_image_size, max_image_size, scaled_fixed_points, scaled_moving_points, prepared=None):
+    """
+    Runs the featurizer-bound part of the registration of one FLoRI21 case: both RetinaRegNet stages, with the stage-1
+    homography applied only to the low-resolution grid the second stage needs.
+
+    Parameters:
+    - i (int): Index of the case.
+    - images (list): (moving, fixed) image paths of every case.
+    - fixed_points, moving_points (list): Ground-truth landmarks of every case.
+    - fixed_image_size, moving_image_size, max_image_size (list): Image sizes of every case.
+    - scaled_fixed_points, scaled_moving_points (list): Ground-truth landmarks of every case on the img_size grid.
+    - prepared (tuple, optional): Output of `prefetch_case` for the case. Defaults to None.
+
+    Returns:
+    - dict or None: Everything `finish_case` needs, or None if the first stage failed.
+    """
     print("Case {}".format(i))
     print("Loading Fixed Images {0} Moving Image{1} to the framework".format(images[i][1],images[i][0]))
-    original_low_res,computed_low_res = main(images[i],os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Stage1'),str(i),str(1),img_size,up_ft_indices = 2,timestep = 1,N=1000,offset=0.01,window_size=51,max_dist = 5,iccl=3,outlier_cond='affine',thresh=40, max_tries=2,num=100,clip = 0.0,disp_clip = 0.0,multi_ch=False,multi_iter=5, multi_img_size=256)
-    imags,imgs,homography_matrix_low_res = compute_homography_matrix_and_plot(images[i][::-1], img_size,original_low_res,computed_low_res,os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Stage1'),str(i),str(1),disp_clip = 0.0)
-    if len(homography_matrix_low_res) !=0:
-        transformed_points_hom = transform_points_homography(scaled_moving_points[i],homography_matrix_low_res)
-        transformed_points_high_res_hom =  coordinates_rescaling(transformed_points_hom,img_size,img_size,max_image_size[i])
-        original_low_res,computed_low_res = main(imags,os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Stage2'),str(i),str(2),img_size,up_ft_indices = 2,timestep = 1,N=1000,offset=0.01,window_size=51,max_dist = 5,iccl=3,outlier_cond='affine',thresh=30, max_tries=2,num=100,clip = 0.0,disp_clip = 0.0,multi_ch=False,multi_iter=5, multi_img_size=256)
-        imgs,imags,polynomial_matrix_low_res = compute_third_order_polynomial_matrix_and_plot(imags[::-1], img_size,original_low_res,computed_low_res,os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Stage2'),str(i),str(2),disp_clip = 0.0)
-        if len(polynomial_matrix_low_res) !=0:
-            ## rescaled version for dispaly purposes
-            transformed_points_poly = transform_points_third_order_polynomial(transformed_points_hom, polynomial_matrix_low_res)
-            original_image_point_correspondences(imags,images[i][0],img_size, scaled_fixed_points[i], scaled_moving_points[i], transformed_points_poly,os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Final_Registration_Results'), str(i),disp_clip = 0.0)
-            ### Original Version for computation of errors
-            polynomial_matrix = transform_points_third_order_polynomial_matrix(original_low_res,computed_low_res,img_size,max_image_size[i])
-            bef_error = compute_landmark_error(fixed_points[i],fixed_image_size[i],moving_points[i],moving_image_size[i],max_image_size[i])
-            aft_error = compute_landmark_error_fixed_space(polynomial_matrix,fixed_points[i],transformed_points_high_res_hom,max_image_size[i],fixed_image_size[i])
-            print("Mean Landmark Error for Case {0} Before Registration is {1} pixels".format(i,bef_error))
-            print("Mean Landmark Error for Case {0} After Registration is {1} pixels".format(i,aft_error))
-            landmark_errors.append(aft_error)
-        else:
-            landmark_errors.append(10000)
-    else:
-        landmark_errors.append(10000)
+    case_images, initialization = prepared if prepared is not None else (images[i], None)
+    original_low_res,computed_low_res = main(case_images,os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Stage1'),str(i),str(1),img_size,up_ft_indices = 2,timestep = 1,N=1000,offset=0.01,window_size=51,max_dist = 5,iccl=3,outlier_cond='affine',thresh=40, max_tries=2,num=100,clip = 0.0,disp_clip = 0.0,multi_ch=False,multi_iter=5, multi_img_size=256,retry_min_score=retry_min_score,prepared=initialization)
+    imags,imgs,homography_matrix_low_res = compute_homography_matrix_and_plot(case_images[::-1], img_size,original_low_res,computed_low_res,os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Stage1'),str(i),str(1),disp_clip = 0.0,save_images=False,lazy_warp=True)
+    if len(homography_matrix_low_res) ==0:
+        return None
+    transformed_points_hom = transform_points_homography(scaled_moving_points[i],homography_matrix_low_res)
+    original_low_res,computed_low_res = main(imags,os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Stage2'),str(i),str(2),img_size,up_ft_indices = 2,timestep = 1,N=1000,offset=0.01,window_size=51,max_dist = 5,iccl=3,outlier_cond='affine',thresh=30, max_tries=2,num=100,clip = 0.0,disp_clip = 0.0,multi_ch=False,multi_iter=5, multi_img_size=256,min_matches=irls_min_matches,retry_min_score=retry_min_score)
+    return {'index': i, 'moving_image': images[i][0], 'stage1_images': imgs, 'images': imags, 'homography_matrix': homography_matrix_low_res,
+            'transformed_points_hom': transformed_points_hom, 'original_low_res': original_low_res, 'computed_low_res': computed_low_res,
+            'fixed_points': fixed_points[i], 'moving_points': moving_points[i], 'fixed_image_size': fixed_image_size[i],
+            'moving_image_size': moving_image_size[i], 'max_image_size': max_image_size[i],
+            'scaled_fixed_points': scaled_fixed_points[i], 'scaled_moving_points': scaled_moving_points[i]}
+
+def finish_case(case):
+    """
+    Runs the CPU-bound tail of the registration of one FLoRI21 case: the full-resolution warps, the figures and image
+    files of both stages and the landmark errors.
+
+    Parameters:
+    - case (dict or None): The output of `register_case`.
+
+    Returns:
+    - float: Mean landmark error of the case after registration, 10000 if the registration failed.
+
+    Notes:
+        What is written depends on `output_level`; the matrices saved at the 'transforms' level map the working grid
+        (`img_size`) of the moving image onto that of the fixed image.
+    """
+    if case is None:
+        return 10000
+    i = case['index']
+    imgs = case['stage1_images']
+    if output_enabled('transforms'):
+        save_transform(os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Stage1'), str(i), 'Homography_Matrix', case['homography_matrix'])
+    if output_enabled('thumbnails'):
+        # the low-resolution preview of the lazy warp is enough for thumbnails
+        save_intermediate_images(os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Stage1'), str(i), imgs[0], imgs[1], read_image(imgs[2], full_resolution=output_enabled('full')))
+    original_low_res,computed_low_res = case['original_low_res'],case['computed_low_res']
+    imgs,imags,polynomial_matrix_low_res = compute_third_order_polynomial_matrix_and_plot(case['images'][::-1], img_size,original_low_res,computed_low_res,os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Stage2'),str(i),str(2),disp_clip = 0.0,warp_tolerance=warp_tolerance,loss=polynomial_loss)
+    if len(polynomial_matrix_low_res) ==0:
+        return 10000
+    if output_enabled('transforms'):
+        save_transform(os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Stage2'), str(i), 'Polynomial_Matrix', polynomial_matrix_low_res)
+    ## rescaled version for dispaly purposes
+    transformed_points_hom = case['transformed_points_hom']
+    transformed_points_high_res_hom =  coordinates_rescaling(transformed_points_hom,*grid_size(img_size),case['max_image_size'])
+    transformed_points_poly = transform_points_third_order_polynomial(transformed_points_hom, polynomial_matrix_low_res)
+    original_image_point_correspondences(imags,case['moving_image'],img_size, case['scaled_fixed_points'], case['scaled_moving_points'], transformed_points_poly,os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results','Final_Registration_Results'), str(i),disp_clip = 0.0)
+    ### Original Version for computation of errors
+    polynomial_matrix = transform_points_third_order_polynomial_matrix(original_low_res,computed_low_res,img_size,case['max_image_size'],polynomial_loss)
+    bef_error = compute_landmark_error(case['fixed_points'],case['fixed_image_size'],case['moving_points'],case['moving_image_size'],case['max_image_size'])
+    aft_error = compute_landmark_error_fixed_space(polynomial_matrix,case['fixed_points'],transformed_points_high_res_hom,case['max_image_size'],case['fixed_image_size'])
+    print("Mean Landmark Error for Case {0} Before Registration is {1} pixels".format(i,bef_error))
+    print("Mean Landmark Error for Case {0} After Registration is {1} pixels".format(i,aft_error))
+    return aft_error
+
+images,fixed_points,moving_points = data_preprocessing('FLoRI21_DataPort')
+fixed_image_size,moving_image_size,max_image_size,scaled_fixed_points,scaled_moving_points,scaled_original_moving_points  = feature_scaling(images,fixed_points,moving_points,img_size)
+
+landmark_errors = run_cases(range(len(images)), lambda i, prepared: register_case(i,images,fixed_points,moving_points,fixed_image_size,moving_image_size,max_image_size,scaled_fixed_points,scaled_moving_points,prepared), finish_case, case_workers, (lambda i: prefetch_case(images[i])) if case_prefetch else None)
 
 plot_landmark_errors(landmark_errors,os.path.join(os.getcwd(),'FLoRI21_DataPort_Image_Registration_Results'),'All')
 
 compute_plot_Flori21_AUC(landmark_errors,'All')
+
+flush_results()
+print_retry_statistics()